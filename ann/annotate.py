@@ -11,8 +11,10 @@
 
 __author__ = "Vas Vasiliadis <vas@uchicago.edu>"
 
+import dbconn as dbc
 import file_utils as fu
 import utils as u
+import vcfinfo as vi
 
 indicesKnownGenes = [12, 1, 3]  # 12 for gene
 
@@ -91,6 +93,30 @@ def collapseRefSeq(line):
     return ";".join(collapsed)
 
 
+"""CpG island containing a position, queried at most once per variant
+memo is a dict the caller empties for each variant, so the promoter flanks
+of many transcripts around one variant share a single query.
+"""
+
+
+def getCpgIsland(cursor, chr, pos, memo):
+    key = (str(chr), str(pos))
+    if key not in memo:
+        sql = (
+            "select chrom, chromStart, chromEnd, name from "
+            + 'cpgIslandExt where chrom="'
+            + str(chr)
+            + '" AND (chromStart <= '
+            + str(pos)
+            + " AND "
+            + str(pos)
+            + " <= chromEnd);"
+        )
+        cursor.execute(sql)
+        memo[key] = cursor.fetchone()
+    return memo[key]
+
+
 def binarySearchUniqueAndSorted(arg0, key):
     low = 0
     high = len(arg0) - 1
@@ -166,7 +192,7 @@ def getSnpsFromDbSnp(
     inds = getFormatSpecificIndices(format=format)
 
     fh = open(vcf)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -240,7 +266,7 @@ def getSnpsFromDbSnp(
     fh_log.write(f"In dbSNP: {str(var_count)} ({str(ratioInDbSnp)}%)\n")
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -260,7 +286,7 @@ def getBigRefGene(vcf, format="vcf", tmpextin=".1", tmpextout=".2", sep="\t"):
     inds = getFormatSpecificIndices(format=format)
     fh = open(vcf)
 
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     vcf_linenum = 1
 
@@ -382,7 +408,7 @@ def getBigRefGene(vcf, format="vcf", tmpextin=".1", tmpextout=".2", sep="\t"):
         else:
             fh_out.write(line + "\n")
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -421,7 +447,7 @@ def getGenes(
 
     inds = getFormatSpecificIndices(format=format)
     fh = open(vcf)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -437,8 +463,8 @@ def getGenes(
             pos = fields[inds[1]].strip()
             ref = clean_mysql_chars(fields[inds[2]]).strip()
             alt = clean_mysql_chars(fields[inds[3]]).strip()
-            info_field = clean_mysql_chars(fields[7]).strip()
-            this_gene_name = str(u.parse_field(info_field, "name", ";", "="))
+            info_field = vi.InfoField(clean_mysql_chars(fields[7]).strip())
+            this_gene_name = info_field.field("name")
 
             sql = (
                 "select * from "
@@ -459,14 +485,13 @@ def getGenes(
             cursor.execute(sql)
             rows = cursor.fetchall()
             info = []
+            cpg = {}
 
             if len(rows) > 0:
                 cnt = 1
                 for row in rows:
                     # count location
-                    positionType = str(
-                        u.parse_field(info_field, "positionType", ";", "=")
-                    )
+                    positionType = info_field.field("positionType")
 
                     if positionType == "intron":
                         intronic_count = intronic_count + 1
@@ -528,18 +553,7 @@ def getGenes(
                             region = ";".join(exons)
 
                     elif u.isBetween(pos, promoter_plus, txtStart) and (strand == "+"):
-                        sql = (
-                            "select chrom, chromStart, chromEnd, name from "
-                            + 'cpgIslandExt where chrom="'
-                            + str(chr)
-                            + '" AND (chromStart <= '
-                            + str(pos)
-                            + " AND "
-                            + str(pos)
-                            + " <= chromEnd);"
-                        )
-                        cursor.execute(sql)
-                        rows = cursor.fetchone()
+                        rows = getCpgIsland(cursor, chr, pos, cpg)
 
                         if rows is not None:
                             region = "putativePromoterRegion=" + "".join(
@@ -548,19 +562,7 @@ def getGenes(
                             promoter_count = promoter_count + 1
 
                     elif u.isBetween(pos, txtEnd, promoter_minus) and (strand == "-"):
-                        sql = (
-                            "select chrom, chromStart, chromEnd, name from "
-                            + 'cpgIslandExt where chrom="'
-                            + str(chr)
-                            + '" AND (chromStart <= '
-                            + str(pos)
-                            + " AND "
-                            + str(pos)
-                            + " <= chromEnd);"
-                        )
-                        cursor.execute(sql)
-
-                        rows = cursor.fetchone()
+                        rows = getCpgIsland(cursor, chr, pos, cpg)
                         if rows is not None:
                             region = "putativePromoterRegion=" + "".join(
                                 str(rows[3]).split()
@@ -629,7 +631,7 @@ def getGenes(
     fh_out.close()
     fh_log.close()
     fh.close()
-    conn.close()
+    cursor.close()
 
 
 """Method used in INDELS, where bigRefGeneTable is not applicable
@@ -666,7 +668,7 @@ def getExonsEtAl(
 
     inds = getFormatSpecificIndices(format=format)
     fh = open(vcf)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -682,8 +684,8 @@ def getExonsEtAl(
             pos = fields[inds[1]].strip()
             ref = clean_mysql_chars(fields[inds[2]]).strip()
             alt = clean_mysql_chars(fields[inds[3]]).strip()
-            info_field = clean_mysql_chars(fields[7]).strip()
-            this_gene_name = str(u.parse_field(info_field, "name", ";", "="))
+            info_field = vi.InfoField(clean_mysql_chars(fields[7]).strip())
+            this_gene_name = info_field.field("name")
 
             sql = (
                 "select * from "
@@ -703,6 +705,7 @@ def getExonsEtAl(
             cursor.execute(sql)
             rows = cursor.fetchall()
             info = []
+            cpg = {}
             if len(rows) > 0:
                 cnt = 1
                 for row in rows:
@@ -790,18 +793,7 @@ def getExonsEtAl(
                         region = "positionType=utr3"
 
                     elif u.isBetween(pos, promoter_plus, txtStart) and (strand == "+"):
-                        sql = (
-                            "select chrom, chromStart, chromEnd, name "
-                            + 'from cpgIslandExt where chrom="'
-                            + str(chr)
-                            + '" AND (chromStart <= '
-                            + str(pos)
-                            + " AND "
-                            + str(pos)
-                            + " <= chromEnd);"
-                        )
-                        cursor.execute(sql)
-                        rows = cursor.fetchone()
+                        rows = getCpgIsland(cursor, chr, pos, cpg)
 
                         if rows is not None:
                             region = "putativePromoterRegion=" + "".join(
@@ -810,18 +802,7 @@ def getExonsEtAl(
                             promoter_count = promoter_count + 1
 
                     elif u.isBetween(pos, txtEnd, promoter_minus) and (strand == "-"):
-                        sql = (
-                            "select chrom, chromStart, chromEnd, name "
-                            + 'from cpgIslandExt where chrom="'
-                            + str(chr)
-                            + '" AND (chromStart <= '
-                            + str(pos)
-                            + " AND "
-                            + str(pos)
-                            + " <= chromEnd);"
-                        )
-                        cursor.execute(sql)
-                        rows = cursor.fetchone()
+                        rows = getCpgIsland(cursor, chr, pos, cpg)
 
                         if rows is not None:
                             region = "putativePromoterRegion=" + "".join(
@@ -891,7 +872,7 @@ def getExonsEtAl(
     fh_out.close()
     fh_log.close()
     fh.close()
-    conn.close()
+    cursor.close()
 
 
 """Overlap with tfbsConsSites
@@ -942,7 +923,7 @@ def addOverlapWithTfbsConsSites(
     line_count = 0
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
 
     linenum = 1
@@ -1022,7 +1003,7 @@ def addOverlapWithTfbsConsSites(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1048,7 +1029,7 @@ def addOverlapWithGadAll(
     line_count = 0
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1111,7 +1092,7 @@ def addOverlapWithGadAll(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1136,7 +1117,7 @@ def addOverlapWithGwasCatalog(
     line_count = 0
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1201,7 +1182,7 @@ def addOverlapWithGwasCatalog(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1227,7 +1208,7 @@ def addOverlapWitHUGOGeneNomenclature(
     line_count = 0
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1293,7 +1274,7 @@ def addOverlapWitHUGOGeneNomenclature(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1319,7 +1300,7 @@ def addOverlapWithGenomicSuperDups(
     line_count = 0
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1390,7 +1371,7 @@ def addOverlapWithGenomicSuperDups(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1422,7 +1403,7 @@ def addOverlapWithRefGene(
     endName = "txEnd"
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1491,7 +1472,7 @@ def addOverlapWithRefGene(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1524,7 +1505,7 @@ def addOverlapWithCytoband(
         endName = "chromEnd"
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1586,7 +1567,7 @@ def addOverlapWithCytoband(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1612,7 +1593,7 @@ def addOverlapWithCnvDatabase(
     line_count = 0
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1664,7 +1645,7 @@ def addOverlapWithCnvDatabase(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
@@ -1690,7 +1671,7 @@ def addOverlapWithMiRNA(
     line_count = 0
 
     inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
+    conn = dbc.shared()
     cursor = conn.cursor()
     linenum = 1
 
@@ -1750,7 +1731,7 @@ def addOverlapWithMiRNA(
     )
     fh_log.close()
 
-    conn.close()
+    cursor.close()
     fh.close()
     fh_out.close()
 
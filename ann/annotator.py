@@ -6,6 +6,7 @@
 import boto3
 import json
 import os
+import shutil
 import sys
 import time
 #from subprocess import Popen, PIPE
@@ -36,12 +37,45 @@ def mkdirp(directory):
         os.makedirs(directory)
 
 
+def fail_job(dynamo_table, job_id, reason):
+    '''
+    Mark a job that cannot be annotated as failed
+    '''
+    try:
+        dynamo_table.update_item(
+              Key={
+              'job_id': job_id
+              },
+              UpdateExpression= 'SET job_status = :val1',
+              ConditionExpression='job_status = :val2 OR job_status = :val3',
+              ExpressionAttributeValues={
+              ':val1':'FAILED',
+              ':val2':'RUNNING',
+              ':val3':'PENDING'
+              }
+              )
+        print(f"Job {job_id} failed: {reason}")
+    except ClientError as error:
+        print(f"Error in marking job {job_id} as failed! {error}")
+
+
+def download_failed_for_good(error):
+    '''
+    Whether a download error will not go away by retrying (the key is missing
+    or not readable)
+    '''
+    return error.response['Error']['Code'] in ('404', 'NoSuchKey', '403', 'AccessDenied')
+
+
 def handle_requests_queue(s3,dynamo_table, sqs):
 
     # Attempt to read the maximum number of messages from the queue
     # Use long polling - DO NOT use sleep() to wait between polls
     # Added int just to make sure sqs format is honored
-    messages = sqs.receive_messages(MaxNumberOfMessages=int(config['sqs']['MaxMessages']), WaitTimeSeconds=int(config['sqs']['WaitTime']))    
+    # Messages stay invisible while their job runs (run.py extends this)
+    # Their receive count tells how many times a job was attempted already
+    messages = sqs.receive_messages(MaxNumberOfMessages=int(config['sqs']['MaxMessages']), WaitTimeSeconds=int(config['sqs']['WaitTime']), VisibilityTimeout=int(config['sqs']['VisibilityTimeout']), AttributeNames=['ApproximateReceiveCount'])    
+    max_deliveries = int(config['sqs']['MaxDeliveries'])
 
     # Process messages received
     if len(messages) > 0:
@@ -55,6 +89,37 @@ def handle_requests_queue(s3,dynamo_table, sqs):
         key = sns_parameters['s3_key_input_file'] 
         bucket = sns_parameters['s3_inputs_bucket']
         user_role = sns_parameters['user_role']
+        profile = sns_parameters.get('profile', '')
+        deliveries = int(message.attributes.get('ApproximateReceiveCount', 1))
+
+        # A job whose message keeps coming back keeps failing: stop retrying it
+        if deliveries > max_deliveries:
+            fail_job(dynamo_table, job_id, f"{deliveries - 1} attempts failed")
+            message.delete()
+            shutil.rmtree(os.path.join(os.getcwd(),jobs_folder,'id_'+str(job_id)), ignore_errors=True)
+            continue
+
+        # Mark the job as running; a job already RUNNING is a redelivery of
+        # one whose annotator died, and resumes from its checkpoint
+        try:
+            dynamo_table.update_item(
+                  Key={
+                  'job_id': job_id
+                  },
+                  UpdateExpression= 'SET job_status = :val1',
+                  ConditionExpression='job_status = :val1 OR job_status = :val2',
+                  ExpressionAttributeValues={
+                  ':val1':'RUNNING',
+                  ':val2':'PENDING'
+                  }
+                  )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Completed (or archived) already, nothing left to do
+            message.delete()
+            print(f"Job {job_id} is not pending or running, message deleted")
+            continue
 
         # Create a local temp folder to save job file from S3
         current_dir = os.getcwd()
@@ -65,35 +130,60 @@ def handle_requests_queue(s3,dynamo_table, sqs):
         local_path = os.path.join(new_job_path,filename)
 
         # Error handling: Key is not valid
+        download_start = time.time()
         try:
             s3.download_file(bucket,key,local_path)
         except ClientError as error:
             # Handle exceptions and return an error response
             out_response = f"Key seems to invalid. {error}"
             print(out_response)
+            # There is nothing to annotate: a missing input fails the job, any
+            # other error leaves the message to be redelivered
+            if download_failed_for_good(error):
+                fail_job(dynamo_table, job_id, "input file could not be downloaded")
+                message.delete()
+            shutil.rmtree(new_job_path, ignore_errors=True)
+            continue
+
+        # Optional side files: a BED of target regions, and a tabix index
+        # that goes next to the input, where the driver looks for it
+        targets_path = ""
+        side_files = []
+        if 's3_key_targets_file' in sns_parameters:
+            targets_path = os.path.join(new_job_path,'targets.bed')
+            side_files.append((sns_parameters['s3_key_targets_file'], targets_path))
+        if 's3_key_index_file' in sns_parameters:
+            side_files.append((sns_parameters['s3_key_index_file'], local_path + '.tbi'))
+        # Without its targets a job would annotate the whole input, so a
+        # failed targets download is handled as a failed input download;
+        # without the index the input is just read in full
+        targets_failed = False
+        for side_key, side_path in side_files:
+            try:
+                s3.download_file(bucket,side_key,side_path)
+            except ClientError as error:
+                print(f"Key seems to invalid. {error}")
+                if side_path == targets_path:
+                    targets_failed = True
+                    if download_failed_for_good(error):
+                        fail_job(dynamo_table, job_id, "targets file could not be downloaded")
+                        message.delete()
+                    break
+        if targets_failed:
+            shutil.rmtree(new_job_path, ignore_errors=True)
+            continue
 
         # Launch annotation job as a background process
         # Note: Error handling for <file does not have vcf format> has been handled in run.py
         # Define path of run.py file  
         run_path = os.path.join(current_dir,"run.py")
-        command = ["python", run_path, local_path, key, job_id, user_id, user_role]
+        # The download time is passed on for the job log
+        download_seconds = f"{time.time() - download_start:.3f}"
+        # run.py deletes the message once the job is over; on the last
+        # delivery, it fails the job rather than leave it for a retry
+        command = ["python", run_path, local_path, key, job_id, user_id, user_role, download_seconds, targets_path, profile, message.queue_url, message.receipt_handle, str(deliveries >= max_deliveries)]
         process = subprocess.Popen(command)
-
-        # Update the Dynamo table if job status is pending
-        dynamo_table.update_item(
-              Key={
-              'job_id': job_id
-              },
-              UpdateExpression= 'SET job_status = :val1',
-              ConditionExpression='job_status = :val2',  
-              ExpressionAttributeValues={
-              ':val1':'RUNNING',
-              ':val2':'PENDING'
-              }
-              )
-        # Delete message from queue if job was successfully submitted
-        message.delete()
-        print(f"Message with job_id {job_id} deleted successfully!")
+        print(f"Job {job_id} submitted")
 
 
 def main():
@@ -0,0 +1,18 @@
+# benchmark
+#
+# Offline end-to-end benchmarks of the annotation pipeline
+#
+#   genome.py     - deterministic synthetic genes and known SNP sites
+#   vcfgen.py     - synthetic VCF inputs of any size and sortedness
+#   reference.py  - synthetic reference tables, snapshot and Bloom filter
+#   runner.py     - times driver.run per scenario and per stage
+#
+# Run from the ann directory, e.g.
+#   python -m benchmark.runner /tmp/gas-bench 1000000 1.0
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+### EOF
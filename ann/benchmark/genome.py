@@ -0,0 +1,158 @@
+# genome.py
+#
+# Deterministic synthetic genome layout shared by the benchmark generators
+#
+# The synthetic VCFs and reference tables have to agree on where the genes
+# and the known SNPs are, or no lookup would ever hit. A Genome lays both
+# out per chromosome of hg19 from a seed and a scale (at 1.0, about 25,000
+# transcripts and 900,000 known SNPs genome-wide), lazily and reproducibly,
+# so the VCF generator and the reference builder see the same layout
+# without sharing any files.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import random
+
+# hg19 chromosome lengths
+CHROM_LENGTHS = {
+    "1": 249250621,
+    "2": 243199373,
+    "3": 198022430,
+    "4": 191154276,
+    "5": 180915260,
+    "6": 171115067,
+    "7": 159138663,
+    "8": 146364022,
+    "9": 141213431,
+    "10": 135534747,
+    "11": 135006516,
+    "12": 133851895,
+    "13": 115169878,
+    "14": 107349540,
+    "15": 102531392,
+    "16": 90354753,
+    "17": 81195210,
+    "18": 78077248,
+    "19": 59128983,
+    "20": 63025520,
+    "21": 48129895,
+    "22": 51304566,
+    "X": 155270560,
+    "Y": 59373566,
+}
+
+# Features per megabase at scale 1.0
+GENES_PER_MB = 8
+SNPS_PER_MB = 300
+
+BASES = "ACGT"
+
+
+"""One synthetic transcript; exons are half-open [start, end) like refGene's
+"""
+
+
+class Gene(object):
+    def __init__(self, name, name2, strand, exons, coding, rng):
+        self.name = name
+        self.name2 = name2
+        self.strand = strand
+        self.exons = exons
+        self.txStart = exons[0][0]
+        self.txEnd = exons[-1][1]
+        if coding and len(exons) > 1:
+            self.cdsStart = rng.randint(exons[0][0], exons[0][1] - 1)
+            self.cdsEnd = rng.randint(exons[-1][0] + 1, exons[-1][1])
+        elif coding:
+            middle = (self.txStart + self.txEnd) // 2
+            self.cdsStart = rng.randint(self.txStart, middle)
+            self.cdsEnd = rng.randint(self.cdsStart + 1, self.txEnd)
+        else:
+            # refGene marks non-coding transcripts with cdsStart == cdsEnd
+            self.cdsStart = self.cdsEnd = self.txEnd
+
+
+"""Genes and known SNP sites of every chromosome, for one seed and scale
+chroms limits the genome to some chromosomes, for small benchmarks.
+"""
+
+
+class Genome(object):
+    def __init__(self, seed=1, scale=1.0, chroms=None):
+        self.seed = seed
+        self.scale = scale
+        self.names = [c for c in CHROM_LENGTHS if chroms is None or c in chroms]
+        self.gene_cache = {}
+        self.snp_cache = {}
+
+    def chroms(self):
+        return list(self.names)
+
+    def length(self, chrom):
+        return CHROM_LENGTHS[chrom]
+
+    def rng(self, chrom, what):
+        return random.Random(f"{self.seed}:{chrom}:{what}")
+
+    def count(self, chrom, per_mb):
+        return max(1, int(self.length(chrom) / 1e6 * per_mb * self.scale))
+
+    """Transcripts of a chromosome in txStart order: median span about 20 kb,
+    mostly 3-15 exons, one in five non-coding
+    """
+
+    def genes(self, chrom):
+        if chrom not in self.gene_cache:
+            rng = self.rng(chrom, "genes")
+            genes = []
+            for i in range(self.count(chrom, GENES_PER_MB)):
+                span = min(int(rng.lognormvariate(9.9, 1.0)) + 500, 2000000)
+                start = rng.randint(1, self.length(chrom) - span - 1)
+                exonCount = min(1 + int(rng.expovariate(1 / 8.0)), 60)
+                slots = range(start + 1, start + span)
+                cuts = sorted(rng.sample(slots, 2 * exonCount - 2))
+                bounds = [start] + cuts + [start + span]
+                exons = []
+                for e in range(exonCount):
+                    exStart, exEnd = bounds[2 * e], bounds[2 * e + 1]
+                    # Exons of about 150 bp, inside their slot
+                    exEnd = min(exEnd, exStart + 50 + int(rng.expovariate(1 / 150.0)))
+                    exons.append((exStart, max(exEnd, exStart + 1)))
+                name2 = f"SYN{chrom}_{i // 2}"
+                genes.append(
+                    Gene(
+                        f"NM_{chrom}{i:06d}",
+                        name2,
+                        rng.choice("+-"),
+                        exons,
+                        rng.random() >= 0.2,
+                        rng,
+                    )
+                )
+            genes.sort(key=lambda g: g.txStart)
+            self.gene_cache[chrom] = genes
+        return self.gene_cache[chrom]
+
+    """Known SNP sites of a chromosome: sorted (pos, ref, alt), distinct
+    positions, uniform over the chromosome
+    """
+
+    def snps(self, chrom):
+        if chrom not in self.snp_cache:
+            rng = self.rng(chrom, "snps")
+            count = self.count(chrom, SNPS_PER_MB)
+            length = self.length(chrom)
+            positions = sorted(set([rng.randint(1, length) for i in range(count)]))
+            sites = []
+            for pos in positions:
+                ref = rng.choice(BASES)
+                alt = rng.choice(BASES.replace(ref, ""))
+                sites.append((pos, ref, alt))
+            self.snp_cache[chrom] = sites
+        return self.snp_cache[chrom]
+
+
+### EOF
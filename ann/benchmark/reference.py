@@ -0,0 +1,366 @@
+# reference.py
+#
+# Synthetic reference tables for the benchmarks
+#
+# Builds every table annotate.py queries (dbSNP, the three bigRefGene
+# tables, refGene, cpgIslandExt, cytoBand, gadAll, gwasCatalog, hugo, the
+# four CNV tables, genomicSuperDups, targetScanS and the per-chromosome
+# tfbsConsSites tables) from a genome.Genome, with the columns the stages
+# read, into a local SQLite replica of the annotator MySQL database (see
+# refdb.py). From it, the reference snapshot (see snapshot.py) and dbSNP
+# Bloom filter (see bloom.py) are built with their usual builders, so the
+# benchmarks run the stages exactly as production does with ReferenceDb,
+# SnapshotDir or BloomDir set, and never need a database server or network.
+#
+# Layout of <root>:
+#   reference.db        - the SQLite replica
+#   snapshot/           - reference snapshot root
+#   bloom/              - dbSNP Bloom filter root
+#
+# Usage: python -m benchmark.reference <root> [scale] [seed]
+# (run from the ann directory)
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import sys
+import time
+import bisect
+import sqlite3
+
+import bloom as bl
+import refdb as rd
+import snapshot as sn
+from benchmark import genome as gn
+
+# Features per megabase at scale 1.0 of the tables not derived from genes
+CNV_PER_MB = {
+    "dgv_Cnv": 20,
+    "abParts_IG_T_CelReceptors": 0.02,
+    "mcCarroll_Cnv": 0.5,
+    "conrad_Cnv": 3,
+}
+SUPERDUPS_PER_MB = 15
+TFBS_PER_MB = 100
+CYTOBAND_LENGTH = 3500000
+
+BIGREFGENE_COLUMNS = [
+    "id", "CHR", "start", "end", "haplotypeReference", "haplotypeAlternate",
+    "name", "name2", "transcriptStrand", "positionType", "frame", "mrnaCoord",
+    "codonCoord", "spliceDist", "referenceCodon", "referenceAA", "variantCodon",
+    "variantAA", "changesAA", "functionalClass", "codingCoordStr",
+    "proteinCoordStr", "inCodingRegion", "spliceInfo", "uorfChange",
+]
+
+SCHEMAS = {
+    "dbSNP": "CHR, POS integer, ID, RSID, REF, ALT, QUAL, GMAF, INFO",
+    "refGene": "bin integer, name, chrom, strand, txStart integer, txEnd integer, "
+    + "cdsStart integer, cdsEnd integer, exonCount integer, exonStarts blob, "
+    + "exonEnds blob, score integer, name2, cdsStartStat, cdsEndStat, exonFrames blob",
+    "cpgIslandExt": "chrom, chromStart integer, chromEnd integer, name",
+    "cytoBand": "chrom, chromStart integer, chromEnd integer, name, gieStain",
+    "gadAll": "chromosome, chromStart integer, chromEnd integer, geneSymbol",
+    "gwasCatalog": "bin integer, chrom, chromStart integer, chromEnd integer, name, "
+    + "pubMedID, author, pubDate, journal, title, trait",
+    "hugo": "chrom, chromStart integer, chromEnd integer, hgncId, locusType, "
+    + "symbol, description",
+    "genomicSuperDups": "bin integer, chrom, chromStart integer, chromEnd integer, "
+    + "name, score integer, strand, otherChrom, otherStart integer, otherEnd integer",
+    "targetScanS": "bin integer, chrom, chromStart integer, chromEnd integer, name, "
+    + "score integer, strand",
+}
+CNV_SCHEMA = "bin integer, chrom, chromStart integer, chromEnd integer, name"
+TFBS_SCHEMA = (
+    "bin integer, chrom, chromStart integer, chromEnd integer, name, "
+    + "score integer, strand, zScore real"
+)
+BIGREFGENE_TABLES = [
+    "chrom_pos_equal_base",
+    "chrom_pos_equal_nobase",
+    "chrom_pos_unequal",
+]
+
+
+"""Columns of a schema with the untyped (text) ones compared case-insensitively,
+as refdb.create_table() makes them
+"""
+
+
+def nocase(schema):
+    columns = [c.strip() for c in schema.split(",")]
+    return ", ".join([c if " " in c else c + " collate nocase" for c in columns])
+
+
+def create_tables(conn):
+    for table, schema in SCHEMAS.items():
+        conn.execute(f"create table {table} ({nocase(schema)})")
+    for table in CNV_PER_MB:
+        conn.execute(f"create table {table} ({nocase(CNV_SCHEMA)})")
+    for table in BIGREFGENE_TABLES:
+        columns = ", ".join(
+            [
+                c + " integer" if c in ("id", "start", "end") else c
+                for c in BIGREFGENE_COLUMNS
+            ]
+        )
+        conn.execute(f"create table {table} ({nocase(columns)})")
+    # tfbsConsSites is split per chromosome; all of them must exist
+    for chrom in sn.TFBS_CHROMS:
+        conn.execute(f"create table {sn.TFBS_TABLE}{chrom} ({nocase(TFBS_SCHEMA)})")
+
+
+def insert(conn, table, rows):
+    if len(rows) > 0:
+        marks = ",".join(["?"] * len(rows[0]))
+        conn.executemany(f"insert into {table} values ({marks})", rows)
+
+
+def intervals(rng, chrom, length, count, min_len, max_len):
+    spans = []
+    for i in range(count):
+        size = rng.randint(min_len, max_len)
+        start = rng.randint(0, length - size)
+        spans.append((start, start + size))
+    return spans
+
+
+"""Rows of the gene-derived tables of one chromosome
+"""
+
+
+def gene_rows(genome, chrom, rng):
+    tables = ["refGene", "cpgIslandExt", "gadAll", "hugo", "targetScanS"]
+    rows = {table: [] for table in tables}
+    for gene in genome.genes(chrom):
+        starts = "".join([str(s) + "," for s, e in gene.exons]).encode("utf-8")
+        ends = "".join([str(e) + "," for s, e in gene.exons]).encode("utf-8")
+        frames = ",".join(["0"] * len(gene.exons)).encode("utf-8") + b","
+        rows["refGene"].append(
+            (
+                0, gene.name, "chr" + chrom, gene.strand, gene.txStart, gene.txEnd,
+                gene.cdsStart, gene.cdsEnd, len(gene.exons), starts, ends, 0,
+                gene.name2, "cmpl", "cmpl", frames,
+            )
+        )
+
+        tss = gene.txStart if gene.strand == "+" else gene.txEnd
+        if rng.random() < 0.6:
+            start = max(0, tss - rng.randint(200, 1500))
+            end = tss + rng.randint(200, 1500)
+            name = f"CpG: {rng.randint(20, 150)}"
+            rows["cpgIslandExt"].append(("chr" + chrom, start, end, name))
+        if rng.random() < 0.3:
+            rows["gadAll"].append((chrom, gene.txStart, gene.txEnd, gene.name2))
+        if gene.name.endswith(("0", "2", "4", "6", "8")):
+            rows["hugo"].append(
+                (
+                    "chr" + chrom,
+                    gene.txStart,
+                    gene.txEnd,
+                    "HGNC:" + gene.name[3:],
+                    "gene with protein product",
+                    gene.name2,
+                    f"synthetic gene {gene.name2}",
+                )
+            )
+        if gene.cdsStart != gene.cdsEnd:
+            # miRNA sites in the 3' UTR
+            if gene.strand == "+":
+                utr = (gene.cdsEnd, gene.txEnd)
+            else:
+                utr = (gene.txStart, gene.cdsStart)
+            for i in range(2):
+                if utr[1] - utr[0] > 8:
+                    start = rng.randint(utr[0], utr[1] - 8)
+                    name = f"MIR{rng.randint(1, 500)}"
+                    rows["targetScanS"].append(
+                        (0, "chr" + chrom, start, start + 8, name, 90, gene.strand)
+                    )
+    return rows
+
+
+"""Rows of the bigRefGene tables of one chromosome: per-base changes at known
+SNPs inside genes, position-only entries and ranges over exons
+"""
+
+
+def bigrefgene_rows(genome, chrom, rng, next_id):
+    genes = genome.genes(chrom)
+    starts = [g.txStart for g in genes]
+    rows = {table: [] for table in BIGREFGENE_TABLES}
+
+    def row(pos, end, ref, alt, gene):
+        positionType = rng.choice(["CDS", "intron", "utr3", "utr5"])
+        coding = positionType == "CDS"
+        functionalClass = "none"
+        if coding:
+            functionalClass = rng.choice(["missense", "silent", "nonsense"])
+        values = [
+            next_id[0], chrom, pos, end, ref, alt, gene.name, gene.name2,
+            gene.strand, positionType, rng.choice([0, 1, 2]),
+            str(pos - gene.txStart), str((pos - gene.txStart) // 3),
+            str(rng.randint(-20, 20)), "", "", "", "",
+            "false" if not coding else rng.choice(["true", "false"]),
+            functionalClass, "c." + str(pos - gene.txStart), "", str(coding).lower(),
+            "", "",
+        ]
+        next_id[0] = next_id[0] + 1
+        return tuple(values)
+
+    for pos, ref, alt in genome.snps(chrom):
+        i = bisect.bisect_right(starts, pos) - 1
+        if i < 0 or pos > genes[i].txEnd:
+            continue
+        r = rng.random()
+        if r < 0.5:
+            rows["chrom_pos_equal_base"].append(row(pos, pos, ref, alt, genes[i]))
+        elif r < 0.7:
+            rows["chrom_pos_equal_nobase"].append(row(pos, pos, ref, "", genes[i]))
+
+    for gene in genes:
+        if rng.random() < 0.3:
+            for start, end in gene.exons:
+                rows["chrom_pos_unequal"].append(row(start + 1, end, "", "", gene))
+    return rows
+
+
+"""Rows of the tables not tied to genes of one chromosome
+"""
+
+
+def other_rows(genome, chrom, rng):
+    length = genome.length(chrom)
+    rows = {}
+    rows["dbSNP"] = [
+        (
+            chrom, pos, ".", f"rs{chrom}{pos}", ref, alt, ".",
+            f"{rng.random() / 2:.4f}" if rng.random() < 0.7 else ".", "SNV",
+        )
+        for pos, ref, alt in genome.snps(chrom)
+    ]
+    rows["gwasCatalog"] = [
+        (
+            0,
+            "chr" + chrom,
+            pos - 1,
+            pos,
+            f"rs{chrom}{pos}",
+            str(20000000 + pos % 9999991),
+            "Author",
+            "2012-01-01",
+            "Journal",
+            "Synthetic study",
+            f"Trait {rng.randint(1, 300)}",
+        )
+        for pos, ref, alt in genome.snps(chrom)
+        if rng.random() < 0.03
+    ]
+
+    bands = []
+    start = 0
+    while start < length:
+        size = rng.randint(CYTOBAND_LENGTH // 2, CYTOBAND_LENGTH * 3 // 2)
+        end = min(length, start + size)
+        arm = "p" if start < length * 0.4 else "q"
+        name = f"{arm}{len(bands) + 11}.{rng.randint(1, 3)}"
+        stain = rng.choice(["gneg", "gpos25", "gpos50", "gpos75", "gpos100"])
+        bands.append(("chr" + chrom, start, end, name, stain))
+        start = end
+    rows["cytoBand"] = bands
+
+    for table, per_mb in CNV_PER_MB.items():
+        count = int(length / 1e6 * per_mb * genome.scale)
+        spans = intervals(rng, chrom, length, count, 1000, 200000)
+        rows[table] = [
+            (0, "chr" + chrom, s, e, f"{table}_{chrom}_{i}")
+            for i, (s, e) in enumerate(spans)
+        ]
+
+    count = genome.count(chrom, SUPERDUPS_PER_MB)
+    rows["genomicSuperDups"] = []
+    for s, e in intervals(rng, chrom, length, count, 1000, 100000):
+        other = rng.choice(genome.chroms())
+        otherStart = rng.randint(0, genome.length(other) - (e - s))
+        rows["genomicSuperDups"].append(
+            (
+                0, "chr" + chrom, s, e, f"chr{other}:{otherStart}", 1000,
+                rng.choice("+-"), "chr" + other, otherStart, otherStart + e - s,
+            )
+        )
+
+    count = genome.count(chrom, TFBS_PER_MB)
+    rows[sn.TFBS_TABLE + chrom] = [
+        (0, "chr" + chrom, s, e, f"V$TF{rng.randint(1, 250)}", 800, "+", 2.5)
+        for s, e in intervals(rng, chrom, length, count, 10, 30)
+    ]
+    return rows
+
+
+"""Fill a new SQLite database at path with the tables of genome
+"""
+
+
+def build_database(path, genome):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    create_tables(conn)
+    next_id = [1]
+    for chrom in genome.chroms():
+        start = time.time()
+        rng = genome.rng(chrom, "reference")
+        rows = gene_rows(genome, chrom, rng)
+        rows.update(bigrefgene_rows(genome, chrom, rng, next_id))
+        rows.update(other_rows(genome, chrom, rng))
+        for table in rows:
+            insert(conn, table, rows[table])
+        conn.commit()
+        total = sum([len(r) for r in rows.values()])
+        print(f"chr{chrom}: {total} rows in {time.time() - start:.2f} seconds")
+    return conn
+
+
+"""Build the replica, snapshot and Bloom filter of a synthetic genome under
+root; returns the paths of the snapshot and Bloom filter roots and of the
+replica
+"""
+
+
+def build(root, genome):
+    os.makedirs(root, exist_ok=True)
+    replica = os.path.join(root, "reference.db")
+    conn = build_database(replica, genome)
+    try:
+        snapshot_root = os.path.join(root, "snapshot")
+        bloom_root = os.path.join(root, "bloom")
+        sn.build(conn, snapshot_root)
+        bl.build(conn, bloom_root)
+        rd.index_tables(conn)
+    finally:
+        conn.close()
+    return snapshot_root, bloom_root, replica
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python -m benchmark.reference <root> [scale] [seed]")
+        sys.exit(1)
+
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    snapshot_root, bloom_root, replica = build(
+        sys.argv[1], gn.Genome(seed=seed, scale=scale)
+    )
+    print(f"Reference snapshot written to {snapshot_root}")
+    print(f"dbSNP Bloom filter written to {bloom_root}")
+    print(f"Reference replica written to {replica}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+### EOF
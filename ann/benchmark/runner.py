@@ -0,0 +1,282 @@
+# runner.py
+#
+# End-to-end annotation benchmarks
+#
+# Builds (once) the synthetic reference of a genome scale and a synthetic
+# VCF of the requested size, then runs driver.run over it once per scenario:
+# the configured pipeline, one lookup per variant, stages on threads, byte
+# ranges on processes, the dbSNP Bloom filter, the minimal profile, BGZF
+# output, a partly unsorted input (as is, and sorted first, see extsort.py)
+# and lookups in the SQLite replica instead of the snapshot. Every run
+# happens in its own forked process, so its peak resident memory is its own;
+# the per-stage times and query counts come from the metrics report each run
+# writes (see metrics.py). The stages read
+# the reference snapshot or replica, so nothing here touches the network or
+# a database server.
+#
+# Results are printed as tables and written to <workdir>/results.json.
+#
+# Usage: python -m benchmark.runner <workdir> <lines> [scale] [chroms] [scenarios]
+# (run from the ann directory; chroms and scenarios are comma-separated,
+# "all" for every one)
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import sys
+import json
+import time
+import shutil
+import traceback
+from configparser import ConfigParser, ExtendedInterpolation
+
+import driver
+import metrics as mt
+from benchmark import genome as gn
+from benchmark import vcfgen as vg
+from benchmark import reference as rf
+
+# Share of the records of the "unsorted" input left in place
+UNSORTED = 0.9
+
+# Scenario name, input ("sorted" or "unsorted") and the driver.RunOptions
+# changed from the configured ones
+SCENARIOS = [
+    ("configured", "sorted", {}),
+    ("per-variant", "sorted", {"batch_size": 1, "indexed_tables": ()}),
+    ("serial-stages", "sorted", {"stage_workers": 0}),
+    ("chunked", "sorted", {"workers": 4, "min_chunk": 1 << 20}),
+    ("bloom", "sorted", {"bloom_dir": True}),
+    ("minimal", "sorted", {"profile": "minimal"}),
+    ("compressed", "sorted", {"compress_output": True}),
+    ("unsorted", "unsorted", {}),
+    ("sorted-first", "unsorted", {"sort_input": True, "keep_order": True}),
+    ("replica", "sorted", {"reference_db": True}),
+]
+
+
+def read_config():
+    config = ConfigParser(os.environ, interpolation=ExtendedInterpolation())
+    config.read("annotator_config.ini")
+    return config
+
+
+def config_list(config, option):
+    return [t.strip() for t in config["ann"][option].split(",") if t.strip()]
+
+
+"""driver.RunOptions of the configured pipeline, reading the synthetic
+snapshot and without the host-wide variant cache
+"""
+
+
+def base_options(config, snapshot_dir):
+    return {
+        "indexed_tables": config_list(config, "IndexedTables"),
+        "sweep_tables": config_list(config, "SweepTables"),
+        "batch_size": config.getint("ann", "BatchSize"),
+        "block_lines": config.getint("ann", "BlockLines"),
+        "stage_workers": config.getint("ann", "StageWorkers"),
+        "workers": 1,
+        "min_chunk": config.getint("ann", "MinChunkBytes"),
+        "sort_memory": config.getint("ann", "SortMemoryBytes"),
+        "compress_output": False,
+        "compress_threads": config.getint("ann", "CompressThreads"),
+        "snapshot_dir": snapshot_dir,
+        "bloom_dir": None,
+        "cache_path": None,
+    }
+
+
+def scenario_options(config, options, changes, reference):
+    snapshot_root, bloom_root, replica = reference
+    options = dict(options)
+    options.update(changes)
+    if changes.get("bloom_dir"):
+        options["bloom_dir"] = bloom_root
+    if changes.get("reference_db"):
+        options["snapshot_dir"] = None
+        options["reference_db"] = replica
+    if changes.get("profile"):
+        options["stage_names"] = config["profiles"][changes["profile"]].split(",")
+    return options
+
+
+def genome_tag(scale, chroms):
+    return f"{scale:g}-" + ("all" if chroms is None else "_".join(chroms))
+
+
+"""Snapshot and Bloom filter roots and replica of the synthetic reference,
+built if missing
+"""
+
+
+def prepare_reference(workdir, genome, tag):
+    root = os.path.join(workdir, "reference-" + tag)
+    snapshot_root = os.path.join(root, "snapshot")
+    bloom_root = os.path.join(root, "bloom")
+    replica = os.path.join(root, "reference.db")
+    if not os.path.exists(os.path.join(snapshot_root, "CURRENT")):
+        print(f"Building the synthetic reference in {root} . . .")
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        rf.build(root, genome)
+    return snapshot_root, bloom_root, replica
+
+
+def prepare_input(workdir, genome, tag, lines, sortedness):
+    path = os.path.join(workdir, f"input-{tag}-{lines}-{sortedness:g}.vcf")
+    if not os.path.exists(path):
+        print(f"Writing {lines} variants to {path} . . .")
+        vg.generate(
+            path + ".tmp", lines, genome, sortedness=sortedness, seed=genome.seed
+        )
+        os.rename(path + ".tmp", path)
+    return path
+
+
+"""Run one scenario in a forked process over a link to infile in rundir
+Returns the run's wall seconds, peak resident memory (KiB) and metrics report.
+"""
+
+
+def run_scenario(infile, rundir, options):
+    if os.path.exists(rundir):
+        shutil.rmtree(rundir)
+    os.makedirs(rundir)
+    path = os.path.join(rundir, "input.vcf")
+    os.symlink(os.path.abspath(infile), path)
+
+    sys.stdout.flush()
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            sys.stdout = open(os.path.join(rundir, "driver.out"), "w")
+            driver.run(path, "vcf", driver.RunOptions(**options))
+        except Exception:
+            traceback.print_exc(file=sys.__stderr__)
+            status = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(status)
+
+    pid, status, usage = os.wait4(pid, 0)
+    seconds = time.time() - start
+    if status != 0:
+        raise RuntimeError(f"Benchmark run in {rundir} failed")
+    with open(mt.report_name(path)) as fh:
+        report = json.load(fh)
+    return seconds, usage.ru_maxrss, report
+
+
+def print_summary(results):
+    print()
+    print(
+        f"{'scenario':<16}{'variants':>10}{'seconds':>10}"
+        + f"{'variants/s':>12}{'peak MiB':>10}"
+    )
+    for result in results:
+        print(
+            f"{result['scenario']:<16}{result['variants']:>10}"
+            + f"{result['wall_seconds']:>10.2f}{result['variants_per_second']:>12.1f}"
+            + f"{result['max_rss_kib'] / 1024:>10.1f}"
+        )
+
+
+def print_stages(result):
+    print()
+    print(f"{result['scenario']}: per stage")
+    print(
+        f"{'stage':<28}{'wall s':>9}{'cpu s':>9}"
+        + f"{'queries':>10}{'rows':>10}{'cache':>8}"
+    )
+    for stage in result["stages"]:
+        print(
+            f"{stage['name'] or stage['label']:<28}{stage['wall_seconds']:>9.2f}"
+            + f"{stage['cpu_seconds']:>9.2f}{stage['db_queries']:>10}"
+            + f"{stage['db_rows']:>10}{stage['cache_hits']:>8}"
+        )
+
+
+"""Run the named scenarios over a synthetic input of lines variants
+"""
+
+
+def benchmark(workdir, lines, scale=1.0, chroms=None, names=None):
+    config = read_config()
+    genome = gn.Genome(scale=scale, chroms=chroms)
+    tag = genome_tag(scale, chroms)
+    os.makedirs(workdir, exist_ok=True)
+    reference = prepare_reference(workdir, genome, tag)
+    options = base_options(config, reference[0])
+    inputs = {
+        "sorted": prepare_input(workdir, genome, tag, lines, 1.0),
+        "unsorted": prepare_input(workdir, genome, tag, lines, UNSORTED),
+    }
+
+    results = []
+    for name, kind, changes in SCENARIOS:
+        if names is not None and name not in names:
+            continue
+        print(f"Running {name} . . .")
+        run_options = scenario_options(config, options, changes, reference)
+        rundir = os.path.join(workdir, "runs", name)
+        seconds, max_rss, report = run_scenario(inputs[kind], rundir, run_options)
+        variants = report["job"]["variants"]
+        results.append(
+            {
+                "scenario": name,
+                "input": kind,
+                "options": changes,
+                "variants": variants,
+                "wall_seconds": round(seconds, 3),
+                "variants_per_second": mt.rate(variants, seconds),
+                "max_rss_kib": max_rss,
+                "job": report["job"],
+                "stages": report["stages"],
+            }
+        )
+
+    print_summary(results)
+    for result in results:
+        print_stages(result)
+    summary = {
+        "lines": lines,
+        "scale": scale,
+        "chroms": genome.chroms(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    mt.write_report(os.path.join(workdir, "results.json"), summary)
+    return results
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(
+            "Usage: python -m benchmark.runner <workdir> <lines> "
+            + "[scale] [chroms] [scenarios]"
+        )
+        sys.exit(1)
+
+    scale = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    chroms = None
+    if len(sys.argv) > 4 and sys.argv[4] != "all":
+        chroms = sys.argv[4].split(",")
+    names = None
+    if len(sys.argv) > 5 and sys.argv[5] != "all":
+        names = sys.argv[5].split(",")
+    benchmark(sys.argv[1], int(sys.argv[2]), scale=scale, chroms=chroms, names=names)
+    print(f"Results written to {os.path.join(sys.argv[1], 'results.json')}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+### EOF
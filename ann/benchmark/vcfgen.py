@@ -0,0 +1,185 @@
+# vcfgen.py
+#
+# Synthetic VCF inputs for the benchmarks
+#
+# Writes a single-sample VCF of any number of lines (10k to 10M and more)
+# over the hg19 chromosomes of a genome.Genome. Chromosomes get lines in
+# proportion to their length; within one, a variant is a known SNP of the
+# genome (so dbSNP and the other exact-match tables hit), falls in or near
+# one of its genes, or lies anywhere on the chromosome. Most variants are
+# SNVs, the rest short indels. The file comes out sorted unless sortedness
+# is below 1, see disorder().
+#
+# Usage: python -m benchmark.vcfgen <out.vcf> <lines> [sortedness] [seed] [scale]
+# (run from the ann directory; seed and scale must match the reference
+# tables' for the lookups to hit)
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import sys
+import random
+
+from benchmark import genome as gn
+
+# Share of variants at known SNPs and in or near genes; the rest are uniform
+KNOWN_FRACTION = 0.3
+GENIC_FRACTION = 0.4
+INDEL_FRACTION = 0.1
+
+# chrY carries few calls in most samples
+WEIGHTS = {"Y": 0.2}
+
+# Displaced records wait in a pool of this many before they are written
+WINDOW = 100000
+
+
+"""Lines per chromosome, in proportion to length times weight
+"""
+
+
+def chrom_counts(genome, lines):
+    weights = [genome.length(c) * WEIGHTS.get(c, 1.0) for c in genome.chroms()]
+    total = sum(weights)
+    counts = [int(lines * w / total) for w in weights]
+    for i in range(lines - sum(counts)):
+        counts[i % len(counts)] = counts[i % len(counts)] + 1
+    return dict(zip(genome.chroms(), counts))
+
+
+def alleles(rng):
+    ref = rng.choice(gn.BASES)
+    if rng.random() >= INDEL_FRACTION:
+        return ref, rng.choice(gn.BASES.replace(ref, ""))
+    extra = "".join([rng.choice(gn.BASES) for i in range(rng.randint(1, 6))])
+    if rng.random() < 0.5:
+        return ref + extra, ref
+    return ref, ref + extra
+
+
+"""(pos, ref, alt) of the variants of one chromosome, sorted by position
+"""
+
+
+def chrom_variants(genome, chrom, count, rng):
+    snps = genome.snps(chrom)
+    genes = genome.genes(chrom)
+    length = genome.length(chrom)
+    variants = []
+    for i in range(count):
+        r = rng.random()
+        if r < KNOWN_FRACTION:
+            variants.append(rng.choice(snps))
+            continue
+        if r < KNOWN_FRACTION + GENIC_FRACTION:
+            gene = rng.choice(genes)
+            if rng.random() < 0.6:
+                # Exome-like: inside an exon
+                start, end = rng.choice(gene.exons)
+                pos = rng.randint(start + 1, end)
+            else:
+                # Introns and flanks, including the promoter
+                pos = rng.randint(max(1, gene.txStart - 2000), gene.txEnd + 2000)
+        else:
+            pos = rng.randint(1, length)
+        ref, alt = alleles(rng)
+        variants.append((min(pos, length), ref, alt))
+    variants.sort()
+    return variants
+
+
+"""Records in sorted order, with a share (1 - sortedness) of them displaced
+Displaced records wait in a pool and come out at random once it holds
+window records, or at the end; sortedness 0 shuffles every window of
+records (the whole file, if it is shorter than the window).
+"""
+
+
+def disorder(records, sortedness, window, rng):
+    pool = []
+    for record in records:
+        if sortedness >= 1.0 or rng.random() < sortedness:
+            yield record
+        else:
+            pool.append(record)
+        if len(pool) >= window:
+            i = rng.randrange(len(pool))
+            pool[i], pool[-1] = pool[-1], pool[i]
+            yield pool.pop()
+    rng.shuffle(pool)
+    for record in pool:
+        yield record
+
+
+"""Chromosome name as written to the VCF: "chr" (chr1), "bare" (1) or "mixed"
+"""
+
+
+def chrom_label(chrom, naming, rng):
+    if naming == "chr" or (naming == "mixed" and rng.random() < 0.5):
+        return "chr" + chrom
+    return chrom
+
+
+def header(genome):
+    lines = ["##fileformat=VCFv4.1", "##source=gas-benchmark"]
+    for chrom in genome.chroms():
+        lines.append(f"##contig=<ID={chrom},length={str(genome.length(chrom))}>")
+    lines.append('##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">')
+    lines.append('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">')
+    lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE1")
+    return "\n".join(lines) + "\n"
+
+
+"""Write a synthetic VCF of lines data lines to path
+"""
+
+
+def generate(path, lines, genome, sortedness=1.0, naming="chr", seed=1, window=WINDOW):
+    rng = random.Random(f"{seed}:vcf")
+    counts = chrom_counts(genome, lines)
+
+    def records():
+        for chrom in genome.chroms():
+            for pos, ref, alt in chrom_variants(genome, chrom, counts[chrom], rng):
+                yield chrom, pos, ref, alt
+
+    with open(path, "w") as fh:
+        fh.write(header(genome))
+        buffer = []
+        for chrom, pos, ref, alt in disorder(records(), sortedness, window, rng):
+            info = "DP=" + str(rng.randint(5, 120)) if rng.random() < 0.8 else "."
+            genotype = "1/1" if rng.random() < 0.3 else "0/1"
+            buffer.append(
+                f"{chrom_label(chrom, naming, rng)}\t{str(pos)}\t.\t{ref}\t{alt}\t"
+                + f"{str(rng.randint(20, 99))}\tPASS\t{info}\tGT\t{genotype}\n"
+            )
+            if len(buffer) >= 10000:
+                fh.write("".join(buffer))
+                buffer = []
+        fh.write("".join(buffer))
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(
+            "Usage: python -m benchmark.vcfgen <out.vcf> <lines> "
+            + "[sortedness] [seed] [scale]"
+        )
+        sys.exit(1)
+
+    sortedness = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    scale = float(sys.argv[5]) if len(sys.argv) > 5 else 1.0
+    genome = gn.Genome(seed=seed, scale=scale)
+    generate(sys.argv[1], int(sys.argv[2]), genome, sortedness=sortedness, seed=seed)
+    print(f"{sys.argv[2]} variants written to {sys.argv[1]}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+### EOF
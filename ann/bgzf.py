@@ -0,0 +1,265 @@
+# bgzf.py
+#
+# gzip/BGZF input and BGZF output for the annotation pipeline
+#
+# Inputs may be uploaded as plain gzip or BGZF (blocked gzip, as written by
+# bgzip and htslib); both are read as a stream of text lines. Results are
+# written as BGZF: the text is cut into blocks of at most 64 KiB, which are
+# deflated on a pool of threads (zlib releases the GIL) and written in
+# order. Because a BGZF file is just a series of gzip members, parts
+# compressed separately can be concatenated into one valid file, as long as
+# only the last one ends with the empty EOF block.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import gzip
+import time
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import chunks as ch
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Uncompressed bytes per block; htslib's limit, so a block never outgrows 64 KiB
+BLOCK_SIZE = 0xFF00
+
+# gzip member header with the BGZF "BC" extra field; BSIZE is filled in
+HEADER = struct.Struct("<4sIBBHBBHH")
+TRAILER = struct.Struct("<II")
+
+EOF_BLOCK = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+
+def is_compressed(path):
+    with open(path, "rb") as fh:
+        return fh.read(2) == GZIP_MAGIC
+
+
+"""Whether a gzip file is BGZF, i.e. its first member has the BC extra field
+"""
+
+
+def is_bgzf(path):
+    with open(path, "rb") as fh:
+        head = fh.read(HEADER.size)
+    if len(head) < HEADER.size or head[:2] != GZIP_MAGIC:
+        return False
+    flags = head[3]
+    return bool(flags & 4) and head[12:14] == b"BC"
+
+
+"""Name of a file without its .gz extension
+"""
+
+
+def plain_name(path):
+    return path[:-3] if path.endswith(".gz") else path
+
+
+"""Open a VCF for reading text lines, decompressing gzip or BGZF on the fly
+"""
+
+
+def open_text(path):
+    if is_compressed(path):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path)
+
+
+"""Decompress a gzip or BGZF file to a plain file
+"""
+
+
+def decompress(path, out_path):
+    with gzip.open(path, "rb") as fh, open(out_path, "wb") as fh_out:
+        while True:
+            data = fh.read(1 << 20)
+            if not data:
+                break
+            fh_out.write(data)
+
+
+"""One BGZF block holding data (at most BLOCK_SIZE bytes)
+"""
+
+
+def compress_block(data, level=6):
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+    body = deflate.compress(data) + deflate.flush()
+    header = HEADER.pack(
+        b"\x1f\x8b\x08\x04", 0, 0, 0xFF, 6, ord("B"), ord("C"), 2,
+        HEADER.size + len(body) + TRAILER.size - 1,
+    )
+    return header + body + TRAILER.pack(zlib.crc32(data), len(data))
+
+
+"""Text file writer producing BGZF
+Blocks are compressed by threads workers (0 = one per available CPU) and
+written in order; at most a few blocks per worker are in flight. Keeps
+count of the text and compressed bytes and of the seconds spent deflating,
+summed over the workers. With eof=False the EOF block is left off, for a
+part that will have others concatenated after it.
+"""
+
+
+class BgzfWriter(object):
+    def __init__(self, path, threads=0, level=6, eof=True):
+        self.path = path
+        self.level = level
+        self.eof = eof
+        self.threads = threads if threads > 0 else ch.available_cpus()
+        self.fh = open(path, "wb")
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = []
+        self.buffer = bytearray()
+        self.text_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_seconds = 0.0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.text_bytes = self.text_bytes + len(data)
+        self.buffer.extend(data)
+        while len(self.buffer) >= BLOCK_SIZE:
+            self.submit(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+
+    def submit(self, data):
+        self.pending.append(self.pool.submit(self.deflate, data))
+        while len(self.pending) > 4 * self.threads:
+            self.drain(1)
+
+    def deflate(self, data):
+        start = time.process_time()
+        block = compress_block(data, self.level)
+        return block, time.process_time() - start
+
+    def drain(self, count=None):
+        if count is None:
+            count = len(self.pending)
+        for future in self.pending[:count]:
+            block, seconds = future.result()
+            self.fh.write(block)
+            self.compressed_bytes = self.compressed_bytes + len(block)
+            self.compress_seconds = self.compress_seconds + seconds
+        del self.pending[:count]
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.drain()
+        self.fh.flush()
+
+    def fileno(self):
+        return self.fh.fileno()
+
+    def close(self):
+        if self.fh.closed:
+            return
+        self.flush()
+        if self.eof:
+            self.fh.write(EOF_BLOCK)
+            self.compressed_bytes = self.compressed_bytes + len(EOF_BLOCK)
+        self.pool.shutdown()
+        self.fh.close()
+
+    def report(self):
+        ratio = self.compressed_bytes / self.text_bytes if self.text_bytes > 0 else 0.0
+        return (
+            f"## BGZF output: {str(self.text_bytes)} bytes compressed to "
+            + f"{str(self.compressed_bytes)} ({100.0 * ratio:.1f}%) in "
+            + f"{self.compress_seconds:.2f} CPU seconds on {str(self.threads)} thread(s)"
+        )
+
+
+"""One line describing a compressed input and its size
+"""
+
+
+def input_report(path, text_bytes):
+    kind = "BGZF" if is_bgzf(path) else "gzip"
+    return (
+        f"## {kind} input: {str(os.path.getsize(path))} bytes, "
+        + f"{str(text_bytes)} bytes of VCF text"
+    )
+
+
+"""BGZF reader positioned by virtual offsets, as tabix indexes give them
+A virtual offset is the compressed offset of a block shifted left 16 bits
+plus the offset of a byte within the block's data. readline() returns
+bytes, tell() the virtual offset of the next line.
+"""
+
+
+class BgzfReader(object):
+    def __init__(self, path):
+        self.fh = open(path, "rb")
+        self.block_start = 0
+        self.next_block = 0
+        self.data = b""
+        self.offset = 0
+
+    def load(self, coffset):
+        self.fh.seek(coffset)
+        head = self.fh.read(12)
+        self.block_start = coffset
+        self.data = b""
+        self.offset = 0
+        if len(head) < 12:
+            self.next_block = coffset
+            return False
+        xlen = struct.unpack("<H", head[10:12])[0]
+        extra = self.fh.read(xlen)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            length = struct.unpack("<H", extra[i + 2 : i + 4])[0]
+            if extra[i : i + 2] == b"BC":
+                bsize = struct.unpack("<H", extra[i + 4 : i + 6])[0]
+            i = i + 4 + length
+        if bsize is None:
+            raise ValueError(f"{self.fh.name}: not a BGZF block at offset {coffset}")
+        body = self.fh.read(bsize + 1 - 12 - xlen)
+        self.next_block = coffset + bsize + 1
+        self.data = zlib.decompress(body[: -TRAILER.size], -15)
+        return True
+
+    def seek(self, voffset):
+        self.load(voffset >> 16)
+        self.offset = voffset & 0xFFFF
+
+    def tell(self):
+        if self.offset >= len(self.data):
+            return self.next_block << 16
+        return (self.block_start << 16) | self.offset
+
+    def readline(self):
+        pieces = []
+        while True:
+            if self.offset >= len(self.data):
+                # Skip to the next block with data; the EOF block has none
+                while self.offset >= len(self.data):
+                    if not self.load(self.next_block):
+                        return b"".join(pieces)
+            end = self.data.find(b"\n", self.offset)
+            if end >= 0:
+                pieces.append(self.data[self.offset : end + 1])
+                self.offset = end + 1
+                return b"".join(pieces)
+            pieces.append(self.data[self.offset :])
+            self.offset = len(self.data)
+
+    def close(self):
+        self.fh.close()
+
+
+### EOF
@@ -0,0 +1,193 @@
+# bloom.py
+#
+# Versioned Bloom filter over the (chrom, pos) keys of dbSNP
+#
+# Most submitted variants are private or rare and not in dbSNP, yet each one
+# costs a dbSNP lookup. The filter answers "definitely not in dbSNP" for
+# them from a memory-mapped bit array, so only possible hits go on to the
+# database, cache or snapshot. It is built offline from the live table with
+# a chosen false positive rate; false positives only cost the lookup that
+# would have happened anyway.
+#
+# Layout of <root>:
+#   CURRENT             - name of the active version
+#   <version>.bloom     - header, then the bit array
+#
+# Usage: python bloom.py <bloom root> [false positive rate] [version]
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import sys
+import mmap
+import math
+import time
+import struct
+import hashlib
+
+import utils as u
+
+MAGIC = b"GASBLM\x00\x01"
+HEADER = struct.Struct("<8sQQQd16s")
+KEY = struct.Struct("<8sQ")
+
+"""Two 64-bit hashes of a packed (chrom, pos) key
+The k probe positions are derived from them by double hashing. The
+chromosome is upper-cased because MySQL compares CHR case-insensitively.
+"""
+
+
+def key_hashes(chrom, pos):
+    digest = hashlib.blake2b(
+        KEY.pack(str(chrom).upper().encode("utf-8"), int(pos)), digest_size=16
+    ).digest()
+    return (
+        int.from_bytes(digest[:8], "little"),
+        int.from_bytes(digest[8:], "little") | 1,
+    )
+
+
+"""Size a filter for n keys: (bits, probes per key)
+"""
+
+
+def filter_size(n, fp_rate):
+    n = max(1, n)
+    m = int(math.ceil(-n * math.log(fp_rate) / (math.log(2) ** 2)))
+    m = (m + 7) // 8 * 8
+    k = max(1, int(round(m / n * math.log(2))))
+    return m, k
+
+
+"""A filter version mapped read-only
+mayContain() is False only for keys that were never added.
+"""
+
+
+class BloomFilter(object):
+    def __init__(self, root, version=None):
+        if version is None:
+            with open(os.path.join(root, "CURRENT")) as fh:
+                version = fh.read().strip()
+        self.version = version
+        self.path = os.path.join(root, version + ".bloom")
+
+        fh = open(self.path, "rb")
+        self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        fh.close()
+        magic, self.m, self.k, self.n, self.fp_rate, varclass = HEADER.unpack_from(
+            self.mm, 0
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a dbSNP Bloom filter")
+        self.varclass = varclass.rstrip(b"\x00").decode("utf-8")
+        self.bits = memoryview(self.mm)[HEADER.size :]
+
+    def mayContain(self, chrom, pos):
+        h1, h2 = key_hashes(chrom, pos)
+        bits = self.bits
+        m = self.m
+        for i in range(self.k):
+            b = (h1 + i * h2) % m
+            if not bits[b >> 3] & (1 << (b & 7)):
+                return False
+        return True
+
+
+_filters = {}
+
+"""Open the current version under root, once per process
+"""
+
+
+def open_filter(root):
+    if root not in _filters:
+        _filters[root] = BloomFilter(root)
+    return _filters[root]
+
+
+"""Build a new filter version from the live dbSNP table and make it current
+Only rows of the given variant class are added, matching the rows the
+dbSNP stage looks for.
+"""
+
+
+def build(conn, root, fp_rate=0.01, varclass="SNV", version=None):
+    if version is None:
+        version = time.strftime("%Y%m%d%H%M%S")
+    os.makedirs(root, exist_ok=True)
+    cursor = conn.cursor()
+
+    cursor.execute('select count(*) from dbSNP where INFO = "' + varclass + '";')
+    n = int(cursor.fetchone()[0])
+    m, k = filter_size(n, fp_rate)
+    bits = bytearray(m // 8)
+
+    cursor.execute("select distinct CHR from dbSNP;")
+    chroms = sorted([str(row[0]) for row in cursor.fetchall() if row[0] is not None])
+    for chrom in chroms:
+        cursor.execute(
+            'select POS from dbSNP where CHR="'
+            + chrom
+            + '" AND INFO = "'
+            + varclass
+            + '";'
+        )
+        while True:
+            rows = cursor.fetchmany(100000)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                if row[0] is None:
+                    continue
+                h1, h2 = key_hashes(chrom, row[0])
+                for i in range(k):
+                    b = (h1 + i * h2) % m
+                    bits[b >> 3] = bits[b >> 3] | (1 << (b & 7))
+    cursor.close()
+
+    path = os.path.join(root, version + ".bloom")
+    with open(path + ".tmp", "wb") as fh:
+        fh.write(HEADER.pack(MAGIC, m, k, n, fp_rate, varclass.encode("utf-8")))
+        fh.write(bits)
+    os.replace(path + ".tmp", path)
+
+    current = os.path.join(root, "CURRENT")
+    with open(current + ".tmp", "w") as fh:
+        fh.write(version + "\n")
+    os.replace(current + ".tmp", current)
+    print(f"dbSNP: {n} keys, {m // 8} bytes, {k} probes per key")
+    return version
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python bloom.py <bloom root> [false positive rate] [version]")
+        sys.exit(1)
+
+    fp_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    if not 0 < fp_rate < 1:
+        print("The false positive rate must be between 0 and 1")
+        sys.exit(1)
+
+    conn = u.db_connect()
+    try:
+        version = build(
+            conn,
+            sys.argv[1],
+            fp_rate=fp_rate,
+            version=sys.argv[3] if len(sys.argv) > 3 else None,
+        )
+    finally:
+        conn.close()
+    print(f"Bloom filter {version} written to {sys.argv[1]}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+### EOF
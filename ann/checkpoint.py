@@ -0,0 +1,175 @@
+# checkpoint.py
+#
+# Checkpoints of annotation jobs, so an interrupted job resumes where it stopped
+#
+# A job is a sequence of steps whose outputs stay on disk until the end of
+# the job: the stages of the legacy pipeline (each writes <input>.<n> and
+# appends to the .count.log) and the byte ranges of the streaming pipeline
+# (each writes a part file, see driver.run_chunked()). As each step
+# finishes, its files are recorded with their size and SHA-256, together
+# with whatever the driver needs to carry on (stage counters, line counts),
+# in the job manifest <input>.checkpoint.json. A job started again over the
+# same input and settings finds the manifest, checks the recorded files are
+# still intact and skips the steps that produced them. The manifest is
+# written atomically after every step; a persist callback (run.py's) can
+# also copy it and the step's files elsewhere, e.g. to S3. Once the job's
+# output is complete, it replaces the steps in the manifest, so a job whose
+# results could not be uploaded is not annotated again when it is retried.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import json
+import hashlib
+
+VERSION = 1
+
+# Step of the job's finished output
+OUTPUT_STEP = "output"
+
+
+def manifest_name(base):
+    return base + ".checkpoint.json"
+
+
+"""Size and SHA-256 of the first size bytes of a file (all of it if None)
+"""
+
+
+def file_digest(path, size=None):
+    digest = hashlib.sha256()
+    remaining = size
+    with open(path, "rb") as fh:
+        while remaining is None or remaining > 0:
+            n = 1 << 20 if remaining is None else min(1 << 20, remaining)
+            data = fh.read(n)
+            if not data:
+                break
+            digest.update(data)
+            if remaining is not None:
+                remaining = remaining - len(data)
+    read = os.path.getsize(path) if size is None else size - (remaining or 0)
+    return read, digest.hexdigest()
+
+
+"""Steps of one job recorded in its manifest
+fingerprint identifies the job's input and every setting its output
+depends on; a manifest left by a job with another fingerprint is ignored
+and replaced. persist, if given, is called as persist(manifest_path,
+added_paths, removed_names) after every save.
+"""
+
+
+class JobCheckpoint(object):
+    def __init__(self, base, fingerprint, persist=None):
+        self.path = manifest_name(base)
+        self.directory = os.path.dirname(os.path.abspath(base))
+        self.fingerprint = fingerprint
+        self.persist = persist
+        self.steps = {}
+        self.resumed = 0
+        self.recorded = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fh:
+                manifest = json.load(fh)
+        except ValueError:
+            print(f"Ignoring unreadable checkpoint {self.path}")
+            return
+        if manifest.get("version") != VERSION:
+            return
+        if manifest.get("fingerprint") != self.fingerprint:
+            print("Input or settings changed since the last checkpoint, starting over")
+            return
+        self.steps = manifest["steps"]
+
+    def file_path(self, name):
+        return os.path.join(self.directory, name)
+
+    """The recorded values of a finished step, or None if the step was not
+    recorded or any of its files is missing or changed
+    Files recorded as logs may have grown since (a later step appended to
+    them); they only need to start with the recorded bytes, and are cut
+    back to them.
+    """
+
+    def resume(self, step):
+        entry = self.steps.get(step)
+        if entry is None:
+            return None
+        for name, info in entry["files"].items():
+            path = self.file_path(name)
+            if not os.path.exists(path):
+                return None
+            size = os.path.getsize(path)
+            if size < info["bytes"] or (size > info["bytes"] and not info["log"]):
+                return None
+            if file_digest(path, info["bytes"]) != (info["bytes"], info["sha256"]):
+                print(f"Checkpointed {name} does not match its checksum")
+                return None
+        for name, info in entry["files"].items():
+            if info["log"]:
+                os.truncate(self.file_path(name), info["bytes"])
+        self.resumed = self.resumed + 1
+        return entry["values"]
+
+    """Record a finished step with its files (paths in the job directory) and
+    the values to resume with; logs are files later steps append to.
+    With replace, the steps recorded before are dropped: each of them only
+    fed the next one.
+    """
+
+    def record(self, step, files, values=None, logs=(), replace=False):
+        removed = []
+        if replace:
+            for old in self.steps.values():
+                removed.extend(old["files"])
+            self.steps = {}
+        entry = {"files": {}, "values": values}
+        for path in list(files) + list(logs):
+            size, sha256 = file_digest(path)
+            entry["files"][os.path.basename(path)] = {
+                "bytes": size,
+                "sha256": sha256,
+                "log": path in logs,
+            }
+        self.steps[step] = entry
+        self.recorded = self.recorded + 1
+        removed = [name for name in removed if name not in entry["files"]]
+        self.save(list(files) + list(logs), removed)
+
+    def save(self, added=(), removed=()):
+        manifest = {
+            "version": VERSION,
+            "fingerprint": self.fingerprint,
+            "steps": self.steps,
+        }
+        with open(self.path + ".tmp", "w") as fh:
+            json.dump(manifest, fh, indent=2)
+            fh.write("\n")
+        os.replace(self.path + ".tmp", self.path)
+        if self.persist is not None:
+            self.persist(self.path, list(added), list(removed))
+
+    """Record the job's finished output in place of the steps that fed it
+    (their files are gone by now). It is not persisted: the manifest stays
+    in the job directory until the results are uploaded and the directory
+    removed, while a persisted copy of the steps can still be resumed from.
+    """
+
+    def finish(self, files, logs=()):
+        self.persist = None
+        self.record(OUTPUT_STEP, files, {"complete": True}, logs, replace=True)
+
+    def report(self):
+        return {"resumed_steps": self.resumed, "recorded_steps": self.recorded}
+
+
+### EOF
@@ -0,0 +1,127 @@
+# chunks.py
+#
+# Byte-range splitting of a VCF for parallel annotation on one host
+#
+# The input is memory-mapped and cut at line boundaries into contiguous
+# byte ranges, with the leading header lines kept apart, so each worker
+# process can annotate its own range and the outputs can be concatenated
+# in order without being parsed again.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import mmap
+import shutil
+
+
+"""Number of CPUs this process may run on
+"""
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+"""Split a file into a header and at most k data ranges
+Returns (header_end, ranges): the header is bytes [0, header_end), the
+leading lines starting with "#", and ranges is a list of (start, end) byte
+offsets covering the rest of the file, each ending just after a newline
+(or at end of file). No range is made smaller than min_chunk bytes, so a
+small file comes back as a single range.
+"""
+
+
+def split_ranges(path, k, min_chunk=1 << 22):
+    with open(path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size == 0:
+            return 0, []
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header_end = 0
+            while header_end < size and mm[header_end : header_end + 1] == b"#":
+                nl = mm.find(b"\n", header_end)
+                header_end = size if nl < 0 else nl + 1
+
+            data = size - header_end
+            if data == 0:
+                return header_end, []
+            k = max(1, min(k, data // max(1, min_chunk)))
+
+            bounds = [header_end]
+            for i in range(1, k):
+                # Cut just after the first newline at or past the target
+                nl = mm.find(b"\n", header_end + data * i // k - 1)
+                if nl < 0 or nl + 1 >= size:
+                    break
+                if nl + 1 > bounds[-1]:
+                    bounds.append(nl + 1)
+            bounds.append(size)
+        finally:
+            mm.close()
+
+    return header_end, list(zip(bounds[:-1], bounds[1:]))
+
+
+"""Lines of one byte range, decoded, the way iterating the file would give them
+"""
+
+
+def range_lines(path, start, end, encoding="utf-8"):
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        pos = start
+        while pos < end:
+            line = fh.readline()
+            if not line:
+                break
+            pos = pos + len(line)
+            yield line.decode(encoding)
+
+
+"""Append files to an open output file in order, in the kernel where possible
+"""
+
+
+def concat(fh_out, paths):
+    fh_out.flush()
+    out_fd = fh_out.fileno()
+    for path in paths:
+        with open(path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            copied = copy_range(fh.fileno(), out_fd, size)
+            if copied < size:
+                fh.seek(copied)
+                os.lseek(out_fd, 0, os.SEEK_END)
+                with open(out_fd, "wb", closefd=False) as raw:
+                    shutil.copyfileobj(fh, raw)
+
+
+"""Copy size bytes from in_fd to the current position of out_fd
+Returns how many bytes were copied before the kernel refused (e.g. EXDEV or
+ENOSYS), so the caller can finish with a plain copy.
+"""
+
+
+def copy_range(in_fd, out_fd, size):
+    copied = 0
+    try:
+        while copied < size:
+            if hasattr(os, "copy_file_range"):
+                n = os.copy_file_range(in_fd, out_fd, size - copied, copied)
+            else:
+                n = os.sendfile(out_fd, in_fd, copied, size - copied)
+            if n == 0:
+                break
+            copied = copied + n
+    except OSError:
+        pass
+    return copied
+
+
+### EOF
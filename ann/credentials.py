@@ -0,0 +1,186 @@
+# credentials.py
+#
+# TTL cache for AWS Secrets Manager lookups
+#
+# Secrets are kept in process memory and, optionally, in a local directory
+# that only root can read, so a secret is fetched from Secrets Manager once
+# per TTL rather than once per connection. Shortly before an entry expires
+# it is refreshed in the background while the cached value keeps being
+# served. Callers invalidate an entry when the credentials in it are
+# rejected, so a rotated password is picked up on the next lookup.
+#
+# Used by the annotator; util/credentials.py is a copy of it for the
+# utility scripts.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import json
+import time
+import threading
+
+try:
+    import boto3
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    # Nothing is fetched without boto3 (see utils.db_connect())
+    boto3 = None
+
+settings = {"ttl": 3600.0, "refresh_ahead": 300.0, "cache_dir": None}
+
+_cache = {}
+_refreshing = set()
+_fetching = {}
+_lock = threading.Lock()
+
+"""Change the cache settings (seconds, and the file layer directory)
+cache_dir is only used by processes running as root; None disables it.
+"""
+
+
+def configure(ttl=None, refresh_ahead=None, cache_dir=None):
+    if ttl is not None:
+        settings["ttl"] = float(ttl)
+    if refresh_ahead is not None:
+        settings["refresh_ahead"] = float(refresh_ahead)
+    settings["cache_dir"] = cache_dir or None
+
+
+"""Secret value (the parsed SecretString) for secret_id
+Served from memory, then from the file layer, then from Secrets Manager.
+"""
+
+
+def get_secret(secret_id, region_name="us-east-1"):
+    with _lock:
+        entry = _cache.get(secret_id)
+    if entry is None:
+        entry = read_file(secret_id)
+        if entry is not None:
+            with _lock:
+                _cache[secret_id] = entry
+
+    if entry is not None:
+        value, fetched = entry
+        age = time.time() - fetched
+        if age < settings["ttl"]:
+            if age >= settings["ttl"] - settings["refresh_ahead"]:
+                refresh_ahead(secret_id, region_name)
+            return value
+
+    return fetch(secret_id, region_name)
+
+
+"""Drop a secret from both layers, e.g. after its credentials were rejected
+"""
+
+
+def invalidate(secret_id):
+    with _lock:
+        _cache.pop(secret_id, None)
+    path = cache_path(secret_id)
+    if path is not None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+"""Fetch a secret from Secrets Manager into both layers
+One caller at a time fetches a given secret; callers that waited for it
+get the value it fetched (unless that is already due for a refresh) instead
+of making a call of their own.
+"""
+
+
+def fetch(secret_id, region_name):
+    with _lock:
+        fetching = _fetching.setdefault(secret_id, threading.Lock())
+    with fetching:
+        with _lock:
+            entry = _cache.get(secret_id)
+        if entry is not None:
+            value, fetched = entry
+            if time.time() - fetched < settings["ttl"] - settings["refresh_ahead"]:
+                return value
+
+        asm = boto3.client("secretsmanager", region_name=region_name)
+        asm_response = asm.get_secret_value(SecretId=secret_id)
+        value = json.loads(asm_response["SecretString"])
+        entry = (value, time.time())
+        with _lock:
+            _cache[secret_id] = entry
+        write_file(secret_id, entry)
+        return value
+
+
+"""Fetch a secret that is about to expire on a background thread
+A failed refresh is only reported; the cached value stays valid until its
+TTL runs out.
+"""
+
+
+def refresh_ahead(secret_id, region_name):
+    with _lock:
+        if secret_id in _refreshing:
+            return
+        _refreshing.add(secret_id)
+
+    def refresh():
+        try:
+            fetch(secret_id, region_name)
+        except (ClientError, BotoCoreError) as e:
+            print(f"Unable to refresh {secret_id} from AWS Secrets Manager: {e}")
+        finally:
+            with _lock:
+                _refreshing.discard(secret_id)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+"""Path of a secret in the file layer, or None if the layer is unusable
+The layer is only trusted when this process runs as root and the directory
+is owned by root and closed to everyone else.
+"""
+
+
+def cache_path(secret_id):
+    cache_dir = settings["cache_dir"]
+    if cache_dir is None or os.geteuid() != 0:
+        return None
+
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    st = os.stat(cache_dir)
+    if st.st_uid != 0 or st.st_mode & 0o077:
+        print(f"Ignoring credential cache {cache_dir}: not private to root")
+        return None
+    return os.path.join(cache_dir, secret_id.replace("/", "%2F") + ".json")
+
+
+def read_file(secret_id):
+    path = cache_path(secret_id)
+    if path is None:
+        return None
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+        return (data["value"], float(data["fetched"]))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_file(secret_id, entry):
+    path = cache_path(secret_id)
+    if path is None:
+        return
+    tmp = path + "." + str(os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as fh:
+        json.dump({"value": entry[0], "fetched": entry[1]}, fh)
+    os.replace(tmp, path)
+
+
+### EOF
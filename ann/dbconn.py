@@ -0,0 +1,265 @@
+# dbconn.py
+#
+# Shared reference database connection for the annotation stages
+#
+# utils.db_connect() costs a Secrets Manager lookup, a TCP connect and a
+# MySQL handshake. A ConnectionProvider makes that call once per process and
+# hands out cursors on the one connection, checks the connection is still
+# alive between stages, and reconnects transparently if it was dropped.
+# Connect time and query time are accounted for separately.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import time
+import utils as u
+
+try:
+    import pymysql
+except ImportError:
+    pymysql = None
+
+
+"""Errors that may mean the connection is dead, see dropped()
+Without pymysql there is no MySQL connection to lose.
+"""
+
+DROPPED = ()
+if pymysql is not None:
+    DROPPED = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+# Client error codes of a lost connection: server gone away, lost during a
+# query, lost with a system error
+LOST_CODES = (2006, 2013, 2055)
+
+
+"""Whether an error means the connection is dead, so a query is retried on
+a fresh one (the pipeline only ever reads, so a retry is safe)
+pymysql raises SQL errors, access denied and lock wait timeouts as
+OperationalError too; those would only fail again, and are raised as they
+are.
+"""
+
+
+def dropped(error):
+    if isinstance(error, pymysql.err.InterfaceError):
+        return True
+    code = error.args[0] if len(error.args) > 0 else None
+    return code in LOST_CODES
+
+
+"""One lazily opened connection to the reference database
+Has the cursor() and close() of a pymysql connection, so it can be passed
+anywhere a connection is expected. check() pings the server if the
+connection has been idle for more than ping_after seconds and reconnects if
+the ping fails; cursors notice the new connection on their next query.
+"""
+
+
+class ConnectionProvider(object):
+    def __init__(self, connect=u.db_connect, ping_after=30.0):
+        self.connect = connect
+        self.ping_after = ping_after
+        self.conn = None
+        self.generation = 0
+        self.last_used = 0.0
+        self.connects = 0
+        self.connect_seconds = 0.0
+        self.reconnects = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def connection(self):
+        if self.conn is None:
+            start = time.time()
+            self.conn = self.connect()
+            self.connect_seconds = self.connect_seconds + (time.time() - start)
+            self.connects = self.connects + 1
+            self.generation = self.generation + 1
+            self.last_used = time.time()
+        return self.conn
+
+    def reconnect(self):
+        self.drop()
+        self.reconnects = self.reconnects + 1
+        return self.connection()
+
+    def drop(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except DROPPED:
+                pass
+            self.conn = None
+
+    def check(self):
+        if self.conn is None or time.time() - self.last_used < self.ping_after:
+            return
+        try:
+            self.conn.ping(reconnect=False)
+            self.last_used = time.time()
+        except DROPPED as e:
+            if not dropped(e):
+                raise
+            print(f"Reference database connection lost ({e}), reconnecting")
+            self.reconnect()
+
+    def cursor(self):
+        return ProviderCursor(self)
+
+    def close(self):
+        self.drop()
+
+    def report(self):
+        return report([self])
+
+
+"""One line with the combined connect and query timings of some providers
+"""
+
+
+def report(providers):
+    connects = sum([p.connects for p in providers])
+    connect_seconds = sum([p.connect_seconds for p in providers])
+    reconnects = sum([p.reconnects for p in providers])
+    queries = sum([p.queries for p in providers])
+    query_seconds = sum([p.query_seconds for p in providers])
+    return (
+        f"Reference DB: {connects} connection(s) in "
+        + f"{connect_seconds:.2f} seconds ({reconnects} reconnects), "
+        + f"{queries} queries in {query_seconds:.2f} seconds"
+    )
+
+
+"""Cursor bound to a provider rather than to one connection
+execute() is timed as query time and retried once on a fresh connection if
+the old one was dropped. Rows are buffered by execute(), so the fetch
+methods never go back to the server.
+"""
+
+
+class ProviderCursor(object):
+    def __init__(self, provider):
+        self.provider = provider
+        self.cursor = None
+        self.generation = None
+
+    def raw(self):
+        provider = self.provider
+        conn = provider.connection()
+        if self.cursor is None or self.generation != provider.generation:
+            self.cursor = conn.cursor()
+            self.generation = provider.generation
+        return self.cursor
+
+    def execute(self, sql, args=None):
+        provider = self.provider
+        cursor = self.raw()
+        start = time.time()
+        try:
+            result = cursor.execute(sql, args)
+        except DROPPED as e:
+            if not dropped(e):
+                raise
+            print(f"Reference database connection lost ({e}), retrying query")
+            provider.reconnect()
+            cursor = self.raw()
+            start = time.time()
+            result = cursor.execute(sql, args)
+        end = time.time()
+        provider.query_seconds = provider.query_seconds + (end - start)
+        provider.queries = provider.queries + 1
+        provider.last_used = end
+        return result
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def close(self):
+        if self.cursor is not None and self.generation == self.provider.generation:
+            self.cursor.close()
+        self.cursor = None
+
+
+"""Cursor of conn that reads a result from the server as it is fetched
+rather than buffering all of it, for scans of whole tables (a replica's
+cursors read rows as they are fetched already)
+"""
+
+
+def streaming_cursor(conn):
+    if pymysql is not None and isinstance(conn, pymysql.connections.Connection):
+        return conn.cursor(pymysql.cursors.SSCursor)
+    return conn.cursor()
+
+
+_providers = {}
+
+# How shared providers connect (a local replica's connection, see refdb.py,
+# instead of MySQL)
+settings = {"connect": u.db_connect}
+
+
+def configure(connect=None):
+    settings["connect"] = connect or u.db_connect
+
+
+"""A new provider connecting as configure() set, for a caller that needs a
+connection of its own (e.g. a stage on another thread)
+"""
+
+
+def new_provider():
+    return ConnectionProvider(settings["connect"])
+
+
+"""The calling process's provider, health-checked before it is returned
+Keyed by process id so a forked worker never shares its parent's socket.
+"""
+
+
+def shared():
+    pid = os.getpid()
+    if pid not in _providers:
+        _providers[pid] = new_provider()
+    provider = _providers[pid]
+    provider.check()
+    return provider
+
+
+"""Close the calling process's shared connection and print its timings
+"""
+
+
+def close_shared():
+    provider = _providers.pop(os.getpid(), None)
+    if provider is not None:
+        close_all([provider])
+
+
+"""Close providers and print their combined timings, if any connected
+"""
+
+
+def close_all(providers):
+    if sum([p.connects for p in providers]) > 0:
+        print(report(providers))
+    for provider in providers:
+        provider.close()
+
+
+### EOF
@@ -13,168 +13,1095 @@ __author__ = "Vas Vasiliadis <vas@uchicago.edu>"
 
 import sys
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import bgzf as bz
+import bloom as bl
+import checkpoint as ck
+import chunks as ch
+import dbconn as dbc
+import extsort as es
 import file_utils as fu
+import metrics as mt
 import annotate as ann
+import refdb as rd
+import snapshot as sn
+import stages as st
+import tabix as tbx
+import targets as tg
+import varcache as vc
+import vcfblock as vb
+import vcfinfo as vi
 
 
-def run(infile, format):
+"""A stage the pipeline can run: its name, as profiles list it, and a
+function building it from the job's options (format, batch_size, bloom and
+lookup(table), see build_stages())
+"""
+
+
+class StageDescriptor(object):
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+
+
+"""Every annotation stage, in the order the legacy pipeline runs them
+"""
+
+STAGE_REGISTRY = [
+    StageDescriptor(
+        "dbSNP",
+        lambda o: st.DbSnpStage(
+            format=o["format"], batch_size=o["batch_size"], bloom=o["bloom"]
+        ),
+    ),
+    StageDescriptor(
+        "bigRefGene",
+        lambda o: st.BigRefGeneStage(
+            format=o["format"], lookup=o["lookup"]("bigRefGene")
+        ),
+    ),
+    StageDescriptor(
+        "refGene",
+        lambda o: st.GenesStage(
+            format=o["format"],
+            table="refGene",
+            promoter_offset=500,
+            lookup=o["lookup"]("refGene"),
+            cpg_lookup=o["lookup"]("cpgIslandExt"),
+        ),
+    ),
+    StageDescriptor(
+        "cytoBand",
+        lambda o: st.CytobandStage(
+            format=o["format"], table="cytoBand", lookup=o["lookup"]("cytoBand")
+        ),
+    ),
+    StageDescriptor(
+        "gadAll",
+        lambda o: st.GadAllStage(
+            format=o["format"], table="gadAll", lookup=o["lookup"]("gadAll")
+        ),
+    ),
+    StageDescriptor(
+        "gwasCatalog",
+        lambda o: st.GwasCatalogStage(format=o["format"], table="gwasCatalog"),
+    ),
+    StageDescriptor(
+        "targetScanS",
+        lambda o: st.MiRNAStage(
+            format=o["format"], table="targetScanS", lookup=o["lookup"]("targetScanS")
+        ),
+    ),
+    StageDescriptor(
+        "hugo",
+        lambda o: st.HugoStage(
+            format=o["format"], table="hugo", lookup=o["lookup"]("hugo")
+        ),
+    ),
+    StageDescriptor(
+        "dgv_Cnv",
+        lambda o: st.CnvStage(
+            format=o["format"], table="dgv_Cnv", lookup=o["lookup"]("dgv_Cnv")
+        ),
+    ),
+    StageDescriptor(
+        "abParts_IG_T_CelReceptors",
+        lambda o: st.CnvStage(
+            format=o["format"],
+            table="abParts_IG_T_CelReceptors",
+            lookup=o["lookup"]("abParts_IG_T_CelReceptors"),
+        ),
+    ),
+    StageDescriptor(
+        "mcCarroll_Cnv",
+        lambda o: st.CnvStage(
+            format=o["format"],
+            table="mcCarroll_Cnv",
+            lookup=o["lookup"]("mcCarroll_Cnv"),
+        ),
+    ),
+    StageDescriptor(
+        "conrad_Cnv",
+        lambda o: st.CnvStage(
+            format=o["format"], table="conrad_Cnv", lookup=o["lookup"]("conrad_Cnv")
+        ),
+    ),
+    StageDescriptor(
+        "genomicSuperDups",
+        lambda o: st.GenomicSuperDupsStage(
+            format=o["format"],
+            table="genomicSuperDups",
+            lookup=o["lookup"]("genomicSuperDups"),
+        ),
+    ),
+    StageDescriptor(
+        "tfbsConsSites",
+        lambda o: st.TfbsConsSitesStage(
+            format=o["format"],
+            table="tfbsConsSites",
+            lookup=o["lookup"]("tfbsConsSites"),
+        ),
+    ),
+]
+
+STAGE_NAMES = [descriptor.name for descriptor in STAGE_REGISTRY]
+
+
+"""Names of the registered stages among names, in pipeline order
+"all" stands for every stage; unknown names raise a ValueError.
+"""
+
+
+def select_stages(names):
+    names = [name.strip() for name in names if name.strip()]
+    if "all" in names:
+        return list(STAGE_NAMES)
+    unknown = [name for name in names if name not in STAGE_NAMES]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown annotation stage(s): {', '.join(unknown)}")
+    if len(names) == 0:
+        raise ValueError("No annotation stages selected")
+    return [name for name in STAGE_NAMES if name in names]
+
+
+"""Annotation stages named in stage_names (all of them if None), in the
+order the legacy pipeline runs them
+Tables in indexed_tables are served from memory and those in sweep_tables
+by a sweep join, instead of one query per variant; dbSNP is looked up
+batch_size variants at a time, skipping those a bloom.BloomFilter rules out.
+"""
+
+
+def build_stages(
+    format="vcf",
+    indexed_tables=(),
+    batch_size=1,
+    sweep_tables=(),
+    bloom=None,
+    stage_names=None,
+):
+    def lookup(table):
+        if table in indexed_tables:
+            return "index"
+        if table in sweep_tables:
+            return "sweep"
+        return "query"
+
+    options = {
+        "format": format,
+        "batch_size": batch_size,
+        "bloom": bloom,
+        "lookup": lookup,
+    }
+    stages = []
+    for descriptor in STAGE_REGISTRY:
+        if stage_names is None or descriptor.name in stage_names:
+            stage = descriptor.build(options)
+            stage.name = descriptor.name
+            stages.append(stage)
+    return stages
+
+
+"""Name of the final annotated file for an input VCF
+"""
+
+
+def annotated_name(infile):
+    return (infile + ".annot").replace(".vcf.annot", ".annot.vcf")
+
+
+"""Re-split a record the way the next file-based stage would
+Each legacy stage strips the line it reads, so trailing whitespace on the
+last column (or an empty last column) never survives into the next stage.
+"""
+
+
+def restrip(fields, sep="\t"):
+    last = vi.last_char(fields[-1])
+    if len(last) == 0 or last.isspace():
+        return fields.resplit(vi.join_fields(fields, sep).strip(), sep)
+    return fields
+
+
+"""Split stages into the chain that must run in order and the independent
+stages after it, which only need the variant positions
+"""
+
+
+def stage_graph(stages):
+    split = len(stages)
+    while split > 0 and stages[split - 1].independent:
+        split = split - 1
+    return stages[:split], stages[split:]
+
+
+"""Bytes of INFO text in a block of split records
+"""
+
+
+def info_bytes(batch):
+    return sum([len(fields[7]) for fields in batch if len(fields) > 7])
+
+
+"""Run fn(*args) on behalf of stage, adding its wall and CPU time (of the
+calling thread) to the stage's metrics
+"""
+
+
+def timed(stage, fn, *args):
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        return fn(*args)
+    finally:
+        stage.wall_seconds = stage.wall_seconds + time.perf_counter() - wall
+        stage.cpu_seconds = stage.cpu_seconds + time.thread_time() - cpu
+
+
+"""Pass a block of vcfblock.VariantRecords through every stage
+The database connections of db, a refdb.MySqlBackend, if any, are
+health-checked before each stage. With a pool, the independent stages
+each compute a sidecar of (line, fragment) pairs for the block concurrently,
+merged in stage order as if the stages had run one after another.
+Each stage is timed, and charged with the records it read and the INFO
+bytes it added.
+"""
+
+
+def annotate_batch(stages, batch, db=None, pool=None):
+    if len(batch) == 0:
+        return batch
+
+    serial, independent = stages, []
+    if pool is not None:
+        serial, independent = stage_graph(stages)
+
+    # Each file-based stage re-reads the previous one's output, see restrip();
+    # the records' parsed columns stay valid throughout
+    for i in range(len(serial)):
+        if i > 0:
+            batch = [restrip(fields) for fields in batch]
+        if db is not None:
+            db.check()
+        before = info_bytes(batch)
+        serial[i].rows_read = serial[i].rows_read + len(batch)
+        batch = timed(serial[i], serial[i].annotateBatch, batch)
+        serial[i].bytes_written = serial[i].bytes_written + info_bytes(batch) - before
+
+    if len(independent) > 0:
+        if len(serial) > 0:
+            batch = [restrip(fields) for fields in batch]
+        if db is not None:
+            db.check()
+        sidecars = list(
+            pool.map(lambda stage: timed(stage, stage.sidecar, batch), independent)
+        )
+        for i in range(len(independent)):
+            if i > 0:
+                batch = [restrip(fields) for fields in batch]
+            stage = independent[i]
+            before = info_bytes(batch)
+            stage.rows_read = stage.rows_read + len(batch)
+            for line, fragment in sidecars[i]:
+                batch[line] = stage.merge(batch[line], fragment)
+            stage.bytes_written = stage.bytes_written + info_bytes(batch) - before
+
+    return batch
+
+
+"""Write a block of annotated fields as VCF lines
+"""
+
+
+def write_batch(fh_out, batch):
+    if len(batch) > 0:
+        fh_out.write("".join([vi.join_fields(fields) + "\n" for fields in batch]))
+
+
+"""How run() annotates a job
+Every option defaults to the original pipeline's behaviour; run.py sets them
+from annotator_config.ini, whose [ann] section says what each one does.
+"""
+
+
+class RunOptions(object):
+    defaults = {
+        # The original one-temp-file-per-stage pipeline (run_legacy())
+        "legacy": False,
+        # Stages to run (see select_stages()), the profile that named them,
+        # and a BED file of the only regions to annotate (see targets.py)
+        "stage_names": None,
+        "profile": None,
+        "targets": None,
+        # Reference snapshot root (snapshot.py), else SQLite replica
+        # (refdb.py), else MySQL
+        "snapshot_dir": None,
+        "reference_db": None,
+        # Range tables served from memory or by sweep join
+        "indexed_tables": (),
+        "sweep_tables": (),
+        # Variants per dbSNP lookup and data lines per parsed block
+        "batch_size": 1,
+        "block_lines": 1,
+        # Threads for the independent stages, and processes annotating byte
+        # ranges of at least min_chunk bytes (0 = one per CPU)
+        "stage_workers": 0,
+        "workers": 1,
+        "min_chunk": 1 << 22,
+        # Host variant cache (varcache.py) and the reference version it holds
+        "cache_path": None,
+        "cache_entries": 5000000,
+        "reference_version": "",
+        # dbSNP Bloom filter root (bloom.py)
+        "bloom_dir": None,
+        # BGZF .annot.vcf.gz output
+        "compress_output": False,
+        "compress_threads": 0,
+        # Resumable jobs (checkpoint.py), with the checkpoint's persist callback
+        "checkpoint": False,
+        "checkpoint_bytes": 1 << 26,
+        "on_checkpoint": None,
+        # Sorting of unsorted inputs (extsort.py), and putting the results
+        # back in input order
+        "sort_input": False,
+        "sort_memory": 1 << 28,
+        "keep_order": False,
+    }
+
+    def __init__(self, **options):
+        for name in options:
+            if name not in self.defaults:
+                raise TypeError(f"Unknown run option {name}")
+        for name in self.defaults:
+            setattr(self, name, options.get(name, self.defaults[name]))
+
+
+"""Annotate a VCF, see RunOptions
+The streaming pipeline parses every variant once, passes it through all
+stages in memory and writes it once to the final .annot.vcf; its output is
+byte-identical to run_legacy()'s. Metrics go to <input>.metrics.json.
+"""
+
+
+def run(infile, format, options=None):
+    if options is None:
+        options = RunOptions()
+    legacy = options.legacy
+    workers = options.workers
+    min_chunk = options.min_chunk
+    settings = {
+        "format": format,
+        "indexed_tables": options.indexed_tables,
+        "batch_size": options.batch_size,
+        "sweep_tables": options.sweep_tables,
+        "snapshot_dir": options.snapshot_dir,
+        "stage_workers": options.stage_workers,
+        "cache_path": options.cache_path,
+        "cache_entries": options.cache_entries,
+        "reference_version": options.reference_version,
+        "bloom_dir": options.bloom_dir,
+        "block_lines": options.block_lines,
+        "compress_output": options.compress_output,
+        "compress_threads": options.compress_threads,
+        "targets": None,
+        "stage_names": None,
+        "reference_db": None,
+        "sort_input": options.sort_input,
+        "keep_order": options.keep_order,
+    }
+    if options.stage_names is not None:
+        settings["stage_names"] = select_stages(options.stage_names)
+    notes = []
+    if legacy and settings["stage_names"] not in (None, STAGE_NAMES):
+        notes.append(
+            f"## Profile {options.profile} selects a subset of stages; running the "
+            + "streaming pipeline instead of the legacy one"
+        )
+        legacy = False
+    if options.targets:
+        settings["targets"] = tg.load_bed(options.targets)
+    if options.reference_db and not options.snapshot_dir:
+        settings["reference_db"] = options.reference_db
+    counts = tg.TargetCounts()
+    method = "scan"
+    job = {
+        "input": os.path.basename(bz.plain_name(infile)),
+        "pipeline": "legacy" if legacy else "streaming",
+        "profile": options.profile,
+        "stages": settings["stage_names"] or STAGE_NAMES,
+        "batch_size": options.batch_size,
+        "block_lines": options.block_lines,
+        "stage_workers": options.stage_workers,
+        "indexed_tables": list(options.indexed_tables),
+        "sweep_tables": list(options.sweep_tables),
+        "snapshot": options.snapshot_dir is not None,
+        "reference_db": (
+            options.reference_db is not None and options.snapshot_dir is None
+        ),
+        "compressed_input": bz.is_compressed(infile),
+    }
+
+    # Seeking to the targets beats splitting the whole file into ranges
+    if settings["targets"] is not None and not legacy and tbx.has_index(infile):
+        method = "tabix"
+        workers = 1
+
+    # Output and log are named after the input without its .gz
+    base = bz.plain_name(infile)
+    journal = None
+    if options.checkpoint and method != "tabix":
+        fingerprint = job_fingerprint(infile, legacy, settings, options.targets)
+        journal = ck.JobCheckpoint(base, fingerprint, options.on_checkpoint)
+        if journal.resume(ck.OUTPUT_STEP) is not None:
+            # An earlier attempt finished, but its results were not uploaded
+            print("Output of the job is complete already, nothing to annotate")
+            return
+    reports = notes
+    plain_copy = None
+    if bz.is_compressed(infile) and (legacy or workers != 1 or journal is not None):
+        # Byte ranges and the legacy temp files need the plain text
+        if base == infile:
+            os.rename(infile, infile + ".gz")
+            infile = infile + ".gz"
+        bz.decompress(infile, base)
+        reports.append(bz.input_report(infile, os.path.getsize(base)))
+        infile = plain_copy = base
+
+    if legacy:
+        if settings["targets"] is not None:
+            # The legacy stages read the file by name, so it is replaced by
+            # its targeted lines for the run
+            os.rename(infile, base + ".all")
+            filter_file(base + ".all", base, settings["targets"], counts)
+            reports.append(tg.report(settings["targets"], counts, method))
+        start = time.time()
+        if settings["reference_db"]:
+            dbc.close_shared()
+            dbc.configure(connect=rd.open_replica(options.reference_db).connection)
+        try:
+            run_legacy(base, format, journal)
+        finally:
+            dbc.close_shared()
+            dbc.configure()
+        seconds = time.time() - start
+        variants = count_variants(annotated_name(base))
+        if options.compress_output:
+            writer = compress_file(annotated_name(base), settings)
+            reports.append(writer.report())
+            job["compression"] = compression_metrics(writer)
+        write_reports(base, reports)
+        if journal is not None:
+            job["checkpoint"] = journal.report()
+        write_metrics(base, job, [], variants, seconds, settings, counts, method)
+        if journal is not None:
+            journal.finish([output_name(base, settings)], [base + ".count.log"])
+        if settings["targets"] is not None:
+            fu.delete(base)
+            if plain_copy is None:
+                os.rename(base + ".all", base)
+            else:
+                fu.delete(base + ".all")
+        elif plain_copy is not None:
+            fu.delete(plain_copy)
+        return
 
     print("Running . . .")
+    if options.cache_path and not options.reference_version:
+        print("No reference version configured, not using the variant cache")
+        settings["cache_path"] = None
+    annotfile = base + ".annot"
 
-    ann.getSnpsFromDbSnp(vcf=infile, format="vcf", tmpextin="", tmpextout=".1")
-    print("dbSNP - done.")
-    tmpextin = 1
-    tmpextout = 2
+    # Stages read the sorted copy, if any, already filtered to the targets;
+    # output to be put back in input order is first written plain
+    stage_options = settings
+    order = None
+    if options.sort_input and method != "tabix":
+        sorting = sort_input_file(infile, base, settings, counts, options.sort_memory)
+        job["sort"] = sorting
+        if not sorting["input_sorted"]:
+            stage_options = dict(settings)
+            stage_options["targets"] = None
+            if bz.is_compressed(infile):
+                reports.append(bz.input_report(infile, sorting["input_bytes"]))
+            infile = base + ".sorted"
+            if options.keep_order:
+                order = base + ".order"
+                stage_options["compress_output"] = False
 
-    ann.getBigRefGene(
-        vcf=infile,
-        format="vcf",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("BigRefGene - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.getGenes(
-        vcf=infile,
-        format="vcf",
-        table="refGene",
-        promoter_offset=500,
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("BigRefGene - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCytoband(
-        vcf=infile,
-        format="vcf",
-        table="cytoBand",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("Cytoband - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGadAll(
-        vcf=infile,
-        format="vcf",
-        table="gadAll",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("gadAll - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGwasCatalog(
-        vcf=infile,
-        format="vcf",
-        table="gwasCatalog",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("GwasCatalog - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithMiRNA(
-        vcf=infile,
-        format="vcf",
-        table="targetScanS",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("miRNA - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWitHUGOGeneNomenclature(
-        vcf=infile,
-        format="vcf",
-        table="hugo",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("HUGO Gene Nomenclature Committee - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(
-        vcf=infile,
-        format="vcf",
-        table="dgv_Cnv",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("dgv_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(
-        vcf=infile,
-        format="vcf",
-        table="abParts_IG_T_CelReceptors",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("abParts_IG_T_CelReceptors - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(
-        vcf=infile,
-        format="vcf",
-        table="mcCarroll_Cnv",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
-    )
-    print("mcCarroll_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(
-        vcf=infile,
-        format="vcf",
-        table="conrad_Cnv",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
+    # Checkpointed ranges are small enough that little is lost if one is cut
+    # short; they are annotated at most workers at a time
+    ranges = []
+    if workers != 1 or journal is not None:
+        if workers <= 0:
+            workers = ch.available_cpus()
+        k = workers
+        if journal is not None:
+            k = max(workers, -(-os.path.getsize(infile) // options.checkpoint_bytes))
+            min_chunk = min(min_chunk, options.checkpoint_bytes)
+        header_end, ranges = ch.split_ranges(infile, k, min_chunk)
+    if len(ranges) > 1:
+        job["pipeline"] = "chunked"
+        job["workers"] = min(workers, len(ranges))
+        job["ranges"] = len(ranges)
+
+    fh_out = open_output(annotfile, stage_options)
+    start = time.time()
+    if len(ranges) > 1:
+        stages, variants = run_chunked(
+            infile,
+            fh_out,
+            header_end,
+            ranges,
+            stage_options,
+            counts,
+            processes=workers,
+            checkpoint=journal,
+        )
+    elif method == "tabix":
+        lines = tbx.region_lines(infile, settings["targets"], counts)
+        stages, variants = annotate_lines(lines, fh_out, settings)
+    else:
+        compressed = bz.is_compressed(infile)
+        fh = bz.open_text(infile)
+        lines = fh
+        if stage_options["targets"] is not None:
+            lines = tg.filter_lines(fh, stage_options["targets"], counts)
+        stages, variants = annotate_lines(lines, fh_out, stage_options)
+        if compressed:
+            reports.append(bz.input_report(infile, fh.buffer.tell()))
+        fh.close()
+    seconds = time.time() - start
+    if settings["targets"] is not None:
+        reports.insert(0, tg.report(settings["targets"], counts, method))
+    reports.insert(0, profile_report(options.profile, stages, variants, seconds))
+    fh_out.close()
+    if order is not None:
+        fh_out = open_output(annotfile + ".tmp", settings)
+        with open(annotfile) as fh, open(order) as fh_order:
+            es.restore_order(fh, fh_order, fh_out, annotfile, options.sort_memory)
+        fh_out.close()
+        os.replace(annotfile + ".tmp", annotfile)
+    if options.compress_output:
+        reports.append(fh_out.report())
+        job["compression"] = compression_metrics(fh_out)
+
+    fh_log = open(base + ".count.log", "w")
+    for stage in stages:
+        stage.summary(fh_log)
+        print(f"{stage.label} - done.")
+    for stage in stages:
+        lookups = stage.cache_hits + stage.cache_misses
+        if lookups > 0:
+            fh_log.write(
+                f"## Variant cache {stage.label}: {str(stage.cache_hits)} hits in "
+                + f"{str(lookups)} lookups "
+                + f"({100.0 * stage.cache_hits / lookups:.1f}%)\n"
+            )
+    fh_log.close()
+    write_reports(base, reports)
+
+    os.rename(annotfile, output_name(base, settings))
+    if journal is not None:
+        job["checkpoint"] = journal.report()
+    write_metrics(base, job, stages, variants, seconds, settings, counts, method)
+    if journal is not None:
+        journal.finish([output_name(base, settings)], [base + ".count.log"])
+    if plain_copy is not None:
+        fu.delete(plain_copy)
+    if infile == base + ".sorted":
+        fu.delete(infile)
+    if order is not None:
+        fu.delete(order)
+
+
+"""Sort the streaming pipeline's input into <base>.sorted unless it is
+coordinate-sorted already, keeping only the variants inside the targets
+With keep_order, the input position of each sorted line goes to
+<base>.order. Returns the sort's metrics; input_bytes is the length of the
+VCF text read.
+"""
+
+
+def sort_input_file(infile, base, options, counts, memory):
+    start = time.time()
+    with bz.open_text(infile) as fh:
+        ordered = es.is_sorted(fh)
+    sorting = {"input_sorted": ordered, "runs": 0, "seconds": 0.0}
+    if ordered:
+        print("Input is coordinate-sorted")
+        return sorting
+
+    print("Input is not coordinate-sorted, sorting it . . .")
+    fh_order = None
+    if options["keep_order"]:
+        fh_order = open(base + ".order", "w")
+    with bz.open_text(infile) as fh, open(base + ".sorted", "w") as fh_out:
+        lines = fh
+        if options["targets"] is not None:
+            lines = tg.filter_lines(fh, options["targets"], counts)
+        prefix = base + ".sorted"
+        variants, runs = es.sort_lines(lines, fh_out, prefix, memory, fh_order)
+        sorting["input_bytes"] = fh.buffer.tell()
+    if fh_order is not None:
+        fh_order.close()
+    sorting["variants"] = variants
+    sorting["runs"] = runs
+    sorting["seconds"] = round(time.time() - start, 3)
+    where = f"{str(runs)} runs" if runs > 0 else "memory"
+    print(f"Sorted {str(variants)} variants in {where}")
+    return sorting
+
+
+"""What a checkpoint of the job is only valid for: the input and every
+option the annotated output depends on
+"""
+
+
+def job_fingerprint(infile, legacy, options, targets):
+    size, sha256 = ck.file_digest(infile)
+    fingerprint = {
+        "input_bytes": size,
+        "input_sha256": sha256,
+        "pipeline": "legacy" if legacy else "streaming",
+        "format": options["format"],
+        "stages": options["stage_names"] or STAGE_NAMES,
+        "targets_sha256": ck.file_digest(targets)[1] if targets else None,
+        "compress_output": options["compress_output"],
+        "snapshot_dir": options["snapshot_dir"],
+        "reference_db": options["reference_db"],
+        "reference_version": options["reference_version"],
+        "sort_input": options["sort_input"],
+        "keep_order": options["keep_order"],
+    }
+    return fingerprint
+
+
+"""Name of the final annotated file, .annot.vcf.gz if it is compressed
+"""
+
+
+def output_name(infile, options):
+    if options["compress_output"]:
+        return annotated_name(infile) + ".gz"
+    return annotated_name(infile)
+
+
+"""Open the annotated output for writing, as BGZF if compress_output is set
+"""
+
+
+def open_output(path, options, eof=True, threads=None):
+    if not options["compress_output"]:
+        return open(path, "w")
+    if threads is None:
+        threads = options["compress_threads"]
+    return bz.BgzfWriter(path, threads=threads, eof=eof)
+
+
+"""Compress a finished plain annotated file to BGZF, replacing it
+"""
+
+
+def compress_file(path, options):
+    writer = open_output(path + ".tmp", options)
+    with open(path) as fh:
+        while True:
+            text = fh.read(1 << 20)
+            if not text:
+                break
+            writer.write(text)
+    writer.close()
+    os.rename(path + ".tmp", path + ".gz")
+    fu.delete(path)
+    return writer
+
+
+"""One .count.log line on the stages a job ran and the time they took
+"""
+
+
+def profile_report(profile, stages, variants, seconds):
+    rate = variants / seconds if seconds > 0 else 0.0
+    name = f"Profile {profile}" if profile else "All stages"
+    return (
+        f"## {name}: {str(len(stages))} of {str(len(STAGE_REGISTRY))} stages, "
+        + f"{str(variants)} variants in {seconds:.2f} seconds ({rate:.1f} variants/s)"
     )
-    print("conrad_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGenomicSuperDups(
-        vcf=infile,
-        format="vcf",
-        table="genomicSuperDups",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
+
+
+"""Write the job's metrics report next to its .count.log
+"""
+
+
+def write_metrics(base, job, stages, variants, seconds, options, counts, method):
+    job = dict(job)
+    output = output_name(base, options)
+    job["output_bytes"] = os.path.getsize(output) if os.path.exists(output) else 0
+    if options["targets"] is not None:
+        job["targets"] = {
+            "regions": options["targets"].count(),
+            "kept": counts.kept,
+            "skipped": counts.skipped,
+            "method": method,
+        }
+    report = mt.job_report(job, stages, variants, seconds)
+    mt.write_report(mt.report_name(base), report)
+
+
+def compression_metrics(writer):
+    return {
+        "text_bytes": writer.text_bytes,
+        "compressed_bytes": writer.compressed_bytes,
+        "cpu_seconds": round(writer.compress_seconds, 3),
+        "threads": writer.threads,
+    }
+
+
+"""Number of data lines of a plain VCF
+"""
+
+
+def count_variants(path):
+    variants = 0
+    with open(path) as fh:
+        for line in fh:
+            if not line.startswith("#"):
+                variants = variants + 1
+    return variants
+
+
+"""Copy the header and the data lines inside targets of a VCF to out_path
+"""
+
+
+def filter_file(path, out_path, targets, counts):
+    with bz.open_text(path) as fh, open(out_path, "w") as fh_out:
+        for line in tg.filter_lines(fh, targets, counts):
+            fh_out.write(line)
+
+
+"""Add input, target and compression lines to the .count.log
+"""
+
+
+def write_reports(infile, reports):
+    if len(reports) == 0:
+        return
+    fh_log = open(infile + ".count.log", "a")
+    for line in reports:
+        print(line)
+        fh_log.write(line + "\n")
+    fh_log.close()
+
+
+"""Reference the stages read: the current snapshot in snapshot_dir, the
+SQLite replica at reference_db, or the MySQL database
+"""
+
+
+def open_reference(options):
+    if options["snapshot_dir"]:
+        snap = sn.open_snapshot(options["snapshot_dir"])
+        print(f"Using reference snapshot {snap.version}")
+        return snap
+    if options["reference_db"]:
+        replica = rd.open_replica(options["reference_db"])
+        print(f"Using reference replica {replica.path}")
+        return replica
+    return rd.MySqlBackend()
+
+
+"""Annotate lines of a VCF and write them to fh_out
+Returns the closed stages, whose counters hold the statistics for the lines,
+and the number of data lines.
+"""
+
+
+def annotate_lines(lines, fh_out, options):
+    batch_size = options["batch_size"]
+    bloom = None
+    if options["bloom_dir"]:
+        bloom = bl.open_filter(options["bloom_dir"])
+    stages = build_stages(
+        format=options["format"],
+        indexed_tables=options["indexed_tables"],
+        batch_size=batch_size,
+        sweep_tables=options["sweep_tables"],
+        bloom=bloom,
+        stage_names=options["stage_names"],
     )
-    print("genomicSuperDups - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithTfbsConsSites(
-        vcf=infile,
-        table="tfbsConsSites",
-        tmpextin="." + str(tmpextin),
-        tmpextout="." + str(tmpextout),
+
+    # A reference snapshot or local replica replaces the database entirely
+    backend = open_reference(options)
+    db = backend if backend.kind == "mysql" else None
+
+    # Mapped snapshot and indexed replica lookups are cheaper than the cache
+    cache = None
+    if options["cache_path"] and db is not None:
+        cache = vc.VariantCache(
+            options["cache_path"],
+            options["reference_version"],
+            options["cache_entries"],
+        )
+
+    # pymysql connections are not thread-safe, so the backend gives every
+    # pool thread a connection of its own
+    pool = None
+    if options["stage_workers"] > 0:
+        pool = ThreadPoolExecutor(max_workers=options["stage_workers"])
+    for stage in stages:
+        timed(stage, stage.open, backend, cache)
+
+    # Data lines are parsed and annotated a block at a time
+    format = options["format"]
+    block_lines = max(batch_size, options["block_lines"])
+    batch = []
+    variants = 0
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#"):
+            block = vb.parse_block(batch, format)
+            write_batch(fh_out, annotate_batch(stages, block, db, pool))
+            batch = []
+            fh_out.write(line + "\n")
+            continue
+
+        batch.append(line)
+        variants = variants + 1
+        if len(batch) >= block_lines:
+            block = vb.parse_block(batch, format)
+            write_batch(fh_out, annotate_batch(stages, block, db, pool))
+            batch = []
+
+    block = vb.parse_block(batch, format)
+    write_batch(fh_out, annotate_batch(stages, block, db, pool))
+
+    for stage in stages:
+        stage.close()
+    if pool is not None:
+        pool.shutdown()
+    if cache is not None:
+        cache.close()
+    if db is not None:
+        db.close()
+    dbc.close_shared()
+    return stages, variants
+
+
+"""Annotate the data ranges of a VCF in parallel processes
+Each process writes a part file, concatenated in order after the header,
+and the stage counters of all parts are summed. At most processes ranges
+run at a time; a checkpoint.JobCheckpoint skips parts already recorded.
+"""
+
+
+def run_chunked(
+    infile,
+    fh_out,
+    header_end,
+    ranges,
+    options,
+    target_counts,
+    processes=None,
+    checkpoint=None,
+):
+    print(f"Annotating {len(ranges)} chunks in parallel")
+    parts = [infile + ".part" + str(i) for i in range(len(ranges))]
+    steps = [f"range {str(start)}-{str(end)}" for start, end in ranges]
+    results = [None] * len(ranges)
+    if checkpoint is not None:
+        for i in range(len(ranges)):
+            results[i] = checkpoint.resume(steps[i])
+    pending = [i for i in range(len(ranges)) if results[i] is None]
+    if len(pending) < len(ranges):
+        print(f"Resuming with {str(len(ranges) - len(pending))} chunks already done")
+    if len(pending) > 0:
+        workers = min(processes or len(pending), len(pending))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for i in pending:
+                start, end = ranges[i]
+                args = (infile, start, end, parts[i], options)
+                futures[pool.submit(annotate_chunk, *args)] = i
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if checkpoint is not None:
+                    checkpoint.record(steps[i], [parts[i]], values=list(results[i]))
+    counts = [result[0] for result in results]
+    for kept, skipped in [result[2] for result in results]:
+        target_counts.add(kept, skipped)
+    variants = sum([result[3] for result in results])
+
+    # BGZF parts are members of one file, concatenated before the EOF block
+    for line in ch.range_lines(infile, 0, header_end):
+        fh_out.write(line.strip() + "\n")
+    ch.concat(fh_out, parts)
+    for part in parts:
+        fu.delete(part)
+    if options["compress_output"]:
+        for text_bytes, compressed_bytes, seconds in [r[1] for r in results]:
+            fh_out.text_bytes = fh_out.text_bytes + text_bytes
+            fh_out.compressed_bytes = fh_out.compressed_bytes + compressed_bytes
+            fh_out.compress_seconds = fh_out.compress_seconds + seconds
+        used = min(processes or len(ranges), len(ranges))
+        fh_out.threads = max(fh_out.threads, used)
+
+    stages = build_stages(
+        format=options["format"],
+        indexed_tables=options["indexed_tables"],
+        batch_size=options["batch_size"],
+        sweep_tables=options["sweep_tables"],
+        stage_names=options["stage_names"],
     )
-    print("addOverlapWithTfbsConsSites - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
+    for part_counts in counts:
+        for stage, stage_counts in zip(stages, part_counts):
+            stage.mergeCounts(stage_counts)
+    return stages, variants
+
+
+"""Worker process: annotate bytes [start, end) of infile into outfile
+Returns the stage counters, for BGZF output the part's (text bytes,
+compressed bytes, compression seconds), the (kept, skipped) counts of the
+target filter and the number of data lines annotated; each part is
+compressed on one thread, the processes already use the CPUs.
+"""
+
+
+def annotate_chunk(infile, start, end, outfile, options):
+    fh_out = open_output(outfile, options, eof=False, threads=1)
+    lines = ch.range_lines(infile, start, end)
+    counts = tg.TargetCounts()
+    if options["targets"] is not None:
+        lines = tg.filter_lines(lines, options["targets"], counts)
+    stages, variants = annotate_lines(lines, fh_out, options)
+    fh_out.close()
+    compressed = None
+    if options["compress_output"]:
+        compressed = (
+            fh_out.text_bytes,
+            fh_out.compressed_bytes,
+            fh_out.compress_seconds,
+        )
+    kept = (counts.kept, counts.skipped)
+    return [stage.counts() for stage in stages], compressed, kept, variants
+
+
+"""Stages of the legacy pipeline: the annotate.py function, its arguments
+besides the file names and the label printed once it is done
+"""
+
+LEGACY_STAGES = [
+    (ann.getSnpsFromDbSnp, {"format": "vcf"}, "dbSNP"),
+    (ann.getBigRefGene, {"format": "vcf"}, "BigRefGene"),
+    (
+        ann.getGenes,
+        {"format": "vcf", "table": "refGene", "promoter_offset": 500},
+        "BigRefGene",
+    ),
+    (ann.addOverlapWithCytoband, {"format": "vcf", "table": "cytoBand"}, "Cytoband"),
+    (ann.addOverlapWithGadAll, {"format": "vcf", "table": "gadAll"}, "gadAll"),
+    (
+        ann.addOverlapWithGwasCatalog,
+        {"format": "vcf", "table": "gwasCatalog"},
+        "GwasCatalog",
+    ),
+    (ann.addOverlapWithMiRNA, {"format": "vcf", "table": "targetScanS"}, "miRNA"),
+    (
+        ann.addOverlapWitHUGOGeneNomenclature,
+        {"format": "vcf", "table": "hugo"},
+        "HUGO Gene Nomenclature Committee",
+    ),
+    (ann.addOverlapWithCnvDatabase, {"format": "vcf", "table": "dgv_Cnv"}, "dgv_Cnv"),
+    (
+        ann.addOverlapWithCnvDatabase,
+        {"format": "vcf", "table": "abParts_IG_T_CelReceptors"},
+        "abParts_IG_T_CelReceptors",
+    ),
+    (
+        ann.addOverlapWithCnvDatabase,
+        {"format": "vcf", "table": "mcCarroll_Cnv"},
+        "mcCarroll_Cnv",
+    ),
+    (
+        ann.addOverlapWithCnvDatabase,
+        {"format": "vcf", "table": "conrad_Cnv"},
+        "conrad_Cnv",
+    ),
+    (
+        ann.addOverlapWithGenomicSuperDups,
+        {"format": "vcf", "table": "genomicSuperDups"},
+        "genomicSuperDups",
+    ),
+    (
+        ann.addOverlapWithTfbsConsSites,
+        {"table": "tfbsConsSites"},
+        "addOverlapWithTfbsConsSites",
+    ),
+]
+
+
+"""File-based pipeline: one pass and one temp file per stage
+Kept for comparison with the streaming pipeline. Stage n reads
+<infile>.<n-1> (the input itself for the first) and writes <infile>.<n>.
+With a checkpoint.JobCheckpoint, each finished stage's output and the
+.count.log so far are recorded, and a run started again goes on after the
+last stage recorded.
+"""
+
+
+def run_legacy(infile, format, checkpoint=None):
+
+    print("Running . . .")
+
+    first = 0
+    if checkpoint is not None:
+        first = resume_legacy(checkpoint)
+        if first > 0:
+            print(f"Resuming after stage {str(first)} of {str(len(LEGACY_STAGES))}")
+
+    for i in range(first, len(LEGACY_STAGES)):
+        function, arguments, label = LEGACY_STAGES[i]
+        tmpextin = "." + str(i) if i > 0 else ""
+        tmpextout = "." + str(i + 1)
+        function(vcf=infile, tmpextin=tmpextin, tmpextout=tmpextout, **arguments)
+        print(f"{label} - done.")
+        if checkpoint is not None:
+            checkpoint.record(
+                legacy_step(i + 1),
+                [infile + tmpextout],
+                values={"stage": i + 1},
+                logs=[infile + ".count.log"],
+                replace=True,
+            )
+
+    dbc.close_shared()
 
     ## Cleanup
-    for i in range(1, tmpextin):
+    last = len(LEGACY_STAGES)
+    for i in range(1, last):
         fu.delete(infile + "." + str(i))
 
-    os.rename(infile + "." + str(tmpextin), infile + ".annot")
-    finalout = (infile + ".annot").replace(".vcf.annot", ".annot.vcf")
-    os.rename(infile + ".annot", finalout)
+    os.rename(infile + "." + str(last), infile + ".annot")
+    os.rename(infile + ".annot", annotated_name(infile))
+
+
+def legacy_step(stage):
+    return "legacy stage " + str(stage)
+
+
+"""Number of legacy stages already done, according to the checkpoint
+"""
+
+
+def resume_legacy(checkpoint):
+    for stage in range(len(LEGACY_STAGES), 0, -1):
+        values = checkpoint.resume(legacy_step(stage))
+        if values is not None:
+            return values["stage"]
+    return 0
 
 
 ### EOF
@@ -0,0 +1,200 @@
+# extsort.py
+#
+# Bounded-memory external sort of VCF inputs into coordinate order
+#
+# Sweep joins (see sweep.py), the locality of the variant cache and byte
+# range chunking all do best on a coordinate-sorted input, but uploads come
+# in any order. is_sorted() tells by streaming the file once; sort_lines()
+# sorts one with a k-way external merge sort: data lines are gathered up to
+# a memory budget, sorted and spilled to run files next to the output, and
+# the runs are merged (in several passes if there are more than MAX_FANIN
+# of them). Chromosomes keep the order they first appear in, compared with
+# the "chr" prefix the stages add, and variants at the same position keep
+# their input order. The input position of every sorted line can be written
+# to an order file, for restore_order() to put the annotated lines back in
+# input order.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import heapq
+
+import file_utils as fu
+
+# Most run files merged at once
+MAX_FANIN = 64
+
+# Bytes a buffered line is charged for on top of its text (the tuple, its
+# key and the string object)
+LINE_OVERHEAD = 120
+
+
+"""Chromosome name as the stages look it up
+"""
+
+
+def normal_chrom(chrom):
+    chrom = chrom.strip()
+    if not chrom.startswith("chr"):
+        chrom = "chr" + chrom
+    return chrom
+
+
+"""POS of a data line, 0 if it cannot be read (the stages deal with it)
+"""
+
+
+def position(fields):
+    try:
+        return int(fields[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+"""Whether the data lines are coordinate-sorted: every chromosome in one
+contiguous block, in which positions never go down
+"""
+
+
+def is_sorted(lines):
+    done = set()
+    chrom = None
+    pos = 0
+    for line in lines:
+        if line.startswith("#"):
+            continue
+        fields = line.split("\t", 2)
+        next_chrom = normal_chrom(fields[0])
+        next_pos = position(fields)
+        if next_chrom != chrom:
+            if next_chrom in done:
+                return False
+            if chrom is not None:
+                done.add(chrom)
+            chrom = next_chrom
+        elif next_pos < pos:
+            return False
+        pos = next_pos
+    return True
+
+
+"""Sorts (key, line) records in bounded memory, key a tuple of ints
+Records are buffered until they take up about memory bytes, then sorted and
+spilled to a run file prefix.run<n>. merged() yields all records in key
+order, deleting the run files once they are read.
+"""
+
+
+class ExternalSorter(object):
+    def __init__(self, prefix, memory):
+        self.prefix = prefix
+        self.memory = memory
+        self.buffer = []
+        self.buffered = 0
+        self.width = 0
+        self.runs = []
+        self.spilled = 0
+
+    def add(self, key, line):
+        self.buffer.append((key, line))
+        self.width = len(key)
+        self.buffered = self.buffered + len(line) + LINE_OVERHEAD
+        if self.buffered >= self.memory:
+            self.spill()
+
+    def spill(self):
+        self.buffer.sort(key=lambda record: record[0])
+        self.runs.append(self.write_run(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def write_run(self, records):
+        path = self.prefix + ".run" + str(self.spilled)
+        self.spilled = self.spilled + 1
+        with open(path, "w") as fh:
+            for key, line in records:
+                fh.write("\t".join([str(k) for k in key]) + "\t" + line + "\n")
+        return path
+
+    def read_run(self, path):
+        width = self.width
+        with open(path) as fh:
+            for text in fh:
+                fields = text[:-1].split("\t", width)
+                yield tuple([int(k) for k in fields[:width]]), fields[width]
+
+    def merge(self, paths):
+        runs = [self.read_run(path) for path in paths]
+        return heapq.merge(*runs, key=lambda record: record[0])
+
+    def merged(self):
+        if len(self.runs) == 0:
+            self.buffer.sort(key=lambda record: record[0])
+            records = self.buffer
+            self.buffer = []
+            yield from records
+            return
+
+        if len(self.buffer) > 0:
+            self.spill()
+        while len(self.runs) > MAX_FANIN:
+            paths = self.runs[:MAX_FANIN]
+            self.runs = self.runs[MAX_FANIN:] + [self.write_run(self.merge(paths))]
+            for path in paths:
+                fu.delete(path)
+        yield from self.merge(self.runs)
+        for path in self.runs:
+            fu.delete(path)
+        self.runs = []
+
+
+"""Write lines of a VCF to fh_out with the data lines in coordinate order
+and every header line first; runs are spilled next to prefix. With fh_order,
+the input position (0-based data line number) of each data line written is
+written there, one per line. Returns the number of data lines and of runs.
+"""
+
+
+def sort_lines(lines, fh_out, prefix, memory, fh_order=None):
+    sorter = ExternalSorter(prefix, memory)
+    ranks = {}
+    variants = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("#"):
+            fh_out.write(line + "\n")
+            continue
+        fields = line.split("\t", 2)
+        rank = ranks.setdefault(normal_chrom(fields[0]), len(ranks))
+        sorter.add((rank, position(fields), variants), line)
+        variants = variants + 1
+
+    for key, line in sorter.merged():
+        fh_out.write(line + "\n")
+        if fh_order is not None:
+            fh_order.write(str(key[2]) + "\n")
+    return variants, sorter.spilled
+
+
+"""Write the lines of a VCF annotated in sorted order to fh_out in input
+order, given the order file sort_lines() wrote; header lines come first
+"""
+
+
+def restore_order(lines, fh_order, fh_out, prefix, memory):
+    sorter = ExternalSorter(prefix, memory)
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("#"):
+            fh_out.write(line + "\n")
+            continue
+        sorter.add((int(fh_order.readline()),), line)
+
+    for key, line in sorter.merged():
+        fh_out.write(line + "\n")
+    return sorter.spilled
+
+
+### EOF
@@ -0,0 +1,174 @@
+# genemodel.py
+#
+# Precomputed gene-model features for the refGene location stage
+#
+# getGenes classifies a variant against every transcript near it by
+# decoding and splitting the exonStarts/exonEnds blobs and walking the exons
+# one by one. Here every transcript is turned into feature segments once
+# per process, for a given promoter offset: its scan window, the pieces of
+# its exons inside the CDS (or its exons, for non-coding transcripts) and
+# its promoter flank, each tagged with the transcript, exon number, strand
+# and region class. The segments go into an implicit interval tree, so a
+# variant is classified with one stab query.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import annotate as ann
+import intervals as iv
+
+WINDOW = 0
+EXON = 1
+NON_CODING_EXON = 2
+PROMOTER = 3
+
+"""One refGene row, reduced to what the Genes stage reports
+prefix holds the name2/name/strand parts annotate.collapseGeneNames()
+puts before the region, label() the whole entry.
+"""
+
+
+class Transcript(object):
+    def __init__(self, row):
+        self.row = row
+        self.strand = str(row[3])
+        self.txStart = int(row[4])
+        self.txEnd = int(row[5])
+        self.cdsStart = int(row[6])
+        self.cdsEnd = int(row[7])
+        self.exonCount = int(row[8])
+        self.coding = self.cdsStart != self.cdsEnd
+        self.prefix = ann.collapseGeneNames(row, ann.indicesKnownGenes, "", 0).split(
+            ";"
+        )[:-1]
+
+    def label(self, region):
+        return ";".join(self.prefix + [region])
+
+    def exons(self):
+        exonsSt = text(self.row[9]).split(",")
+        exonsEn = text(self.row[10]).split(",")
+        for e in range(0, self.exonCount):
+            exnum = e + 1
+            if self.strand == "-":
+                exnum = self.exonCount - e
+            yield int(exonsSt[e]), int(exonsEn[e]), "ex" + str(exnum) + "/" + str(
+                self.exonCount
+            )
+
+    """Closed feature segments of this transcript, in the order getGenes
+    reports them
+    """
+
+    def features(self, promoter_offset):
+        features = [
+            (self.txStart - promoter_offset, self.txEnd + promoter_offset, WINDOW, None)
+        ]
+
+        if not self.coding:
+            for start, end, label in self.exons():
+                features.append((start, end, NON_CODING_EXON, label))
+            return features
+
+        for start, end, label in self.exons():
+            start = max(start, self.cdsStart)
+            end = min(end, self.cdsEnd)
+            if start <= end:
+                features.append((start, end, EXON, label))
+
+        # The promoter flank only counts outside [cdsStart, cdsEnd]
+        if self.strand == "+":
+            flank = (self.txStart - promoter_offset, self.txStart)
+        elif self.strand == "-":
+            flank = (self.txEnd, self.txEnd + promoter_offset)
+        else:
+            return features
+        for start, end in subtract(flank, (self.cdsStart, self.cdsEnd)):
+            features.append((start, end, PROMOTER, None))
+        return features
+
+
+def text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+"""Parts of the closed interval a that lie outside the closed interval b
+"""
+
+
+def subtract(a, b):
+    pieces = []
+    if a[0] < b[0]:
+        pieces.append((a[0], min(a[1], b[0] - 1)))
+    if a[1] > b[1]:
+        pieces.append((max(a[0], b[1] + 1), a[1]))
+    return [p for p in pieces if p[0] <= p[1]]
+
+
+"""Feature segments of every transcript of a table, for one promoter offset
+lookup() returns, in table-scan order, each transcript whose window
+contains the position, paired with the (kind, label) of its features that
+contain it, in exon order.
+"""
+
+
+class GeneModel(object):
+    def __init__(self, promoter_offset):
+        self.promoter_offset = promoter_offset
+        self.index = iv.IntervalIndex()
+
+    def add(self, chrom, row):
+        transcript = Transcript(row)
+        for start, end, kind, label in transcript.features(self.promoter_offset):
+            self.index.add(chrom, start, end, (transcript, kind, label))
+
+    def build(self):
+        self.index.build()
+        return self
+
+    def lookup(self, chrom, pos):
+        transcripts = []
+        for transcript, kind, label in self.index.stab(chrom, pos):
+            if kind == WINDOW:
+                transcripts.append((transcript, []))
+            elif len(transcripts) > 0 and transcripts[-1][0] is transcript:
+                transcripts[-1][1].append((kind, label))
+        return transcripts
+
+
+_models = {}
+
+"""Build the model of a table once per process, from the database or from
+the copy of the table in a snapshot or replica (see refdb.py)
+"""
+
+
+def load_model(conn, table, promoter_offset, snap=None):
+    key = (table, promoter_offset, None if snap is None else snap.path)
+    if key in _models:
+        return _models[key]
+
+    model = GeneModel(promoter_offset)
+    if snap is not None:
+        source = snap.table(table)
+        for chrom in source.chromosomes():
+            for row in source.overlap(chrom, -(1 << 62), 1 << 62):
+                model.add(chrom, row)
+    else:
+        cursor = conn.cursor()
+        cursor.execute("select * from " + table + ";")
+        names = [str(d[0]) for d in cursor.description]
+        chrom_ind = names.index("chrom")
+        for row in cursor.fetchall():
+            model.add(str(row[chrom_ind]), row)
+        cursor.close()
+
+    _models[key] = model.build()
+    return _models[key]
+
+
+### EOF
@@ -0,0 +1,216 @@
+# intervals.py
+#
+# In-memory interval index for the range-overlap annotation stages
+#
+# Each chromosome is kept as an implicit interval tree: intervals sorted by
+# start in flat lists, with every node of the implied balanced binary tree
+# augmented by the largest end in its subtree (the layout used by Heng Li's
+# cgranges). Stabbing queries cost O(log n + hits) and never touch MySQL.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+
+"""Per-chromosome interval tree over closed [start, end] intervals
+overlap() and stab() return the items whose interval overlaps a range or
+contains a position, in the order they were added, which is the order the
+table scan returned them in.
+"""
+
+
+class IntervalIndex(object):
+    def __init__(self):
+        self.pending = {}
+        self.chroms = {}
+        self.size = 0
+
+    def add(self, chrom, start, end, item):
+        self.pending.setdefault(chrom, []).append((start, self.size, end, item))
+        self.size = self.size + 1
+
+    def build(self):
+        for chrom, entries in self.pending.items():
+            entries.sort(key=lambda e: (e[0], e[1]))
+            starts = [e[0] for e in entries]
+            ends = [e[2] for e in entries]
+            seqs = [e[1] for e in entries]
+            items = [e[3] for e in entries]
+            maxs, level = index_core(starts, ends)
+            self.chroms[chrom] = (starts, ends, maxs, level, seqs, items)
+        self.pending = {}
+        return self
+
+    def overlap(self, chrom, lo, hi):
+        tree = self.chroms.get(chrom)
+        if tree is None:
+            return []
+        starts, ends, maxs, level, seqs, items = tree
+        hits = overlap_core(starts, ends, maxs, level, lo, hi)
+        if len(hits) > 1:
+            hits.sort(key=lambda i: seqs[i])
+        return [items[i] for i in hits]
+
+    def stab(self, chrom, pos, widen=0):
+        return self.overlap(chrom, pos - widen, pos + widen)
+
+    def first(self, chrom, pos):
+        rows = self.stab(chrom, pos)
+        if len(rows) > 0:
+            return rows[0]
+        return None
+
+
+"""Hash of rows by exact (chrom, position), for tables of single positions
+stab() returns the rows at a position in the order they were added; column()
+gives the position of a named column, like a snapshot table's.
+"""
+
+
+class PointIndex(object):
+    def __init__(self, columns=()):
+        self.columns = list(columns)
+        self.points = {}
+
+    def add(self, chrom, pos, item):
+        self.points.setdefault((chrom, pos), []).append(item)
+
+    def stab(self, chrom, pos):
+        return self.points.get((chrom, pos), [])
+
+    def column(self, name):
+        return self.columns.index(name)
+
+
+"""Compute subtree max ends for intervals already sorted by start
+Returns the max-end list and the level of the root node.
+"""
+
+
+def index_core(starts, ends):
+    n = len(starts)
+    maxs = list(ends)
+    if n == 0:
+        return maxs, -1
+
+    last_i = 0
+    last = 0
+    for i in range(0, n, 2):
+        last_i = i
+        last = ends[i]
+
+    k = 1
+    while (1 << k) <= n:
+        x = 1 << (k - 1)
+        step = x << 2
+        for i in range((x << 1) - 1, n, step):
+            el = maxs[i - x]
+            er = maxs[i + x] if i + x < n else last
+            maxs[i] = max(ends[i], el, er)
+        last_i = last_i - x if (last_i >> k) & 1 else last_i + x
+        if last_i < n and maxs[last_i] > last:
+            last = maxs[last_i]
+        k = k + 1
+
+    return maxs, k - 1
+
+
+"""Positions of the intervals overlapping [lo, hi] in an implicit tree
+The lists only need indexing and len(), so flat lists and int64
+memoryviews over a mapped snapshot both work.
+"""
+
+
+def overlap_core(starts, ends, maxs, level, lo, hi):
+    n = len(starts)
+    hits = []
+    if n == 0:
+        return hits
+
+    stack = [(level, (1 << level) - 1, 0)]
+    while stack:
+        k, x, w = stack.pop()
+        if k <= 3:
+            # small subtree: scan it linearly
+            i = x >> k << k
+            i1 = min(i + (1 << (k + 1)) - 1, n)
+            while i < i1 and starts[i] <= hi:
+                if lo <= ends[i]:
+                    hits.append(i)
+                i = i + 1
+        elif w == 0:
+            # first visit: come back for this node after its left child
+            y = x - (1 << (k - 1))
+            stack.append((k, x, 1))
+            if y >= n or maxs[y] >= lo:
+                stack.append((k - 1, y, 0))
+        elif x < n and starts[x] <= hi:
+            if lo <= ends[x]:
+                hits.append(x)
+            stack.append((k - 1, x + (1 << (k - 1)), 0))
+
+    return hits
+
+
+_indexes = {}
+
+"""Load a reference table into an IntervalIndex, once per process
+Rows are kept whole, as `select *` would return them, so stages can keep
+addressing columns by position. Column positions of the chromosome,
+start and end are looked up in the cursor description.
+"""
+
+
+def load_table(conn, table, chromColumn="chrom", startColumn="chromStart",
+               endColumn="chromEnd", columns="*", chrom=None):
+    key = (table, columns)
+    if key in _indexes:
+        return _indexes[key]
+
+    cursor = conn.cursor()
+    cursor.execute("select " + columns + " from " + table + ";")
+    names = [str(d[0]) for d in cursor.description]
+    start_ind = names.index(startColumn)
+    end_ind = names.index(endColumn)
+    chrom_ind = names.index(chromColumn) if chrom is None else None
+
+    index = IntervalIndex()
+    for row in cursor.fetchall():
+        index.add(
+            chrom if chrom is not None else str(row[chrom_ind]),
+            int(row[start_ind]),
+            int(row[end_ind]),
+            row,
+        )
+    cursor.close()
+
+    _indexes[key] = index.build()
+    return _indexes[key]
+
+
+"""Load a table of single positions into a PointIndex, once per process
+"""
+
+
+def load_points(conn, table, chromColumn="chrom", posColumn="start"):
+    key = (table, "points")
+    if key in _indexes:
+        return _indexes[key]
+
+    cursor = conn.cursor()
+    cursor.execute("select * from " + table + ";")
+    names = [str(d[0]) for d in cursor.description]
+    chrom_ind = names.index(chromColumn)
+    pos_ind = names.index(posColumn)
+
+    index = PointIndex(names)
+    for row in cursor.fetchall():
+        index.add(str(row[chrom_ind]), int(row[pos_ind]), row)
+    cursor.close()
+
+    _indexes[key] = index
+    return _indexes[key]
+
+
+### EOF
@@ -0,0 +1,109 @@
+# metrics.py
+#
+# Machine-readable performance report of an annotation job
+#
+# The .count.log holds the annotation statistics as free text. Next to it,
+# every job writes <input>.metrics.json: per stage its wall and CPU time,
+# records read, database queries and rows returned, cache hits and the bytes
+# it added to the output, and for the job its variants per second, CPU time
+# and peak memory. run.py adds the S3 transfer times and uploads the report
+# with the log, so regressions and the tables that dominate latency can be
+# tracked across jobs.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import json
+import resource
+
+VERSION = 1
+
+
+def report_name(infile):
+    return infile + ".metrics.json"
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else 0.0
+
+
+"""Metrics of one stage, from the counters every stage keeps
+Stages running on a pool overlap, so their wall times may add up to more
+than the job's.
+"""
+
+
+def stage_metrics(stage):
+    metrics = {
+        "name": stage.name,
+        "label": stage.label,
+        "table": stage.table,
+        "wall_seconds": round(stage.wall_seconds, 3),
+        "cpu_seconds": round(stage.cpu_seconds, 3),
+        "rows_read": stage.rows_read,
+        "db_queries": stage.db_queries,
+        "db_rows": stage.db_rows,
+        "cache_hits": stage.cache_hits,
+        "cache_misses": stage.cache_misses,
+        "bytes_written": stage.bytes_written,
+    }
+    metrics["variants_per_second"] = rate(stage.rows_read, stage.wall_seconds)
+    return metrics
+
+
+"""CPU seconds and peak resident memory (KiB) of this process and of the
+processes it waited for
+"""
+
+
+def process_usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    return round(cpu, 3), max(own.ru_maxrss, children.ru_maxrss)
+
+
+"""The report of a job
+job holds the job-level fields (pipeline, profile, ...) to record as they
+are; variants per second, CPU time and memory are added here.
+"""
+
+
+def job_report(job, stages, variants, seconds):
+    cpu_seconds, max_rss = process_usage()
+    job = dict(job)
+    job["variants"] = variants
+    job["wall_seconds"] = round(seconds, 3)
+    job["variants_per_second"] = rate(variants, seconds)
+    job["cpu_seconds"] = cpu_seconds
+    job["max_rss_kib"] = max_rss
+    return {
+        "version": VERSION,
+        "job": job,
+        "stages": [stage_metrics(stage) for stage in stages],
+    }
+
+
+def write_report(path, report):
+    with open(path, "w") as fh:
+        json.dump(report, fh, indent=2)
+        fh.write("\n")
+
+
+"""Add a section to an existing report (nothing happens if there is none)
+"""
+
+
+def add_section(path, name, values):
+    if not os.path.exists(path):
+        return
+    with open(path) as fh:
+        report = json.load(fh)
+    report[name] = values
+    write_report(path, report)
+
+
+### EOF
@@ -0,0 +1,904 @@
+# refdb.py
+#
+# Pluggable reference-data backends for the annotation stages
+#
+# The stages look reference rows up in three shapes: rows at an exact
+# position (dbSNP, the two bigRefGene equality tables, gwasCatalog), rows
+# whose range contains a position or overlaps a window (every other table),
+# and the same for tfbsConsSites, which is split into one table per
+# chromosome. A backend answers them for a table through table(name), with
+# the overlap()/stab()/first()/column() interface of snapshot.SnapshotTable
+# and intervals.IntervalIndex, so the stages look rows up the same way in a
+# snapshot, a replica or the database. Tables also stream a chromosome's
+# rows in start order for sweep joins (rows_by_start()) and give the rows at
+# many positions in one query (stab_many()). Queries are parameterized.
+#
+# Rows come back in the order of the source database. MySqlBackend issues
+# the predicates of the annotate.py queries (position = pos for exact positions,
+# start - offset <= pos AND pos <= end + offset for the promoter window), so
+# MySQL plans them as it plans the legacy queries and returns rows in the
+# order those do. A replica is copied in one table scan, so its rowids keep
+# the database's table-scan order, and it returns rows in rowid order.
+#
+#   MySqlBackend   - the `annotator` MySQL database, through dbconn.py
+#   SqliteBackend  - an embedded SQLite replica of it, exact-position tables
+#                    indexed on (chromosome, position) and range tables on an
+#                    R*-tree (a composite index where SQLite lacks the module)
+#
+# A replica has the MySQL schema, so connection() also serves the SQL the
+# stages and annotate.py build. It is imported from table dumps, either as
+# downloaded from UCSC (<table>.sql and <table>.txt.gz) or as written by
+# mysqldump --tab from the reference database, or copied from the database.
+#
+# Usage: python refdb.py import <replica.db> <dump directory> [tables]
+#        python refdb.py copy <replica.db> [tables]
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import re
+import sys
+import gzip
+import time
+import sqlite3
+import threading
+import urllib.parse
+
+import dbconn as dbc
+import snapshot as sn
+import utils as u
+
+# Chromosome, start and end columns and the columns returned, per table
+LAYOUTS = dict(sn.TABLES)
+LAYOUTS[sn.TFBS_TABLE] = (None, "chromStart", "chromEnd", sn.TFBS_COLUMNS)
+
+# Chromosome codes of the R*-tree dimensions
+CHROMS_TABLE = "refdb_chroms"
+RTREE_SUFFIX = "__rtree"
+
+# Rows inserted per statement by the importer
+INSERT_ROWS = 10000
+
+# Rows fetched at a time from a streamed query
+FETCH_ROWS = 10000
+
+
+"""Physical tables holding a table's rows, with the chromosome each holds
+(None if it holds every chromosome)
+"""
+
+
+def physical_tables(table):
+    if table == sn.TFBS_TABLE:
+        return [(sn.TFBS_TABLE + chrom, chrom) for chrom in sn.TFBS_CHROMS]
+    return [(table, None)]
+
+
+def is_exact(table):
+    chromColumn, startColumn, endColumn, columns = LAYOUTS[table]
+    return startColumn == endColumn
+
+
+"""One reference table of a backend
+Rows of the chromosome whose [start, end] overlaps [lo, hi]; exact-position
+tables use the position as both start and end.
+"""
+
+
+class ReferenceTable(object):
+    def __init__(self, backend, table):
+        if table not in LAYOUTS:
+            raise KeyError(f"Table {table} is not a reference table")
+        self.backend = backend
+        self.table = table
+        self.path = backend.path
+        layout = LAYOUTS[table]
+        self.chromColumn, self.startColumn, self.endColumn, self.columns = layout
+        self.names = None
+
+    def physical(self, chrom):
+        if self.table == sn.TFBS_TABLE:
+            if chrom not in sn.TFBS_CHROMS:
+                return None
+            return self.table + chrom
+        return self.table
+
+    def query(self, sql, args):
+        cursor = self.backend.cursor()
+        cursor.execute(sql, args)
+        return list(cursor.fetchall())
+
+    def overlap(self, chrom, lo, hi):
+        name = self.physical(str(chrom))
+        if name is None:
+            return []
+        sql, args = self.backend.overlap_sql(self, name, str(chrom), lo, hi)
+        if sql is None:
+            return []
+        return self.query(sql, args)
+
+    """Rows whose range, widened by widen on either side, contains pos
+    """
+
+    def stab(self, chrom, pos, widen=0):
+        name = self.physical(str(chrom))
+        if name is None:
+            return []
+        sql, args = self.backend.stab_sql(self, name, str(chrom), pos, widen)
+        if sql is None:
+            return []
+        return self.query(sql, args)
+
+    def first(self, chrom, pos):
+        rows = self.stab(chrom, pos)
+        if len(rows) > 0:
+            return rows[0]
+        return None
+
+    """(position in the scan, row) of every row of a chromosome, streamed in
+    start order for sweep.py; rows at the same start keep their scan order
+    Rows are numbered with ROW_NUMBER(), which needs MySQL 8 (or SQLite
+    3.25).
+    """
+
+    def rows_by_start(self, chrom):
+        name = self.physical(str(chrom))
+        if name is None:
+            return iter(())
+        where, args = chrom_filter(self, self.backend.mark, str(chrom))
+        columns = name + ".*" if self.columns == "*" else self.columns
+        sql = select_sql(self, name, where, "row_number() over () as seq, " + columns)
+        sql = sql + " order by " + self.startColumn + ", seq;"
+        rows = self.backend.stream(name, sql, args)
+        return ((row[0], tuple(row[1:])) for row in rows)
+
+    """Rows at any of positions, in one query (exact-position tables)
+    """
+
+    def stab_many(self, chrom, positions):
+        name = self.physical(str(chrom))
+        if name is None or len(positions) == 0:
+            return []
+        mark = self.backend.mark
+        where, args = chrom_filter(self, mark, str(chrom))
+        where.append(
+            self.startColumn + " IN (" + ",".join([mark] * len(positions)) + ")"
+        )
+        sql = self.backend.ordered(select_sql(self, name, where))
+        return self.query(sql, args + tuple(positions))
+
+    def column(self, name):
+        if self.names is None:
+            cursor = self.backend.cursor()
+            cursor.execute(
+                "select " + self.columns + " from " + physical_tables(self.table)[0][0]
+                + " limit 0;"
+            )
+            cursor.fetchall()
+            self.names = [str(d[0]) for d in cursor.description]
+        return self.names.index(name)
+
+    def chromosomes(self):
+        if self.chromColumn is None:
+            return list(sn.TFBS_CHROMS)
+        cursor = self.backend.cursor()
+        cursor.execute("select distinct " + self.chromColumn + " from " + self.table)
+        return sorted([str(row[0]) for row in cursor.fetchall() if row[0] is not None])
+
+
+"""Select of a table's columns from one of its physical tables, filtered by
+the predicates in where
+"""
+
+
+def select_sql(table, name, where, columns=None):
+    sql = "select " + (columns or table.columns) + " from " + name
+    if len(where) > 0:
+        sql = sql + " where " + " AND ".join(where)
+    return sql
+
+
+"""Chromosome predicate of a table and its arguments (none for the
+per-chromosome tfbs tables)
+"""
+
+
+def chrom_filter(table, mark, chrom):
+    if table.chromColumn is None:
+        return [], ()
+    return [table.chromColumn + " = " + mark], (chrom,)
+
+
+"""Range predicate of a table on the placeholder style of a backend
+"""
+
+
+def range_sql(table, name, mark, columns=None):
+    where = chrom_filter(table, mark, None)[0]
+    where.append(table.startColumn + " <= " + mark)
+    where.append(mark + " <= " + table.endColumn)
+    return select_sql(table, name, where, columns)
+
+
+def range_args(table, chrom, lo, hi):
+    return chrom_filter(table, "", chrom)[1] + (hi, lo)
+
+
+"""Predicate of the rows containing a position, in the shape of the
+annotate.py queries
+"""
+
+
+def stab_sql(table, name, mark, widen=0, columns=None):
+    where = chrom_filter(table, mark, None)[0]
+    if widen != 0:
+        where.append("(" + table.startColumn + " - " + mark + ") <= " + mark)
+        where.append(mark + " <= (" + table.endColumn + " + " + mark + ")")
+    elif is_exact(table.table):
+        where.append(table.startColumn + " = " + mark)
+    else:
+        where.append(table.startColumn + " <= " + mark)
+        where.append(mark + " <= " + table.endColumn)
+    return select_sql(table, name, where, columns)
+
+
+def stab_args(table, chrom, pos, widen=0):
+    args = chrom_filter(table, "", chrom)[1]
+    if widen != 0:
+        return args + (widen, pos, pos, widen)
+    if is_exact(table.table):
+        return args + (pos,)
+    return args + (pos, pos)
+
+
+"""Rows of an executed query, fetched FETCH_ROWS at a time
+"""
+
+
+def fetch_rows(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if len(rows) == 0:
+            return
+        for row in rows:
+            yield row
+
+
+"""The reference MySQL database
+Lookups go through a dbconn.ConnectionProvider of the calling thread, since
+pymysql connections are not thread-safe: the process's shared provider on
+the main thread and one of its own on every other thread (connecting as
+dbconn.configure() set), or a provider connecting with connect if one is
+given. check() pings them between stages. Streamed queries run on
+connections of their own, see stream().
+"""
+
+
+class MySqlBackend(object):
+    kind = "mysql"
+    mark = "%s"
+
+    def __init__(self, connect=None):
+        self.connect = connect
+        self.path = "mysql"
+        self.local = threading.local()
+        self.providers = []
+        self.streamers = []
+        self.tables = {}
+
+    def connection(self):
+        local = self.local
+        if getattr(local, "provider", None) is None:
+            if self.connect is not None:
+                local.provider = dbc.ConnectionProvider(self.connect)
+            elif threading.current_thread() is not threading.main_thread():
+                local.provider = dbc.new_provider()
+            else:
+                local.provider = dbc.shared()
+                return local.provider
+            self.providers.append(local.provider)
+        return local.provider
+
+    def cursor(self):
+        if getattr(self.local, "cursor", None) is None:
+            self.local.cursor = self.connection().cursor()
+        return self.local.cursor
+
+    def check(self):
+        provider = getattr(self.local, "provider", None)
+        if provider is not None:
+            provider.check()
+        for provider in self.providers:
+            provider.check()
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = ReferenceTable(self, name)
+        return self.tables[name]
+
+    def ordered(self, sql):
+        return sql + ";"
+
+    def overlap_sql(self, table, name, chrom, lo, hi):
+        sql = range_sql(table, name, self.mark) + ";"
+        return sql, range_args(table, chrom, lo, hi)
+
+    def stab_sql(self, table, name, chrom, pos, widen):
+        sql = stab_sql(table, name, self.mark, widen) + ";"
+        return sql, stab_args(table, chrom, pos, widen)
+
+    """Rows containing pos in each of the tables names, in one UNION query,
+    as one list of rows per table
+    """
+
+    def stab_tables(self, names, chrom, pos):
+        selects = []
+        args = ()
+        for tier in range(len(names)):
+            table = self.table(names[tier])
+            columns = table.columns
+            if columns == "*":
+                columns = names[tier] + ".*"
+            selects.append(
+                stab_sql(table, names[tier], self.mark, 0, str(tier) + ", " + columns)
+            )
+            args = args + stab_args(table, str(chrom), pos)
+        cursor = self.cursor()
+        cursor.execute(" union all ".join(selects) + ";", args)
+        tiers = [[] for name in names]
+        for row in cursor.fetchall():
+            tiers[int(row[0])].append(row[1:])
+        return tiers
+
+    """Rows of a query, read from the server as they are fetched on a
+    connection the calling thread keeps for key, so its other lookups can
+    run in between; a stream still open for key is closed (and the rest of
+    its rows skipped) first. These connections are not pinged, since a
+    ping in the middle of a result would break it.
+    """
+
+    def stream(self, key, sql, args):
+        streams = getattr(self.local, "streams", None)
+        if streams is None:
+            streams = self.local.streams = {}
+        if key in streams:
+            provider, cursor = streams[key]
+            cursor.close()
+        elif self.connect is not None:
+            provider = dbc.ConnectionProvider(self.connect)
+            self.streamers.append(provider)
+        else:
+            provider = dbc.new_provider()
+            self.streamers.append(provider)
+        cursor = dbc.streaming_cursor(provider.connection())
+        streams[key] = (provider, cursor)
+        cursor.execute(sql, args)
+        return fetch_rows(cursor)
+
+    def close(self):
+        dbc.close_all(self.providers + self.streamers)
+        self.providers = []
+        self.streamers = []
+        self.local = threading.local()
+
+
+"""Connection to a replica with the cursor(), ping() and close() of a
+pymysql connection, so dbconn.py and the SQL of the stages can use it
+"""
+
+
+class SqliteConnection(object):
+    def __init__(self, path, readonly=True):
+        if readonly:
+            uri = "file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self):
+        return SqliteCursor(self.conn.cursor())
+
+    def ping(self, reconnect=False):
+        return True
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+"""Cursor of a replica, with the interface of a pymysql cursor; queries
+with arguments use SQLite's ? placeholders
+"""
+
+
+class SqliteCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, args=None):
+        return self.cursor.execute(sql, args or ())
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def close(self):
+        self.cursor.close()
+
+
+"""An embedded SQLite replica of the reference database, opened read-only
+Every thread of every process gets its own connection.
+"""
+
+
+class SqliteBackend(object):
+    kind = "sqlite"
+    mark = "?"
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No reference replica at {path}")
+        self.path = path
+        self.local = threading.local()
+        self.tables = {}
+        self.rtrees = None
+        self.codes = None
+
+    def connection(self):
+        return SqliteConnection(self.path)
+
+    def cursor(self):
+        local = self.local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = self.connection()
+            local.cursor = local.conn.cursor()
+            local.pid = os.getpid()
+        return local.cursor
+
+    def table(self, name):
+        if name not in self.tables:
+            self.load_catalog()
+            self.tables[name] = ReferenceTable(self, name)
+        return self.tables[name]
+
+    def load_catalog(self):
+        if self.rtrees is not None:
+            return
+        cursor = self.cursor()
+        cursor.execute("select name from sqlite_master where type = 'table';")
+        names = set([str(row[0]) for row in cursor.fetchall()])
+        self.rtrees = set(
+            [n[: -len(RTREE_SUFFIX)] for n in names if n.endswith(RTREE_SUFFIX)]
+        )
+        self.codes = {}
+        if CHROMS_TABLE in names:
+            cursor.execute("select name, code from " + CHROMS_TABLE + ";")
+            self.codes = dict([(str(name), code) for name, code in cursor.fetchall()])
+
+    def ordered(self, sql):
+        return sql + " order by rowid;"
+
+    def overlap_sql(self, table, name, chrom, lo, hi):
+        if name not in self.rtrees:
+            sql = range_sql(table, name, self.mark) + " order by rowid;"
+            return sql, range_args(table, chrom, lo, hi)
+
+        # The R*-tree holds each row's rowid, chromosome code and range
+        where = "lo <= ? AND ? <= hi"
+        args = (hi, lo)
+        if table.chromColumn is not None:
+            if chrom not in self.codes:
+                return None, None
+            where = "chromLo <= ? AND ? <= chromHi AND " + where
+            args = (self.codes[chrom], self.codes[chrom]) + args
+        sql = (
+            "select " + table.columns + " from " + name
+            + " where rowid in (select id from " + name + RTREE_SUFFIX
+            + " where " + where + ") order by rowid;"
+        )
+        return sql, args
+
+    def stab_sql(self, table, name, chrom, pos, widen):
+        return self.overlap_sql(table, name, chrom, pos - widen, pos + widen)
+
+    def stream(self, key, sql, args):
+        cursor = self.connection().cursor()
+        cursor.execute(sql, args)
+        return fetch_rows(cursor)
+
+    def close(self):
+        self.local = threading.local()
+
+
+_backends = {}
+
+"""Open the replica at path, once per process
+"""
+
+
+def open_replica(path):
+    if path not in _backends:
+        _backends[path] = SqliteBackend(path)
+    return _backends[path]
+
+
+def has_rtree(conn):
+    try:
+        conn.execute("create virtual table temp.refdb_probe using rtree_i32(id, a, b)")
+        conn.execute("drop table temp.refdb_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+"""Index one physical table of a replica for its layout
+"""
+
+
+def index_table(conn, table, name, rtree):
+    chromColumn, startColumn, endColumn, columns = LAYOUTS[table]
+    if table == sn.TFBS_TABLE:
+        chromColumn = None
+    conn.execute("drop table if exists " + name + RTREE_SUFFIX)
+
+    if is_exact(table) or not rtree:
+        keys = [c for c in (chromColumn, startColumn) if c is not None]
+        if not is_exact(table):
+            keys.append(endColumn)
+        conn.execute(
+            "create index if not exists " + name + "__range on " + name
+            + " (" + ", ".join(keys) + ")"
+        )
+        return
+
+    # Rows whose range is NULL or inverted never contain a position
+    valid = (
+        startColumn + " is not null AND " + endColumn + " is not null AND "
+        + startColumn + " <= " + endColumn
+    )
+    if chromColumn is None:
+        conn.execute(
+            "create virtual table " + name + RTREE_SUFFIX
+            + " using rtree_i32(id, lo, hi)"
+        )
+        conn.execute(
+            "insert into " + name + RTREE_SUFFIX + " select rowid, "
+            + startColumn + ", " + endColumn + " from " + name + " where " + valid
+        )
+        return
+
+    conn.execute(
+        "insert or ignore into " + CHROMS_TABLE + " (name) select distinct "
+        + "cast(" + chromColumn + " as text) from " + name
+        + " where " + chromColumn + " is not null"
+    )
+    conn.execute(
+        "create virtual table " + name + RTREE_SUFFIX
+        + " using rtree_i32(id, chromLo, chromHi, lo, hi)"
+    )
+    conn.execute(
+        "insert into " + name + RTREE_SUFFIX + " select t.rowid, c.code, c.code, "
+        + "t." + startColumn + ", t." + endColumn + " from " + name + " t join "
+        + CHROMS_TABLE + " c on c.name = cast(t." + chromColumn + " as text)"
+        + " where " + valid
+    )
+
+
+"""Index every reference table present in a replica
+"""
+
+
+def index_tables(conn):
+    rtree = has_rtree(conn)
+    conn.execute(
+        "create table if not exists " + CHROMS_TABLE
+        + " (code integer primary key, name text unique)"
+    )
+    names = set(
+        [
+            str(row[0])
+            for row in conn.execute(
+                "select name from sqlite_master where type = 'table'"
+            )
+        ]
+    )
+    for table in LAYOUTS:
+        for name, chrom in physical_tables(table):
+            if name in names:
+                start = time.time()
+                index_table(conn, table, name, rtree)
+                print(f"{name}: indexed in {time.time() - start:.2f} seconds")
+    conn.execute("analyze")
+    conn.commit()
+
+
+"""Table dumps
+<table>.sql holds the MySQL CREATE TABLE statement and <table>.txt (or
+.txt.gz) the rows, tab-separated, with \\N for NULL and backslash escapes.
+"""
+
+COLUMN = re.compile(r"^\s*`(\w+)`\s+(\w+)")
+ESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r", "0": "\0", "Z": "\x1a"}
+
+
+def column_type(mysql_type):
+    mysql_type = mysql_type.lower()
+    if "int" in mysql_type:
+        return "integer"
+    if mysql_type in ("float", "double", "real"):
+        return "real"
+    if "blob" in mysql_type or "binary" in mysql_type:
+        return "blob"
+    return "text"
+
+
+"""Column names and SQLite types from a dump's CREATE TABLE statement
+"""
+
+
+def read_schema(path):
+    columns = []
+    with open(path) as fh:
+        inside = False
+        for line in fh:
+            if line.upper().startswith("CREATE TABLE"):
+                inside = True
+                continue
+            if inside:
+                match = COLUMN.match(line)
+                if match:
+                    columns.append((match.group(1), column_type(match.group(2))))
+                elif line.startswith(")"):
+                    break
+    if len(columns) == 0:
+        raise ValueError(f"No CREATE TABLE statement in {path}")
+    return columns
+
+
+def unescape(text):
+    if "\\" not in text:
+        return text
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and i + 1 < len(text):
+            out.append(ESCAPES.get(text[i + 1], text[i + 1]))
+            i = i + 2
+        else:
+            out.append(c)
+            i = i + 1
+    return "".join(out)
+
+
+def convert(value, kind):
+    if value == "\\N":
+        return None
+    value = unescape(value)
+    if kind == "integer":
+        return int(value)
+    if kind == "real":
+        return float(value)
+    if kind == "blob":
+        return value.encode("utf-8")
+    return value
+
+
+def read_rows(path, columns):
+    opener = gzip.open if path.endswith(".gz") else open
+    kinds = [kind for name, kind in columns]
+    with opener(path, "rt") as fh:
+        for line in fh:
+            values = line.rstrip("\n").split("\t")
+            if len(values) != len(kinds):
+                raise ValueError(
+                    f"{path}: {len(values)} columns where {len(kinds)} were expected"
+                )
+            yield tuple([convert(v, k) for v, k in zip(values, kinds)])
+
+
+"""Create a replica table; text columns compare case-insensitively, like
+MySQL's default collation does
+"""
+
+
+def create_table(conn, name, columns):
+    conn.execute("drop table if exists " + name)
+    conn.execute(
+        "create table " + name + " ("
+        + ", ".join([n + " " + column_sql(kind) for n, kind in columns]) + ")"
+    )
+
+
+def column_sql(kind):
+    if kind in ("", "text"):
+        return (kind + " collate nocase").strip()
+    return kind
+
+
+def insert_rows(conn, name, width, rows):
+    marks = ",".join(["?"] * width)
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_ROWS:
+            conn.executemany("insert into " + name + " values (" + marks + ")", batch)
+            count = count + len(batch)
+            batch = []
+    conn.executemany("insert into " + name + " values (" + marks + ")", batch)
+    return count + len(batch)
+
+
+"""Batches of (bare chromosome, rows) of the chromosomes with a tfbs table
+"""
+
+
+def split_rows(rows, chrom_ind):
+    batches = {}
+    for row in rows:
+        chrom = str(row[chrom_ind]).replace("chr", "")
+        if chrom not in sn.TFBS_CHROMS:
+            continue
+        batch = batches.setdefault(chrom, [])
+        batch.append(row)
+        if len(batch) >= INSERT_ROWS:
+            yield chrom, batch
+            batches[chrom] = []
+    for chrom in batches:
+        yield chrom, batches[chrom]
+
+
+def data_file(directory, table):
+    for suffix in (".txt.gz", ".txt"):
+        path = os.path.join(directory, table + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+"""Import one table dump
+UCSC ships tfbsConsSites as a single table; it is split into the
+per-chromosome tables of the reference database.
+"""
+
+
+def import_dump(conn, directory, table):
+    start = time.time()
+    columns = read_schema(os.path.join(directory, table + ".sql"))
+    rows = read_rows(data_file(directory, table), columns)
+    if table != sn.TFBS_TABLE:
+        create_table(conn, table, columns)
+        count = insert_rows(conn, table, len(columns), rows)
+    else:
+        chrom_ind = [name for name, kind in columns].index("chrom")
+        for name, chrom in physical_tables(table):
+            create_table(conn, name, columns)
+        count = 0
+        for chrom, batch in split_rows(rows, chrom_ind):
+            count = count + insert_rows(conn, table + chrom, len(columns), batch)
+    conn.commit()
+    print(f"{table}: {count} rows imported in {time.time() - start:.2f} seconds")
+
+
+"""Import the dumps of tables (every dump in directory if None) into the
+replica at path and index it
+"""
+
+
+def import_dumps(path, directory, tables=None):
+    if tables is None:
+        tables = sorted(
+            [
+                f[: -len(".sql")]
+                for f in os.listdir(directory)
+                if f.endswith(".sql") and data_file(directory, f[: -len(".sql")])
+            ]
+        )
+    conn = sqlite3.connect(path)
+    try:
+        for table in tables:
+            import_dump(conn, directory, table)
+        index_tables(conn)
+    finally:
+        conn.close()
+
+
+"""Values pymysql returns that SQLite cannot store are kept as the text the
+stages would print for them
+"""
+
+
+def copy_value(value):
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
+
+
+"""Copy one table from the database in one table scan, streamed a batch of
+rows at a time, so the replica's rowids keep the database's scan order
+"""
+
+
+def copy_table(cursor, conn, name):
+    cursor.execute("select * from " + name + ";")
+    columns = [(str(d[0]), "") for d in cursor.description]
+    create_table(conn, name, columns)
+    count = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if len(rows) == 0:
+            break
+        rows = [tuple([copy_value(v) for v in row]) for row in rows]
+        count = count + insert_rows(conn, name, len(columns), rows)
+    conn.commit()
+    return count
+
+
+"""Copy reference tables (every one if None) from the database into the
+replica at path and index it
+"""
+
+
+def copy_database(path, tables=None, connect=u.db_connect):
+    if tables is None:
+        tables = list(LAYOUTS)
+    source = connect()
+    cursor = dbc.streaming_cursor(source)
+    conn = sqlite3.connect(path)
+    try:
+        for table in tables:
+            for name, chrom in physical_tables(table):
+                start = time.time()
+                count = copy_table(cursor, conn, name)
+                seconds = time.time() - start
+                print(f"{name}: {count} rows copied in {seconds:.2f} seconds")
+        index_tables(conn)
+    finally:
+        conn.close()
+        source.close()
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("import", "copy"):
+        print("Usage: python refdb.py import <replica.db> <dump directory> [tables]")
+        print("       python refdb.py copy <replica.db> [tables]")
+        sys.exit(1)
+
+    if sys.argv[1] == "import":
+        if len(sys.argv) < 4:
+            print(
+                "Usage: python refdb.py import <replica.db> <dump directory> [tables]"
+            )
+            sys.exit(1)
+        tables = sys.argv[4].split(",") if len(sys.argv) > 4 else None
+        import_dumps(sys.argv[2], sys.argv[3], tables)
+    else:
+        tables = sys.argv[3].split(",") if len(sys.argv) > 3 else None
+        copy_database(sys.argv[2], tables)
+    print(f"Reference replica written to {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+### EOF
@@ -8,12 +8,16 @@ __author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
 import sys
 import time
 import driver
+import metrics
+import checkpoint
+import credentials
 import os
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ClientError
 import json
 import shutil
+import threading
 
 # Get configuration
 from configparser import ConfigParser, ExtendedInterpolation
@@ -21,6 +25,11 @@ from configparser import ConfigParser, ExtendedInterpolation
 config = ConfigParser(os.environ, interpolation=ExtendedInterpolation())
 config.read("annotator_config.ini")
 
+credentials.configure(
+  ttl=config.getfloat('ann', 'SecretTtl'),
+  refresh_ahead=config.getfloat('ann', 'SecretRefreshAhead'),
+  cache_dir=config['ann']['SecretCacheDir'].strip())
+
 
 
 """A rudimentary timer for coarse-grained profiling
@@ -39,6 +48,147 @@ class Timer(object):
     if self.verbose:
       print(f"Approximate runtime: {self.secs:.2f} seconds")
 
+"""Append the bytes moved to and from S3 to the job log and metrics report
+"""
+def log_transfer(log_path, metrics_path, input_path, results_path, download_seconds):
+  downloaded = os.path.getsize(input_path) if os.path.exists(input_path) else 0
+  results = os.path.getsize(results_path) if os.path.exists(results_path) else 0
+  line = f"## S3 transfer: {downloaded} bytes downloaded"
+  if download_seconds is not None:
+    line = line + f" in {download_seconds:.2f} seconds"
+  line = line + f", {results} bytes of results to upload"
+  print(line)
+  with open(log_path, 'a') as fh_log:
+    fh_log.write(line + "\n")
+  metrics.add_section(metrics_path, 'transfer', {
+    'downloaded_bytes': downloaded,
+    'download_seconds': download_seconds,
+    'results_bytes': results})
+
+"""Keeps the job's SQS message invisible while the job runs, so the message
+is only redelivered (and the job resumed from its checkpoint) if this
+process dies; release() deletes it once the job is over
+"""
+class MessageLease(object):
+  def __init__(self, sqs, queue_url, receipt_handle, timeout, every):
+    self.sqs = sqs
+    self.queue_url = queue_url
+    self.receipt_handle = receipt_handle
+    self.timeout = timeout
+    self.every = every
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.extend, daemon=True)
+
+  def start(self):
+    if self.receipt_handle:
+      self.thread.start()
+
+  def extend(self):
+    while not self.stopped.wait(self.every):
+      try:
+        self.sqs.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=self.receipt_handle, VisibilityTimeout=self.timeout)
+      except (ClientError) as e:
+        print(f"Error in extending the job message's visibility! {e}")
+
+  """Stop extending the message's visibility without deleting it, so it is
+  redelivered once the visibility timeout runs out
+  """
+  def abandon(self):
+    self.stopped.set()
+
+  def release(self):
+    self.stopped.set()
+    if not self.receipt_handle:
+      return
+    try:
+      self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=self.receipt_handle)
+      print("Job message deleted successfully!")
+    except (ClientError) as e:
+      print(f"Error in deleting the job message! {e}")
+
+"""Checkpoint persist callback copying each recorded step's files and then
+the manifest to S3 under prefix, and dropping the files no longer recorded
+"""
+def s3_checkpoint(s3, bucket, prefix):
+  def persist(manifest_path, added, removed):
+    try:
+      for path in added:
+        s3.upload_file(path, bucket, prefix + os.path.basename(path))
+      s3.upload_file(manifest_path, bucket, prefix + os.path.basename(manifest_path))
+      for name in removed:
+        s3.delete_object(Bucket=bucket, Key=prefix + name)
+    except (ClientError) as e:
+      print(f"Error in saving checkpoint to S3! {e}")
+  return persist
+
+"""Download the checkpoint a previous attempt at the job left in S3, unless
+there is one in the job directory already
+"""
+def fetch_checkpoint(s3, bucket, prefix, manifest_path):
+  if os.path.exists(manifest_path):
+    return
+  try:
+    s3.download_file(bucket, prefix + os.path.basename(manifest_path), manifest_path)
+  except (ClientError):
+    # No earlier attempt left one
+    return
+  with open(manifest_path) as fh:
+    manifest = json.load(fh)
+  directory = os.path.dirname(manifest_path)
+  try:
+    for step in manifest['steps'].values():
+      for name in step['files']:
+        s3.download_file(bucket, prefix + name, os.path.join(directory, name))
+    print(f"Checkpoint of {len(manifest['steps'])} steps downloaded from S3")
+  except (ClientError) as e:
+    print(f"Error in downloading checkpoint from S3! {e}")
+
+"""Delete every object of a job's checkpoint in S3
+"""
+def drop_checkpoint(s3, bucket, prefix):
+  try:
+    listing = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    for item in listing.get('Contents', []):
+      s3.delete_object(Bucket=bucket, Key=item['Key'])
+  except (ClientError) as e:
+    print(f"Error in deleting checkpoint from S3! {e}")
+
+"""Mark a job that cannot be annotated as failed
+"""
+def fail_job(ann_table, job_id, reason):
+  try:
+    ann_table.update_item(
+      Key={
+      'job_id': job_id
+      },
+      UpdateExpression= 'SET job_status = :val1',
+      ExpressionAttributeValues={
+      ':val1': 'FAILED'
+      }
+      )
+    print(f"Job {job_id} failed: {reason}")
+  except (ClientError) as e:
+    print(f"Error in marking job {job_id} as failed on Dynamo! {e}")
+
+"""Comma-separated list of table names from the [ann] config section
+"""
+def table_list(option):
+  return [t.strip() for t in config['ann'][option].split(',') if t.strip()]
+
+"""Name and stage names of the profile a job runs
+Unknown profiles get the default one, and free users only get the profiles
+listed for them.
+"""
+def job_profile(requested, user_role):
+  profiles = [p for p in config['profiles'] if p not in config.defaults()]
+  profile = requested if requested in profiles else config['ann']['DefaultProfile'].strip()
+  free_profiles = table_list('FreeUserProfiles')
+  if user_role == "free_user" and free_profiles and profile not in free_profiles:
+    profile = free_profiles[0]
+  if requested and requested != profile:
+    print(f"Running profile {profile} instead of {requested}")
+  return profile, config['profiles'][profile].split(',')
+
 def main():
   # Call the AnnTools pipeline
   if len(sys.argv) > 1:
@@ -50,27 +200,107 @@ def main():
       input_job_id = sys.argv[3]
       input_user_id = sys.argv[4]
       input_user_role = sys.argv[5]
-
-      # When user inputs a non-vcf format  
-      try:
-        driver.run(input_file, 'vcf')
-      except (UnicodeDecodeError) as e:
-        print(f"Error in running process because of file format! Only vcf files are supported.")
+      download_seconds = float(sys.argv[6]) if len(sys.argv) > 6 else None
+      # BED of the job's target regions, if one was submitted with it
+      targets = sys.argv[7] if len(sys.argv) > 7 and sys.argv[7] else None
+      # Annotation profile the job asked for, checked against the user's role
+      profile, stage_names = job_profile(sys.argv[8] if len(sys.argv) > 8 else "", input_user_role)
+      # SQS message of the job, deleted once the job is over (not at submit time)
+      queue_url = sys.argv[9] if len(sys.argv) > 9 else ""
+      receipt_handle = sys.argv[10] if len(sys.argv) > 10 else ""
+      # On the message's last delivery, a failed job is not left for a retry
+      last_attempt = len(sys.argv) > 11 and sys.argv[11] == "True"
 
       # Setting up AWS connection
       my_config = Config(region_name=config['aws']['AwsRegionName'], signature_version = 's3v4')
       s3 = boto3.client('s3', config=my_config)
+      results_bucket = config['s3']['ResultsBucketName']
+
+      # Error handling: Issue with the key
+      try:
+        key = input_key.split("~")[0]
+      except (IndexError, ValueError, ClientError) as e:
+        print(e)
+
+      # The message stays invisible to other annotators while the job runs
+      sqs = boto3.client('sqs', config=my_config)
+      lease = MessageLease(sqs, queue_url, receipt_handle, config.getint('sqs', 'VisibilityTimeout'), config.getint('sqs', 'VisibilityHeartbeat'))
+      lease.start()
+
+      # A redelivered job resumes from the checkpoint of the last attempt,
+      # which is also kept in S3 if this instance may not be the one to retry
+      use_checkpoints = config.getboolean('ann', 'Checkpoints')
+      checkpoint_prefix = key + '~checkpoint~'
+      persist = None
+      if use_checkpoints and config.getboolean('ann', 'CheckpointToS3'):
+        plain_input = input_file[:-3] if input_file.endswith('.gz') else input_file
+        fetch_checkpoint(s3, results_bucket, checkpoint_prefix, checkpoint.manifest_name(plain_input))
+        persist = s3_checkpoint(s3, results_bucket, checkpoint_prefix)
+
+      # Reference tables to serve from memory or by sweep join rather than per-variant queries
+      indexed_tables = table_list('IndexedTables')
+      sweep_tables = table_list('SweepTables')
+      snapshot_dir = config['ann']['SnapshotDir'].strip() or None
+      reference_db = config['ann']['ReferenceDb'].strip() or None
+      compress_results = config.getboolean('ann', 'CompressResults')
 
       # Adding dynamo config
       dynamodb = boto3.resource('dynamodb',config=my_config)
       ann_table = dynamodb.Table(config['gas']['AnnotationsTable'])
 
-      # Extract the filename from the input_file
+      # A failure is either retried (the message is redelivered and the job
+      # resumes from its checkpoint) or, when retrying cannot help, fails the job
+      failure = None
+      retry = False
+
+      # When user inputs a non-vcf format  
+      try:
+        options = driver.RunOptions(
+          legacy=config.getboolean('ann', 'LegacyPipeline'),
+          indexed_tables=indexed_tables,
+          batch_size=config.getint('ann', 'BatchSize'),
+          sweep_tables=sweep_tables,
+          snapshot_dir=snapshot_dir,
+          stage_workers=config.getint('ann', 'StageWorkers'),
+          workers=config.getint('ann', 'ChunkWorkers'),
+          min_chunk=config.getint('ann', 'MinChunkBytes'),
+          cache_path=config['ann']['VariantCache'].strip() or None,
+          cache_entries=config.getint('ann', 'VariantCacheEntries'),
+          reference_version=config['ann']['ReferenceVersion'].strip(),
+          bloom_dir=config['ann']['BloomDir'].strip() or None,
+          block_lines=config.getint('ann', 'BlockLines'),
+          compress_output=compress_results,
+          compress_threads=config.getint('ann', 'CompressThreads'),
+          targets=targets,
+          stage_names=stage_names,
+          profile=profile,
+          reference_db=reference_db,
+          checkpoint=use_checkpoints,
+          checkpoint_bytes=config.getint('ann', 'CheckpointBytes'),
+          on_checkpoint=persist,
+          sort_input=config.getboolean('ann', 'SortInput'),
+          sort_memory=config.getint('ann', 'SortMemoryBytes'),
+          keep_order=config.getboolean('ann', 'KeepInputOrder'))
+        driver.run(input_file, 'vcf', options)
+      except (UnicodeDecodeError) as e:
+        print(f"Error in running process because of file format! Only vcf files are supported.")
+        failure = "input is not a vcf file"
+      except (Exception) as e:
+        print(f"Error in annotating the input! {e}")
+        failure = f"annotation failed: {e}"
+        retry = True
+
+      # Extract the filename from the input_file (results of a .vcf.gz upload are named after the .vcf)
       input_file_name = os.path.basename(input_file)
+      if input_file_name.endswith('.gz'):
+        input_file_name = input_file_name[:-3]
 
       # Define the new filenames
       annot_results = input_file_name.replace('.vcf', '.annot.vcf')
+      if compress_results:
+        annot_results = annot_results + '.gz'
       annot_logs = input_file_name.replace('.vcf', '.vcf.count.log')
+      annot_metrics = metrics.report_name(input_file_name)
 
       # Get the directory of the input_file
       directory = os.path.dirname(input_file)
@@ -78,23 +308,46 @@ def main():
       # Generate the full paths for the results file and log file
       annot_results_path = os.path.join(directory, annot_results)
       annot_logs_path = os.path.join(directory, annot_logs)
+      annot_metrics_path = os.path.join(directory, annot_metrics)
 
 
       # Upload results to S3
-      # Error handling: Issue with the key
-      try:
-        key = input_key.split("~")[0]
-      except (IndexError, ValueError, ClientError) as e:
-        print(e)
-
-      results_bucket = config['s3']['ResultsBucketName']
-
       # Source: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/s3-uploading-files.html
-      try:
-        s3.upload_file(annot_results_path, results_bucket, key + '~'+ annot_results)
-        s3.upload_file(annot_logs_path, results_bucket, key + '~'+ annot_logs)
-      except (ClientError) as e:
-        print(f"Error in uploading files to S3!{e}")
+      if failure is None:
+        try:
+          log_transfer(annot_logs_path, annot_metrics_path, input_file, annot_results_path, download_seconds)
+          upload_start = time.time()
+          s3.upload_file(annot_results_path, results_bucket, key + '~'+ annot_results)
+          s3.upload_file(annot_logs_path, results_bucket, key + '~'+ annot_logs)
+          if os.path.exists(annot_metrics_path):
+            s3.upload_file(annot_metrics_path, results_bucket, key + '~'+ annot_metrics)
+          print(f"Results uploaded in {time.time() - upload_start:.2f} seconds")
+        except (OSError) as e:
+          # The annotation did not write its results
+          print(f"Error in uploading files to S3!{e}")
+          failure = f"results are missing: {e}"
+        except (Exception) as e:
+          # ClientError, or boto3's S3UploadFailedError wrapping one
+          print(f"Error in uploading files to S3!{e}")
+          failure = f"results could not be uploaded: {e}"
+          retry = True
+
+      # A job left for a retry keeps its checkpoint and job directory, and
+      # resumes from them once its message is redelivered
+      if failure is not None and retry and not last_attempt:
+        lease.abandon()
+        print(f"Job {input_job_id} left for a retry, jobs directory {directory} kept")
+        return
+      if failure is not None:
+        fail_job(ann_table, input_job_id, failure)
+        if persist is not None:
+          drop_checkpoint(s3, results_bucket, checkpoint_prefix)
+        lease.release()
+        shutil.rmtree(directory)
+        print(f"Jobs directory {directory} removed successfully!")
+        return
+      if persist is not None:
+        drop_checkpoint(s3, results_bucket, checkpoint_prefix)
 
       # New try-except block for uploading to Dynamo
       complete_time= int(time.time())
@@ -108,13 +361,15 @@ def main():
           s3_key_result_file = :val2, \
           s3_key_log_file = :val3, \
           complete_time = :val4, \
-          job_status = :val5',
+          job_status = :val5, \
+          s3_key_metrics_file = :val6',
           ExpressionAttributeValues={
           ':val1': results_bucket,
           ':val2': annot_results,
           ':val3': annot_logs,
           ':val4': complete_time,
-          ':val5': 'COMPLETED'
+          ':val5': 'COMPLETED',
+          ':val6': annot_metrics
           }
           )
       except (ClientError) as e:
@@ -136,6 +391,9 @@ def main():
 
       except (ClientError) as e:
         print(f"Error in updating archive SNS topic! {e}")
+
+      # The job is over, so its message must not be redelivered
+      lease.release()
       
   else:
     print("The input to sub-process seems incorrect.")
@@ -0,0 +1,550 @@
+# snapshot.py
+#
+# Versioned, memory-mapped columnar snapshot of the annotator reference tables
+#
+# Builds an on-disk copy of every table the annotation stages query, so the
+# stages can run without touching the `annotator` MySQL database. Each table
+# is one file. For every chromosome it holds fixed-width int64 arrays in
+# native byte order: start, end, subtree max end and scan order, laid out as
+# an implicit interval tree (see intervals.py), and one per column, holding
+# the values of an integer column or the offsets of the cells of any other
+# column in a heap of strings. Files are mmap'ed, so opening a snapshot costs
+# nothing and every worker process on a host shares the same page cache.
+#
+# The builder streams each table in one scan and spools its rows to disk, so
+# it holds no more than a few int64 arrays per chromosome in memory. A
+# position's rows come back in the table-scan order, as from a replica (see
+# refdb.py).
+#
+# Layout of <root>:
+#   CURRENT             - name of the active version
+#   <version>/manifest.json
+#   <version>/<table>.snap
+#
+# Usage: python snapshot.py <snapshot root> [version]
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import sys
+import json
+import mmap
+import array
+import pickle
+import shutil
+import struct
+import time
+import decimal
+import datetime
+import tempfile
+
+import dbconn as dbc
+import intervals as iv
+import utils as u
+
+MAGIC = b"GASSNAP\x02"
+HEADER = struct.Struct("<8sQQ")
+FORMAT_VERSION = 2
+
+# Rows fetched from the database at a time
+FETCH_ROWS = 10000
+
+# Reference tables and the columns holding their chromosome, start and end.
+# Exact-match tables (dbSNP, the two bigRefGene equality tables and
+# gwasCatalog) use the matched column as both start and end.
+TABLES = {
+    "dbSNP": ("CHR", "POS", "POS", "*"),
+    "refGene": ("chrom", "txStart", "txEnd", "*"),
+    "chrom_pos_equal_base": ("CHR", "start", "start", "*"),
+    "chrom_pos_equal_nobase": ("CHR", "start", "start", "*"),
+    "chrom_pos_unequal": ("CHR", "start", "end", "*"),
+    "cytoBand": ("chrom", "chromStart", "chromEnd", "*"),
+    "gadAll": ("chromosome", "chromStart", "chromEnd", "*"),
+    "gwasCatalog": ("chrom", "chromEnd", "chromEnd", "*"),
+    "hugo": ("chrom", "chromStart", "chromEnd", "*"),
+    "dgv_Cnv": ("chrom", "chromStart", "chromEnd", "*"),
+    "abParts_IG_T_CelReceptors": ("chrom", "chromStart", "chromEnd", "*"),
+    "mcCarroll_Cnv": ("chrom", "chromStart", "chromEnd", "*"),
+    "conrad_Cnv": ("chrom", "chromStart", "chromEnd", "*"),
+    "genomicSuperDups": ("chrom", "chromStart", "chromEnd", "*"),
+    "targetScanS": ("chrom", "chromStart", "chromEnd", "*"),
+    "cpgIslandExt": (
+        "chrom",
+        "chromStart",
+        "chromEnd",
+        "chrom, chromStart, chromEnd, name",
+    ),
+}
+
+# tfbsConsSites is split into one MySQL table per chromosome; the snapshot
+# merges them into a single table keyed by the bare chromosome name
+TFBS_TABLE = "tfbsConsSites"
+TFBS_CHROMS = [str(c) for c in range(1, 23)] + ["X", "Y"]
+TFBS_COLUMNS = "chrom, chromStart, chromEnd, name"
+
+
+"""Row cells are encoded as JSON; types JSON cannot carry are tagged so the
+decoded row has the same Python types pymysql returns
+"""
+
+
+def encode_cell(value):
+    if isinstance(value, bytes):
+        return {"$b": value.decode("latin-1")}
+    if isinstance(value, decimal.Decimal):
+        return {"$d": str(value)}
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.timedelta)):
+        return {"$s": str(value)}
+    return value
+
+
+def decode_cell(obj):
+    if "$b" in obj:
+        return obj["$b"].encode("latin-1")
+    if "$d" in obj:
+        return decimal.Decimal(obj["$d"])
+    return obj["$s"]
+
+
+def encode_row(row):
+    return json.dumps([encode_cell(v) for v in row], separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+
+def decode_row(data):
+    return tuple(json.loads(data, object_hook=decode_cell))
+
+
+"""How a column's cells are stored: "int" columns hold only integers, kept
+in a fixed-width array; the cells of "str" columns are UTF-8 and of "cell"
+columns (NULLs, floats, decimals, bytes, dates) JSON in the string heap
+"""
+
+
+def cell_kind(value):
+    if type(value) is int:
+        return "int"
+    if type(value) is str:
+        return "str"
+    return "cell"
+
+
+def merge_kinds(kinds, row):
+    if kinds is None:
+        return [cell_kind(v) for v in row]
+    return [k if k == cell_kind(v) else "cell" for k, v in zip(kinds, row)]
+
+
+def encode_heap_cell(value, kind):
+    if kind == "str":
+        return value.encode("utf-8")
+    return json.dumps(encode_cell(value), separators=(",", ":")).encode("utf-8")
+
+
+def decode_heap_cell(data, kind):
+    if kind == "str":
+        return str(data, "utf-8")
+    return json.loads(str(data, "utf-8"), object_hook=decode_cell)
+
+
+"""Rows of one table spooled to a temporary file as the table is scanned
+Per chromosome it keeps the start, end, scan order and spool offset of every
+row in int64 arrays, and the kinds of its columns.
+"""
+
+
+class Spool(object):
+    def __init__(self, directory):
+        self.fh = tempfile.TemporaryFile(dir=directory)
+        self.chroms = {}
+        self.kinds = {}
+        self.seq = 0
+        self.view = None
+
+    def add(self, chrom, start, end, row):
+        arrays = self.chroms.get(chrom)
+        if arrays is None:
+            arrays = tuple([array.array("q") for i in range(4)])
+            self.chroms[chrom] = arrays
+        starts, ends, seqs, offsets = arrays
+        starts.append(start)
+        ends.append(end)
+        seqs.append(self.seq)
+        offsets.append(self.fh.tell())
+        self.fh.write(pickle.dumps(row, pickle.HIGHEST_PROTOCOL))
+        self.kinds[chrom] = merge_kinds(self.kinds.get(chrom), row)
+        self.seq = self.seq + 1
+
+    def row(self, offset):
+        # Bytes past a pickle are ignored, so the view need not be cut
+        if self.view is None:
+            self.fh.flush()
+            self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mm)
+        return pickle.loads(self.view[offset:])
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.mm.close()
+        self.fh.close()
+
+
+"""Writes one table file, one chromosome block at a time
+"""
+
+
+class TableWriter(object):
+    def __init__(self, path, table, columns):
+        self.path = path
+        self.fh = open(path + ".tmp", "wb")
+        self.fh.write(HEADER.pack(MAGIC, 0, 0))
+        self.directory = {"table": table, "columns": columns, "chroms": {}}
+        self.rows = 0
+
+    def align(self):
+        pad = (-self.fh.tell()) % 8
+        if pad:
+            self.fh.write(b"\0" * pad)
+
+    def write_array(self, values):
+        self.align()
+        offset = self.fh.tell()
+        self.fh.write(array.array("q", values).tobytes())
+        return offset
+
+    def add_spool(self, spool):
+        for chrom in sorted(spool.chroms):
+            self.add_chrom(chrom, spool, spool.kinds[chrom])
+
+    """Write a chromosome's rows, sorted by start and then scan order
+    """
+
+    def add_chrom(self, chrom, spool, kinds):
+        starts, ends, seqs, offsets = spool.chroms[chrom]
+        order = range(len(starts))
+        if any(starts[i] > starts[i + 1] for i in range(len(starts) - 1)):
+            order = sorted(order, key=starts.__getitem__)
+        block = {"count": len(starts)}
+        starts = array.array("q", [starts[i] for i in order])
+        ends = array.array("q", [ends[i] for i in order])
+        maxs, block["level"] = iv.index_core(starts, ends)
+        block["starts"] = self.write_array(starts)
+        block["ends"] = self.write_array(ends)
+        block["maxs"] = self.write_array(maxs)
+        block["seqs"] = self.write_array([seqs[i] for i in order])
+        block["columns"] = self.write_columns(
+            [offsets[i] for i in order], spool, kinds
+        )
+        self.directory["chroms"][chrom] = block
+        self.rows = self.rows + len(starts)
+
+    """One array per column, of the values of an "int" column or the heap
+    offsets of any other, followed by the heaps; cells are gathered in one
+    pass over the spooled rows, the heaps in temporary files
+    """
+
+    def write_columns(self, offsets, spool, kinds):
+        values = [array.array("q") for kind in kinds]
+        heaps = [None] * len(kinds)
+        for c in range(len(kinds)):
+            if kinds[c] != "int":
+                heaps[c] = tempfile.TemporaryFile(dir=os.path.dirname(self.path))
+                values[c].append(0)
+        for offset in offsets:
+            row = spool.row(offset)
+            for c in range(len(kinds)):
+                if heaps[c] is None:
+                    values[c].append(row[c])
+                else:
+                    heaps[c].write(encode_heap_cell(row[c], kinds[c]))
+                    values[c].append(heaps[c].tell())
+
+        columns = []
+        for c in range(len(kinds)):
+            column = {"kind": kinds[c], "values": self.write_array(values[c])}
+            if heaps[c] is not None:
+                column["heap"] = self.fh.tell()
+                heaps[c].seek(0)
+                shutil.copyfileobj(heaps[c], self.fh)
+                heaps[c].close()
+            columns.append(column)
+        return columns
+
+    def close(self):
+        directory = json.dumps(self.directory).encode("utf-8")
+        offset = self.fh.tell()
+        self.fh.write(directory)
+        self.fh.seek(0)
+        self.fh.write(HEADER.pack(MAGIC, offset, len(directory)))
+        self.fh.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+"""Memory-mapped reader for one table file
+Has the overlap()/stab()/first() interface of intervals.IntervalIndex, so
+stages can use either interchangeably.
+"""
+
+
+class SnapshotTable(object):
+    def __init__(self, path):
+        self.fh = open(path, "rb")
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, offset, length = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an annotator snapshot table")
+
+        directory = json.loads(self.mm[offset : offset + length].decode("utf-8"))
+        self.table = directory["table"]
+        self.columns = directory["columns"]
+        self.blocks = directory["chroms"]
+        self.chroms = {}
+        self.view = memoryview(self.mm)
+
+    def array(self, offset, count):
+        return self.view[offset : offset + 8 * count].cast("q")
+
+    def tree(self, chrom):
+        tree = self.chroms.get(chrom)
+        if tree is None:
+            block = self.blocks.get(chrom)
+            if block is None:
+                return None
+            n = block["count"]
+            columns = []
+            for column in block["columns"]:
+                if column["kind"] == "int":
+                    values = self.array(column["values"], n)
+                else:
+                    values = self.array(column["values"], n + 1)
+                columns.append((column["kind"], values, column.get("heap")))
+            tree = (
+                self.array(block["starts"], n),
+                self.array(block["ends"], n),
+                self.array(block["maxs"], n),
+                block["level"],
+                self.array(block["seqs"], n),
+                columns,
+            )
+            self.chroms[chrom] = tree
+        return tree
+
+    def row(self, columns, i):
+        cells = []
+        for kind, values, heap in columns:
+            if heap is None:
+                cells.append(values[i])
+            else:
+                data = self.view[heap + values[i] : heap + values[i + 1]]
+                cells.append(decode_heap_cell(data, kind))
+        return tuple(cells)
+
+    def overlap(self, chrom, lo, hi):
+        tree = self.tree(chrom)
+        if tree is None:
+            return []
+        starts, ends, maxs, level, seqs, columns = tree
+        hits = iv.overlap_core(starts, ends, maxs, level, lo, hi)
+        if len(hits) > 1:
+            hits.sort(key=lambda i: seqs[i])
+        return [self.row(columns, i) for i in hits]
+
+    def stab(self, chrom, pos, widen=0):
+        return self.overlap(chrom, pos - widen, pos + widen)
+
+    def first(self, chrom, pos):
+        rows = self.stab(chrom, pos)
+        if len(rows) > 0:
+            return rows[0]
+        return None
+
+    def column(self, name):
+        return self.columns.index(name)
+
+    def chromosomes(self):
+        return sorted(self.blocks)
+
+
+"""An opened snapshot version; tables are mapped on first use
+"""
+
+
+class Snapshot(object):
+    kind = "snapshot"
+
+    def __init__(self, root, version=None):
+        if version is None:
+            with open(os.path.join(root, "CURRENT")) as fh:
+                version = fh.read().strip()
+        self.root = root
+        self.version = version
+        self.path = os.path.join(root, version)
+        with open(os.path.join(self.path, "manifest.json")) as fh:
+            self.manifest = json.load(fh)
+        if self.manifest["format"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Snapshot {self.path} has format {self.manifest['format']}, "
+                + f"expected {FORMAT_VERSION}"
+            )
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError(
+                f"Snapshot {self.path} was built on a {self.manifest['byteorder']}"
+                + "-endian host"
+            )
+        self.tables = {}
+
+    def table(self, name):
+        if name not in self.tables:
+            if name not in self.manifest["tables"]:
+                raise KeyError(f"Table {name} is not in snapshot {self.path}")
+            self.tables[name] = SnapshotTable(
+                os.path.join(self.path, self.manifest["tables"][name]["file"])
+            )
+        return self.tables[name]
+
+
+_snapshots = {}
+
+"""Open the current version under root, once per process
+"""
+
+
+def open_snapshot(root):
+    if root not in _snapshots:
+        _snapshots[root] = Snapshot(root)
+    return _snapshots[root]
+
+
+"""Dump one MySQL table (or the per-chromosome tfbs tables) into a writer
+The table is read in one scan on a streaming cursor.
+"""
+
+
+def dump_table(conn, writer, table, chromColumn, startColumn, endColumn, columns):
+    spool = Spool(os.path.dirname(writer.path))
+    try:
+        cursor = dbc.streaming_cursor(conn)
+        names = column_names(cursor, table, columns)
+        writer.directory["columns"] = names
+        chrom_ind = names.index(chromColumn)
+        cursor.execute("select " + columns + " from " + table + ";")
+        spool_rows(
+            spool, cursor, lambda row: row[chrom_ind], names, startColumn, endColumn
+        )
+        cursor.close()
+        writer.add_spool(spool)
+    finally:
+        spool.close()
+
+
+def dump_tfbs(conn, writer):
+    spool = Spool(os.path.dirname(writer.path))
+    try:
+        cursor = dbc.streaming_cursor(conn)
+        names = column_names(cursor, TFBS_TABLE + TFBS_CHROMS[0], TFBS_COLUMNS)
+        writer.directory["columns"] = names
+        for chrom in TFBS_CHROMS:
+            cursor.execute(
+                "select " + TFBS_COLUMNS + " from " + TFBS_TABLE + chrom + ";"
+            )
+            spool_rows(
+                spool, cursor, lambda row: chrom, names, "chromStart", "chromEnd"
+            )
+        cursor.close()
+        writer.add_spool(spool)
+    finally:
+        spool.close()
+
+
+def column_names(cursor, table, columns):
+    cursor.execute("select " + columns + " from " + table + " limit 0;")
+    cursor.fetchall()
+    return [str(d[0]) for d in cursor.description]
+
+
+"""Spool the rows of an executed query, FETCH_ROWS at a time
+"""
+
+
+def spool_rows(spool, cursor, chrom_of, names, startColumn, endColumn):
+    start_ind = names.index(startColumn)
+    end_ind = names.index(endColumn)
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if len(rows) == 0:
+            break
+        for row in rows:
+            chrom = chrom_of(row)
+            # NULL coordinates never satisfy the stages' range predicates
+            if chrom is None or row[start_ind] is None or row[end_ind] is None:
+                continue
+            spool.add(str(chrom), int(row[start_ind]), int(row[end_ind]), tuple(row))
+
+
+"""Build a new snapshot version from the live database and make it current
+"""
+
+
+def build(conn, root, version=None):
+    if version is None:
+        version = time.strftime("%Y%m%d%H%M%S")
+    path = os.path.join(root, version)
+    os.makedirs(path)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "version": version,
+        "created": int(time.time()),
+        "tables": {},
+    }
+
+    for table in list(TABLES) + [TFBS_TABLE]:
+        start = time.time()
+        writer = TableWriter(os.path.join(path, table + ".snap"), table, [])
+        if table == TFBS_TABLE:
+            dump_tfbs(conn, writer)
+        else:
+            chromColumn, startColumn, endColumn, columns = TABLES[table]
+            dump_table(
+                conn, writer, table, chromColumn, startColumn, endColumn, columns
+            )
+        writer.close()
+        manifest["tables"][table] = {"file": table + ".snap", "rows": writer.rows}
+        print(f"{table}: {writer.rows} rows in {time.time() - start:.2f} seconds")
+
+    with open(os.path.join(path, "manifest.json"), "w") as fh:
+        json.dump(manifest, fh, indent=2)
+
+    current = os.path.join(root, "CURRENT")
+    with open(current + ".tmp", "w") as fh:
+        fh.write(version + "\n")
+    os.replace(current + ".tmp", current)
+    return version
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python snapshot.py <snapshot root> [version]")
+        sys.exit(1)
+
+    conn = u.db_connect()
+    try:
+        version = build(
+            conn, sys.argv[1], version=sys.argv[2] if len(sys.argv) > 2 else None
+        )
+    finally:
+        conn.close()
+    print(f"Snapshot {version} written to {sys.argv[1]}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+### EOF
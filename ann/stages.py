@@ -0,0 +1,1176 @@
+# stages.py
+#
+# Per-variant annotation stages used by the streaming pipeline in driver.py
+#
+# Each stage mirrors one of the file-to-file functions in annotate.py, but
+# annotates a single vcfblock.VariantRecord instead of a whole temp file, so
+# a variant can be parsed once and passed through every stage in memory.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import time
+import annotate as ann
+import file_utils as fu
+import genemodel as gm
+import intervals as iv
+import sweep as sw
+import utils as u
+import vcfinfo as vi
+
+
+"""Base class for a streaming annotation stage
+annotate() receives the vcfblock.VariantRecord of one data line (its split
+fields, with CHROM, POS, REF and ALT parsed) and returns the (possibly
+modified) record; summary() writes the stage's lines to the
+.count.log once every variant has been seen. open() is given the reference
+the stages read their tables from through its table(name): a
+snapshot.Snapshot, or a refdb.py backend (a SQLite replica or the MySQL
+database); referenceTable() is the stage's view of one of them.
+INFO is a vcfinfo.InfoField the stages append to.
+Independent stages only append to INFO based on the variant's position.
+They split annotate() into fragment(), a lookup that returns the text to
+add (or None) without touching the fields, and merge(), which adds it, so
+sidecar() can run while other stages work on the same records.
+counters names the attributes summary() reports, so counts() from stages
+that annotated separate parts of a file can be added up with mergeCounts().
+With a varcache.VariantCache, lookups that would go to the database are
+answered from it when possible, see cachedRows().
+The metrics counters (time, records, database queries and rows, bytes
+added to INFO) are kept for the job's metrics report, see metrics.py; the
+driver times the stage, MeteredTable counts the stage's database queries.
+"""
+
+
+class Stage(object):
+    label = ""
+    name = ""
+    independent = False
+    metrics = (
+        "wall_seconds",
+        "cpu_seconds",
+        "rows_read",
+        "db_queries",
+        "db_rows",
+        "bytes_written",
+    )
+    counters = ("var_count", "line_count", "cache_hits", "cache_misses") + metrics
+
+    def __init__(self, table=None, format="vcf", sep="\t"):
+        self.table = table
+        self.format = format
+        self.sep = sep
+        self.inds = ann.getFormatSpecificIndices(format=format)
+        self.backend = None
+        self.tables = {}
+        self.cache = None
+        self.var_count = 0
+        self.line_count = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        for name in Stage.metrics:
+            setattr(self, name, 0)
+
+    def open(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache
+
+    """Table name of the reference (the stage's own table if None), counted
+    by a MeteredTable when the reference is the database
+    """
+
+    def referenceTable(self, name=None):
+        name = name or self.table
+        if name not in self.tables:
+            table = self.backend.table(name)
+            if self.queriesDatabase():
+                table = MeteredTable(table, self)
+            self.tables[name] = table
+        return self.tables[name]
+
+    def queriesDatabase(self):
+        return self.backend.kind == "mysql"
+
+    def cachedRows(self, lookup, chrom, pos, ref="", alt="", table=None):
+        if self.cache is None:
+            return lookup()
+
+        key = self.cache.key(table or self.table, chrom, pos, ref, alt)
+        rows = self.cache.get(key)
+        if rows is not None:
+            self.cache_hits = self.cache_hits + 1
+            return rows
+
+        self.cache_misses = self.cache_misses + 1
+        rows = lookup()
+        self.cache.put(key, rows)
+        return rows
+
+    def annotate(self, fields):
+        fragment = self.fragment(fields)
+        if fragment is None:
+            return fields
+        return self.merge(fields, fragment)
+
+    def annotateBatch(self, records):
+        return [self.annotate(fields) for fields in records]
+
+    def fragment(self, fields):
+        return None
+
+    def merge(self, fields, fragment):
+        appendInfo(fields, fragment)
+        return fields
+
+    def sidecar(self, records):
+        fragments = []
+        for i in range(len(records)):
+            fragment = self.fragment(records[i])
+            if fragment is not None:
+                fragments.append((i, fragment))
+        return fragments
+
+    def summary(self, fh_log):
+        fh_log.write(
+            f"In {str(self.table)}: {str(self.var_count)} in "
+            + f"{str(self.line_count)} variants\n"
+        )
+
+    def close(self):
+        self.tables = {}
+
+    def counts(self):
+        return dict([(name, getattr(self, name)) for name in self.counters])
+
+    def mergeCounts(self, counts):
+        for name in counts:
+            setattr(self, name, getattr(self, name) + counts[name])
+
+
+"""Reference table counting the queries a stage issues and the rows they
+return
+"""
+
+
+class MeteredTable(object):
+    def __init__(self, table, stage):
+        self.table = table
+        self.stage = stage
+
+    def count(self, rows):
+        self.stage.db_queries = self.stage.db_queries + 1
+        self.stage.db_rows = self.stage.db_rows + len(rows)
+        return rows
+
+    def overlap(self, chrom, lo, hi):
+        return self.count(self.table.overlap(chrom, lo, hi))
+
+    def stab(self, chrom, pos, widen=0):
+        return self.count(self.table.stab(chrom, pos, widen))
+
+    def first(self, chrom, pos):
+        row = self.table.first(chrom, pos)
+        self.count([row] if row is not None else [])
+        return row
+
+    def rows_by_start(self, chrom):
+        self.count([])
+        for seq, row in self.table.rows_by_start(chrom):
+            self.stage.db_rows = self.stage.db_rows + 1
+            yield seq, row
+
+    def stab_many(self, chrom, positions):
+        return self.count(self.table.stab_many(chrom, positions))
+
+    def column(self, name):
+        return self.table.column(name)
+
+
+"""Appends records to the INFO field the way the overlap functions do
+"""
+
+
+def appendInfo(fields, text):
+    fields[7].add(text)
+
+
+# dbSNP lookup source of each kind of reference open() is given
+LOOKUP_SOURCES = {"snapshot": "snapshot", "sqlite": "replica"}
+
+
+"""Whether a reference cell holds the given text, ignoring case, as the
+legacy queries' = comparisons do in MySQL
+"""
+
+
+def same_text(cell, text):
+    return str(cell).upper() == str(text).upper()
+
+
+"""dbSNP membership, see annotate.getSnpsFromDbSnp
+Rows at the variant's position are kept if their REF is the variant's (or
+its complement) and their INFO its variant class. With batch_size > 1,
+database lookups are made batch_size variants at a time with one
+stab_many() query per chromosome, and rows are matched back to each
+variant client-side. With a bloom.BloomFilter of the same variant class,
+variants whose position is definitely not in dbSNP are not looked up at all.
+"""
+
+
+class DbSnpStage(Stage):
+    label = "dbSNP"
+    counters = Stage.counters + (
+        "linenum",
+        "queries",
+        "seconds",
+        "bloom_checks",
+        "bloom_skips",
+    )
+
+    def __init__(
+        self, format="vcf", varclass="SNV", sep="\t", batch_size=1, bloom=None
+    ):
+        Stage.__init__(self, table="dbSNP", format=format, sep=sep)
+        self.varclass = varclass
+        self.batch_size = batch_size
+        self.bloom = None
+        if bloom is not None and bloom.varclass == varclass:
+            self.bloom = bloom
+        self.bloom_checks = 0
+        self.bloom_skips = 0
+        self.linenum = 1
+        self.queries = 0
+        self.seconds = 0.0
+        self.source = "batch" if batch_size > 1 else "query"
+
+    def absent(self, chr, pos):
+        if self.bloom is None:
+            return False
+        self.bloom_checks = self.bloom_checks + 1
+        if self.bloom.mayContain(chr, pos):
+            return False
+        self.bloom_skips = self.bloom_skips + 1
+        return True
+
+    def annotate(self, fields):
+        chr, pos, ref, compRef = fields.bare, fields.pos, fields.ref, fields.comp_ref
+        if self.absent(chr, pos):
+            return self.addRows(fields, [])
+        rows = self.cachedRows(
+            lambda: self.queryRows(chr, pos, ref, compRef), chr, pos, ref
+        )
+        return self.addRows(fields, rows)
+
+    def queryRows(self, chr, pos, ref, compRef):
+        table = self.referenceTable()
+        ref_ind = table.column("REF")
+        info_ind = table.column("INFO")
+        rows = table.stab(chr, int(pos))
+        if self.queriesDatabase():
+            self.queries = self.queries + 1
+        return [
+            row
+            for row in rows
+            if (same_text(row[ref_ind], ref) or same_text(row[ref_ind], compRef))
+            and same_text(row[info_ind], self.varclass)
+        ]
+
+    def annotateBatch(self, records):
+        start = time.time()
+        if self.batch_size > 1 and self.queriesDatabase():
+            for i in range(0, len(records), self.batch_size):
+                end = min(i + self.batch_size, len(records))
+                self.lookupBatch(records[i:end], self.parseBatch(records, i, end))
+        else:
+            records = Stage.annotateBatch(self, records)
+        self.seconds = self.seconds + (time.time() - start)
+        return records
+
+    """(chrom, pos, ref, compRef) of records[start:end], as dbSNP stores them
+    """
+
+    def parseBatch(self, records, start, end):
+        return [
+            (fields.bare, fields.position, fields.ref, fields.comp_ref)
+            for fields in records[start:end]
+        ]
+
+    def lookupBatch(self, records, variants):
+        keys = []
+        cached = []
+        positions = {}
+        for chr, pos, ref, compRef in variants:
+            keys.append((chr, pos, ref, compRef))
+            rows = None
+            if self.absent(chr, pos):
+                rows = []
+            elif self.cache is not None:
+                rows = self.cache.get(self.cache.key(self.table, chr, pos, ref))
+                if rows is not None:
+                    self.cache_hits = self.cache_hits + 1
+                else:
+                    self.cache_misses = self.cache_misses + 1
+            cached.append(rows)
+            if rows is None:
+                positions.setdefault(chr, set()).add(pos)
+
+        table = self.referenceTable()
+        hits = {}
+        for chr in positions:
+            rows = table.stab_many(chr, sorted(positions[chr]))
+            self.queries = self.queries + 1
+            pos_ind = table.column("POS")
+            info_ind = table.column("INFO")
+            for row in rows:
+                if same_text(row[info_ind], self.varclass):
+                    hits.setdefault((chr, int(row[pos_ind])), []).append(row)
+
+        ref_ind = table.column("REF") if len(hits) > 0 else None
+        for fields, (chr, pos, ref, compRef), rows in zip(records, keys, cached):
+            if rows is None:
+                rows = [
+                    row
+                    for row in hits.get((chr, pos), [])
+                    if same_text(row[ref_ind], ref) or same_text(row[ref_ind], compRef)
+                ]
+                if self.cache is not None:
+                    self.cache.put(self.cache.key(self.table, chr, pos, ref), rows)
+            self.addRows(fields, rows)
+
+    """Where variants are looked up: MySQL one "query" per variant or a
+    "batch" of them per query, or the "snapshot" or "replica" open() was
+    given; it goes with the counts of the stage
+    """
+
+    def open(self, backend, cache=None):
+        Stage.open(self, backend, cache)
+        if backend.kind in LOOKUP_SOURCES:
+            self.source = LOOKUP_SOURCES[backend.kind]
+
+    def counts(self):
+        counts = Stage.counts(self)
+        counts["source"] = self.source
+        return counts
+
+    def mergeCounts(self, counts):
+        counts = dict(counts)
+        self.source = counts.pop("source")
+        Stage.mergeCounts(self, counts)
+        # linenum starts at 1 in every part, as it does in the legacy stage
+        self.linenum = self.linenum - 1
+
+    def addRows(self, fields, rows):
+        fields[2] = "."
+        if len(rows) > 0:
+            rsids = []
+            mafs = []
+            for row in rows:
+                rsids.append(str(row[3]))
+                if str(row[7]) != ".":
+                    mafs.append("GMAF=" + str(row[7]))
+
+            maf_str = ""
+            if len(mafs) > 0:
+                maf_str = ";" + ";".join([str(x) for x in mafs])
+
+            self.var_count = self.var_count + 1
+            if str(fields[7]) == ".":
+                fields[7] = vi.InfoField("DB" + maf_str)
+            else:
+                fields[7].append(";DB;VC=" + self.varclass + maf_str)
+
+            fields[2] = str(";".join(rsids))
+
+        self.linenum = self.linenum + 1
+        return fields
+
+    def summary(self, fh_log):
+        ratioInDbSnp = (self.var_count / float(self.linenum)) * 100
+        fh_log.write("## Please notice that all Isoforms were counted\n")
+        fh_log.write("## Numbers may exceed number of variants in the annotated file\n")
+        fh_log.write(f"Total: {str(self.linenum)}\n")
+        fh_log.write(f"In dbSNP: {str(self.var_count)} ({str(ratioInDbSnp)}%)\n")
+
+        variants = self.linenum - 1
+        rate = variants / self.seconds if self.seconds > 0 else 0.0
+        source = self.source
+        if source == "batch":
+            source = f"batch (size {str(self.batch_size)})"
+        # Only MySQL lookups are counted as queries
+        queries = ""
+        if self.queries > 0:
+            queries = f"{str(self.queries)} queries, "
+        fh_log.write(
+            f"## dbSNP lookup from {source}: {str(variants)} variants in {queries}"
+            + f"{self.seconds:.2f} seconds ({rate:.1f} variants/s)\n"
+        )
+        if self.bloom_checks > 0:
+            fh_log.write(
+                f"## dbSNP Bloom filter: {str(self.bloom_skips)} of "
+                + f"{str(self.bloom_checks)} variants skipped "
+                + f"({100.0 * self.bloom_skips / self.bloom_checks:.1f}%)\n"
+            )
+
+
+"""Known-transcript consequences from the three bigRefGene tables
+The first non-empty tier answers: rows at the variant's position with its
+(or the complementary) bases, then rows at its position, then rows whose
+range contains it. With lookup "query" the database is asked for all three
+tiers in one UNION query; with "index" they are answered from memory, the
+two single-position tables from a hash and the ranges from an
+IntervalIndex. A snapshot or replica is asked one tier at a time.
+"""
+
+
+class BigRefGeneStage(Stage):
+    label = "BigRefGene"
+    tierTables = ("chrom_pos_equal_base", "chrom_pos_equal_nobase", "chrom_pos_unequal")
+
+    def __init__(self, format="vcf", sep="\t", lookup="query"):
+        Stage.__init__(self, table="bigRefGene", format=format, sep=sep)
+        self.lookup = lookup
+        self.tiers = None
+
+    def open(self, backend, cache=None):
+        Stage.open(self, backend, cache)
+        base, nobase, unequal = self.tierTables
+        if not self.queriesDatabase():
+            self.tiers = [self.referenceTable(name) for name in self.tierTables]
+        elif self.lookup == "index":
+            conn = backend.connection()
+            self.tiers = [
+                iv.load_points(conn, base, "CHR", "start"),
+                iv.load_points(conn, nobase, "CHR", "start"),
+                iv.load_table(conn, unequal, "CHR", "start", "end"),
+            ]
+
+    def annotate(self, fields):
+        return self.annotateVariant(
+            fields,
+            fields.bare,
+            fields.pos,
+            fields.ref,
+            fields.alt,
+            fields.comp_ref,
+            fields.comp_alt,
+        )
+
+    def annotateVariant(self, fields, chr, pos, ref, alt, compRef, compAlt):
+        if self.tiers is not None:
+            rows = self.indexTiers(chr, int(pos), ref, alt, compRef, compAlt)
+        else:
+            rows = self.cachedRows(
+                lambda: self.queryTiers(chr, pos, ref, alt, compRef, compAlt),
+                chr,
+                pos,
+                ref,
+                alt,
+            )
+        if len(rows) > 0:
+            self.addRows(fields, rows)
+        return fields
+
+    def queryTiers(self, chr, pos, ref, alt, compRef, compAlt):
+        tiers = self.backend.stab_tables(self.tierTables, chr, int(pos))
+        self.db_queries = self.db_queries + 1
+        self.db_rows = self.db_rows + sum([len(rows) for rows in tiers])
+        base = self.referenceTable(self.tierTables[0])
+        rows = self.baseRows(base, tiers[0], ref, alt, compRef, compAlt)
+        if len(rows) == 0:
+            rows = tiers[1]
+        if len(rows) == 0:
+            rows = tiers[2]
+        return rows
+
+    def indexTiers(self, chr, pos, ref, alt, compRef, compAlt):
+        base, nobase, unequal = self.tiers
+        rows = self.baseRows(base, base.stab(chr, pos), ref, alt, compRef, compAlt)
+        if len(rows) == 0:
+            rows = nobase.stab(chr, pos)
+        if len(rows) == 0:
+            rows = unequal.stab(chr, pos)
+        return rows
+
+    """Rows of the base tier with the variant's (or the complementary) bases
+    """
+
+    def baseRows(self, base, rows, ref, alt, compRef, compAlt):
+        ref_ind = base.column("haplotypeReference")
+        alt_ind = base.column("haplotypeAlternate")
+        return [
+            row
+            for row in rows
+            if (same_text(row[ref_ind], ref) and same_text(row[alt_ind], alt))
+            or (same_text(row[ref_ind], compRef) and same_text(row[alt_ind], compAlt))
+        ]
+
+    def addRows(self, fields, rows):
+        m = set([])
+        for row in rows:
+            m.add(ann.collapseRefSeq("\t".join([str(x) for x in row[1 : len(row)]])))
+
+        fields[7].append(";" + ";".join(m))
+        if fields[7].startswith(".;"):
+            fields[7].drop(2)
+
+    def summary(self, fh_log):
+        pass
+
+
+"""Location in gene structures, see annotate.getGenes
+"""
+
+
+class GenesStage(Stage):
+    label = "Genes"
+    counters = Stage.counters + (
+        "interGenic_count",
+        "cds_count",
+        "utr3_count",
+        "utr5_count",
+        "intronic_count",
+        "non_coding_intronic_count",
+        "exonic_count",
+        "non_coding_exonic_count",
+        "promoter_count",
+    )
+
+    def __init__(
+        self,
+        format="vcf",
+        table="refGene",
+        promoter_offset=500,
+        sep="\t",
+        lookup="query",
+        cpg_lookup="query",
+    ):
+        Stage.__init__(self, table=table, format=format, sep=sep)
+        self.promoter_offset = promoter_offset
+        self.lookup = lookup
+        self.cpg_lookup = cpg_lookup
+        self.model = None
+        self.cpgIndex = None
+        self.cpgKey = None
+        self.cpgRow = None
+        self.interGenic_count = 0
+        self.cds_count = 0
+        self.utr3_count = 0
+        self.utr5_count = 0
+        self.intronic_count = 0
+        self.non_coding_intronic_count = 0
+        self.exonic_count = 0
+        self.non_coding_exonic_count = 0
+        self.promoter_count = 0
+
+    def open(self, backend, cache=None):
+        Stage.open(self, backend, cache)
+        if self.lookup == "index":
+            if self.queriesDatabase():
+                self.model = gm.load_model(
+                    backend.connection(), self.table, int(self.promoter_offset)
+                )
+            else:
+                self.model = gm.load_model(
+                    None, self.table, int(self.promoter_offset), backend
+                )
+        if self.cpg_lookup == "index" and self.queriesDatabase():
+            self.cpgIndex = iv.load_table(
+                backend.connection(),
+                "cpgIslandExt",
+                columns="chrom, chromStart, chromEnd, name",
+            )
+
+    """Transcripts whose range, widened by the promoter offset, contains pos
+    """
+
+    def getTranscripts(self, chr, pos):
+        offset = int(self.promoter_offset)
+        return self.cachedRows(
+            lambda: self.referenceTable().stab(chr, int(pos), offset),
+            chr,
+            pos,
+            table=self.table + ":" + str(self.promoter_offset),
+        )
+
+    """CpG island containing a position, looked up at most once per variant
+    The transcripts around a variant all ask about the same position, so the
+    last answer is kept and reused until the position changes.
+    """
+
+    def getCpgIsland(self, chr, pos):
+        key = (str(chr), str(pos))
+        if key != self.cpgKey:
+            self.cpgRow = self.findCpgIsland(chr, pos)
+            self.cpgKey = key
+        return self.cpgRow
+
+    def findCpgIsland(self, chr, pos):
+        if self.cpgIndex is not None:
+            return self.cpgIndex.first(chr, int(pos))
+        table = self.referenceTable("cpgIslandExt")
+        if self.cache is not None:
+            rows = self.cachedRows(
+                lambda: [row for row in [table.first(chr, int(pos))] if row],
+                chr,
+                pos,
+                table="cpgIslandExt",
+            )
+            return rows[0] if len(rows) > 0 else None
+        return table.first(chr, int(pos))
+
+    def annotate(self, fields):
+        promoter_offset = self.promoter_offset
+        chr = fields.chrom
+        pos = fields.pos
+        info_field = fields[7]
+
+        if self.model is not None:
+            return self.annotateModel(fields, chr, fields.position, info_field)
+
+        rows = self.getTranscripts(chr, pos)
+        info = []
+
+        if len(rows) > 0:
+            for row in rows:
+                # count location
+                self.countPositionType(info_field)
+
+                txtStart = int(row[4])
+                txtEnd = int(row[5])
+                cdsStart = int(row[6])
+                cdsEnd = int(row[7])
+                exonCount = int(row[8])
+                exonStarts = str(row[9].decode("utf-8"))
+                exonEnds = str(row[10].decode("utf-8"))
+                strand = str(row[3])
+
+                promoter_plus = txtStart - int(promoter_offset)
+                promoter_minus = txtEnd + int(promoter_offset)
+                region = ""
+                pos = int(pos)
+                exons = []
+                exonsSt = exonStarts.split(",")
+                exonsEn = exonEnds.split(",")
+
+                if cdsStart == cdsEnd:
+                    for e in range(0, exonCount):
+                        if u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e])):
+                            exnum = e + 1
+                            if strand == "-":
+                                exnum = exonCount - e
+                            exons.append(
+                                "non_coding_exon="
+                                + "ex"
+                                + str(exnum)
+                                + "/"
+                                + str(exonCount)
+                            )
+                    if len(exons) > 0:
+                        region = ";".join(exons)
+                elif u.isBetween(pos, cdsStart, cdsEnd):
+                    for e in range(0, exonCount):
+                        if u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e])):
+                            exnum = e + 1
+                            if strand == "-":
+                                exnum = exonCount - e
+                            exons.append(
+                                "exon=" + "ex" + str(exnum) + "/" + str(exonCount)
+                            )
+                            self.exonic_count = self.exonic_count + 1
+                    if len(exons) > 0:
+                        region = ";".join(exons)
+
+                elif (
+                    u.isBetween(pos, promoter_plus, txtStart) and (strand == "+")
+                ) or (u.isBetween(pos, txtEnd, promoter_minus) and (strand == "-")):
+                    cpg = self.getCpgIsland(chr, pos)
+                    if cpg is not None:
+                        region = "putativePromoterRegion=" + "".join(
+                            str(cpg[3]).split()
+                        )
+                        self.promoter_count = self.promoter_count + 1
+
+                if region != "":
+                    info.append(
+                        ann.collapseGeneNames(
+                            row=row,
+                            indices=ann.indicesKnownGenes,
+                            region=region,
+                            cnt=0,
+                        )
+                    )
+
+            fields[7].append(";" + ";".join(info))
+
+        else:
+            fields[7].append(";positionType=interGenic")
+            self.interGenic_count = self.interGenic_count + 1
+
+        return fields
+
+    """Classify a variant from the precomputed gene model, see genemodel.py
+    Gives the same entries as the per-transcript exon walk in annotate().
+    """
+
+    def annotateModel(self, fields, chr, pos, info_field):
+        transcripts = self.model.lookup(chr, pos)
+        if len(transcripts) == 0:
+            fields[7].append(";positionType=interGenic")
+            self.interGenic_count = self.interGenic_count + 1
+            return fields
+
+        info = []
+        for transcript, features in transcripts:
+            self.countPositionType(info_field)
+
+            exons = []
+            region = ""
+            for kind, label in features:
+                if kind == gm.NON_CODING_EXON:
+                    exons.append("non_coding_exon=" + label)
+                elif kind == gm.EXON:
+                    exons.append("exon=" + label)
+                    self.exonic_count = self.exonic_count + 1
+                elif kind == gm.PROMOTER:
+                    cpg = self.getCpgIsland(chr, pos)
+                    if cpg is not None:
+                        region = "putativePromoterRegion=" + "".join(
+                            str(cpg[3]).split()
+                        )
+                        self.promoter_count = self.promoter_count + 1
+            if len(exons) > 0:
+                region = ";".join(exons)
+
+            if region != "":
+                info.append(transcript.label(region))
+
+        fields[7].append(";" + ";".join(info))
+        return fields
+
+    def countPositionType(self, info_field):
+        positionType = info_field.field("positionType")
+
+        if positionType == "intron":
+            self.intronic_count = self.intronic_count + 1
+        elif positionType == "non_coding_intron":
+            self.non_coding_intronic_count = self.non_coding_intronic_count + 1
+        elif positionType == "CDS":
+            self.cds_count = self.cds_count + 1
+        elif positionType == "non_coding_exon":
+            self.non_coding_exonic_count = self.non_coding_exonic_count + 1
+        elif positionType == "utr5":
+            self.utr5_count = self.utr5_count + 1
+        elif positionType == "utr3":
+            self.utr3_count = self.utr3_count + 1
+
+    def summary(self, fh_log):
+        counts = [
+            ("interGenic", self.interGenic_count),
+            ("CDS", self.cds_count),
+            ("'3 UTR", self.utr3_count),
+            ("'5 UTR", self.utr5_count),
+            ("Intronic", self.intronic_count),
+            ("Non_coding_intronic", self.non_coding_intronic_count),
+            ("Exonic", self.exonic_count),
+            ("Non_coding_exonic", self.non_coding_exonic_count),
+            ("Putative Promoter Region", self.promoter_count),
+        ]
+        print("Variants located:")
+        fh_log.write("Variants located:\n")
+        for name, count in counts:
+            print(f"In {name} {str(count)}")
+            fh_log.write(f"In {name} {str(count)}\n")
+
+
+"""Base class for stages that look up reference intervals containing a position
+With a snapshot or replica, rows come from its table; from the database,
+lookup selects how they are read:
+    "query" - one query per variant
+    "index" - an in-memory IntervalIndex of the whole table, loaded once
+              per process
+    "sweep" - a SweepJoin reading the table once per chromosome alongside
+              a coordinate-sorted input; if the input turns out not to be
+              sorted the stage falls back to "query" for the rest of the job
+"""
+
+
+class OverlapStage(Stage):
+    independent = True
+    chromColumn = "chrom"
+    startColumn = "chromStart"
+    endColumn = "chromEnd"
+
+    def __init__(self, table=None, format="vcf", sep="\t", lookup="query"):
+        Stage.__init__(self, table=table, format=format, sep=sep)
+        self.lookup = lookup
+        self.index = None
+        self.join = None
+
+    def open(self, backend, cache=None):
+        Stage.open(self, backend, cache)
+        if not self.queriesDatabase():
+            return
+        if self.lookup == "index":
+            self.index = iv.load_table(
+                backend.connection(),
+                self.table,
+                self.chromColumn,
+                self.startColumn,
+                self.endColumn,
+            )
+        elif self.lookup == "sweep":
+            self.join = sw.SweepJoin(
+                self.referenceTable(), self.startColumn, self.endColumn
+            )
+
+    def chrom(self, fields):
+        return fields.chrom
+
+    def swept(self, chr, pos):
+        if self.join.advance(chr, int(pos)):
+            return self.join.stab(int(pos))
+
+        print(
+            f"{self.table}: input is not coordinate-sorted, "
+            + "falling back to per-variant lookups"
+        )
+        self.join = None
+        return None
+
+    def overlapping(self, chr, pos):
+        if self.index is not None:
+            return self.index.stab(chr, int(pos))
+        if self.join is not None:
+            rows = self.swept(chr, pos)
+            if rows is not None:
+                return rows
+        return self.cachedRows(
+            lambda: self.referenceTable().stab(chr, int(pos)), chr, pos
+        )
+
+    def firstOverlapping(self, chr, pos):
+        if self.index is None and self.join is None and self.cache is None:
+            return self.referenceTable().first(chr, int(pos))
+        rows = self.overlapping(chr, pos)
+        if len(rows) > 0:
+            return rows[0]
+        return None
+
+
+"""Overlap with Cytoband table, see annotate.addOverlapWithCytoband
+"""
+
+
+class CytobandStage(OverlapStage):
+    label = "Cytoband"
+
+    def __init__(self, format="vcf", table="cytoBand", sep="\t", lookup="query"):
+        OverlapStage.__init__(
+            self, table=table, format=format, sep=sep, lookup=lookup
+        )
+        self.colindex = 12
+        self.startColumn = "txStart"
+        self.endColumn = "txEnd"
+        if table == "cytoBand":
+            self.colindex = 3
+            self.startColumn = "chromStart"
+            self.endColumn = "chromEnd"
+
+    def fragment(self, fields):
+        rows = self.overlapping(self.chrom(fields), fields.pos)
+
+        if len(rows) > 0:
+            self.line_count = self.line_count + 1
+            overlapsWith = []
+            for row in rows:
+                self.var_count = self.var_count + 1
+                overlapsWith.append(str(row[self.colindex]))
+            overlapsWith = u.dedup(overlapsWith)
+            cytoband = ";".join([str(x) for x in overlapsWith])
+            return str(self.table) + "=" + str(cytoband)
+
+        return None
+
+
+"""Overlap with GadAll table, see annotate.addOverlapWithGadAll
+"""
+
+
+class GadAllStage(OverlapStage):
+    label = "gadAll"
+    chromColumn = "chromosome"
+
+    def __init__(self, format="vcf", table="gadAll", sep="\t", lookup="query"):
+        OverlapStage.__init__(
+            self, table=table, format=format, sep=sep, lookup=lookup
+        )
+
+    def chrom(self, fields):
+        # For some reason this table has no "chr" preceeding number
+        return fields.bare
+
+    def fragment(self, fields):
+        rows = self.overlapping(self.chrom(fields), fields.pos)
+
+        if len(rows) > 0:
+            self.line_count = self.line_count + 1
+            records = []
+            r_tmp = []
+            for row in rows:
+                self.var_count = self.var_count + 1
+                if not fu.isOnTheList(r_tmp, str(row[3])):
+                    r_tmp.append(str(row[3]))
+                    records.append(str(self.table) + "=" + str(row[3]))
+            return ";".join(records)
+
+        return None
+
+    def merge(self, fields, fragment):
+        appendInfo(fields, fragment)
+        # The file-based stage writes annotated lines joined with "\t ",
+        # so every later column carries a leading space
+        return fields.resplit(vi.join_fields(fields, "\t "), "\t")
+
+
+"""Overlap with gwasCatalog table, see annotate.addOverlapWithGwasCatalog
+"""
+
+
+class GwasCatalogStage(Stage):
+    label = "GwasCatalog"
+    independent = True
+
+    def __init__(self, format="vcf", table="gwasCatalog", sep="\t"):
+        Stage.__init__(self, table=table, format=format, sep=sep)
+
+    def fragment(self, fields):
+        chr = fields.chrom
+        pos = fields.pos
+        rows = self.cachedRows(
+            lambda: self.referenceTable().stab(chr, int(pos)), chr, pos
+        )
+
+        if len(rows) > 0:
+            self.line_count = self.line_count + 1
+            records = []
+            for row in rows:
+                self.var_count = self.var_count + 1
+                records.append(
+                    str(self.table)
+                    + "="
+                    + str("pubMedID")
+                    + "="
+                    + str(row[5])
+                    + ",trait="
+                    + str(row[10])
+                )
+            return ";".join(records)
+
+        return None
+
+
+"""Overlap with HGNC table, see annotate.addOverlapWitHUGOGeneNomenclature
+"""
+
+
+class HugoStage(OverlapStage):
+    label = "HUGO Gene Nomenclature Committee"
+
+    def __init__(self, format="vcf", table="hugo", sep="\t", lookup="query"):
+        OverlapStage.__init__(
+            self, table=table, format=format, sep=sep, lookup=lookup
+        )
+
+    def fragment(self, fields):
+        rows = self.overlapping(self.chrom(fields), fields.pos)
+
+        if len(rows) > 0:
+            self.line_count = self.line_count + 1
+            records = []
+            r_tmp = []
+            for row in rows:
+                self.var_count = self.var_count + 1
+                t = str(str(row[5]) + "," + str(row[6])).strip()
+                if not fu.isOnTheList(r_tmp, t):
+                    r_tmp.append(t)
+                    records.append("HGNC_GeneAnnotation" + "=" + t)
+            return ",".join(records).replace(";", ",")
+
+        return None
+
+
+"""Overlap with CNV tables, see annotate.addOverlapWithCnvDatabase
+"""
+
+
+class CnvStage(OverlapStage):
+    def __init__(self, format="vcf", table="dgv_Cnv", sep="\t", lookup="query"):
+        OverlapStage.__init__(
+            self, table=table, format=format, sep=sep, lookup=lookup
+        )
+        self.label = table
+
+    def fragment(self, fields):
+        row = self.firstOverlapping(self.chrom(fields), fields.pos)
+
+        if row is not None:
+            self.line_count = self.line_count + 1
+            self.var_count = self.var_count + 1
+            return str(self.table) + "=" + str(True)
+
+        return None
+
+
+"""Overlap with segdup regions, see annotate.addOverlapWithGenomicSuperDups
+"""
+
+
+class GenomicSuperDupsStage(OverlapStage):
+    label = "genomicSuperDups"
+
+    def __init__(
+        self, format="vcf", table="genomicSuperDups", sep="\t", lookup="query"
+    ):
+        OverlapStage.__init__(
+            self, table=table, format=format, sep=sep, lookup=lookup
+        )
+
+    def fragment(self, fields):
+        row = self.firstOverlapping(self.chrom(fields), fields.pos)
+
+        if row is not None:
+            self.line_count = self.line_count + 1
+            self.var_count = self.var_count + 1
+            return (
+                ";"
+                + str(self.table)
+                + "="
+                + str(True)
+                + ";"
+                + "otherChrom="
+                + str(row[7])
+                + ";otherStart="
+                + str(row[8])
+                + ";otherEnd="
+                + str(row[9])
+            )
+
+        return None
+
+    def merge(self, fields, fragment):
+        fields[7].append(fragment)
+        return fields
+
+
+"""Overlap with targetScanS table, see annotate.addOverlapWithMiRNA
+"""
+
+
+class MiRNAStage(OverlapStage):
+    label = "miRNA"
+
+    def __init__(self, format="vcf", table="targetScanS", sep="\t", lookup="query"):
+        OverlapStage.__init__(
+            self, table=table, format=format, sep=sep, lookup=lookup
+        )
+
+    def fragment(self, fields):
+        row = self.firstOverlapping(self.chrom(fields), fields.pos)
+
+        if row is not None:
+            self.line_count = self.line_count + 1
+            self.var_count = self.var_count + 1
+            t = (
+                str(row[4])
+                + ","
+                + str(row[1])
+                + "_"
+                + str(row[2])
+                + "_"
+                + str(row[3])
+            )
+            return "miRNAsites=" + t.strip()
+
+        return None
+
+    def summary(self, fh_log):
+        fh_log.write(
+            f"In miRNAsites: {str(self.var_count)} in "
+            + f"{str(self.line_count)} variants\n"
+        )
+
+
+"""Overlap with tfbsConsSites, see annotate.addOverlapWithTfbsConsSites
+The reference is split into one table per chromosome, so the index keeps
+one IntervalIndex per table, keyed by the bare chromosome name; the
+reference's table takes the bare name for the chromosome.
+"""
+
+
+class TfbsConsSitesStage(OverlapStage):
+    label = "addOverlapWithTfbsConsSites"
+
+    allowed_chrom = [str(c) for c in range(1, 23)] + ["X", "Y"]
+    columns = "chrom, chromStart, chromEnd, name"
+
+    def __init__(self, format="vcf", table="tfbsConsSites", sep="\t", lookup="query"):
+        OverlapStage.__init__(
+            self, table=table, format=format, sep=sep, lookup=lookup
+        )
+        self.indexes = {}
+
+    def open(self, backend, cache=None):
+        Stage.open(self, backend, cache)
+        if not self.queriesDatabase():
+            return
+        if self.lookup == "index":
+            for chrIndex in self.allowed_chrom:
+                self.indexes[chrIndex] = iv.load_table(
+                    backend.connection(),
+                    self.table + chrIndex,
+                    columns=self.columns,
+                    chrom=chrIndex,
+                )
+        elif self.lookup == "sweep":
+            self.join = sw.SweepJoin(self.referenceTable())
+
+    def overlapping(self, chrIndex, pos):
+        if chrIndex in self.indexes:
+            return self.indexes[chrIndex].stab(chrIndex, int(pos))
+        if self.join is not None:
+            rows = self.swept(chrIndex, pos)
+            if rows is not None:
+                return rows
+        return self.cachedRows(
+            lambda: self.referenceTable().stab(chrIndex, int(pos)), chrIndex, pos
+        )
+
+    def fragment(self, fields):
+        chrIndex = self.chrom(fields).replace("chr", "")
+
+        if chrIndex in self.allowed_chrom:
+            rows = self.overlapping(chrIndex, fields.pos)
+
+            if len(rows) > 0:
+                self.line_count = self.line_count + 1
+                records = []
+                for row in rows:
+                    self.var_count = self.var_count + 1
+                    t = (
+                        str(row[3])
+                        + "."
+                        + str(row[0])
+                        + "."
+                        + str(row[1])
+                        + "."
+                        + str(row[2])
+                    )
+                    records.append("tfbsRegion" + "=" + t.strip())
+                return ";".join(records)
+
+        return None
+
+
+### EOF
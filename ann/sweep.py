@@ -0,0 +1,97 @@
+# sweep.py
+#
+# Sort-merge sweep join between a coordinate-sorted VCF and a reference table
+#
+# The table's rows of a chromosome are streamed in start order and swept
+# alongside the variants: intervals enter an active set once their start is
+# reached and leave it once their end falls behind the current position.
+# Each table costs one sequential scan per chromosome instead of one indexed
+# probe per variant, and only the active intervals are held in memory.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import heapq
+
+
+"""Sweep join over one reference table
+table is a refdb.ReferenceTable, or anything with its rows_by_start(chrom)
+and column(name), and startColumn and endColumn name its range. Callers
+must check advance() before each stab(); it returns False as soon as the
+variants are found to be out of order (a position moving backwards or a
+chromosome coming back), after which the join can no longer be used.
+"""
+
+
+class SweepJoin(object):
+    def __init__(self, table, startColumn="chromStart", endColumn="chromEnd"):
+        self.table = table
+        self.startColumn = startColumn
+        self.endColumn = endColumn
+        self.chrom = None
+        self.pos = None
+        self.done = set()
+        self.stream = iter(())
+        self.ahead = None
+        self.active = []
+        self.hits = []
+        self.scans = 0
+
+    def advance(self, chrom, pos):
+        if chrom != self.chrom:
+            if chrom in self.done:
+                return False
+            if self.chrom is not None:
+                self.done.add(self.chrom)
+            self.load(chrom)
+        elif pos < self.pos:
+            return False
+        self.pos = pos
+        return True
+
+    def load(self, chrom):
+        self.start_ind = self.table.column(self.startColumn)
+        self.end_ind = self.table.column(self.endColumn)
+        self.chrom = chrom
+        self.stream = iter(self.table.rows_by_start(chrom))
+        self.ahead = self.read()
+        self.active = []
+        self.hits = []
+        self.scans = self.scans + 1
+
+    """Next (start, end, seq, row) of the stream, or None at its end
+    Rows without a range never contain a position and are skipped.
+    """
+
+    def read(self):
+        for seq, row in self.stream:
+            start = row[self.start_ind]
+            end = row[self.end_ind]
+            if start is not None and end is not None:
+                return (int(start), int(end), seq, row)
+        return None
+
+    """Rows containing pos, in scan order
+    The active set is a heap on end, so intervals left behind are popped off
+    its top; the hits are only sorted again when the set has changed.
+    """
+
+    def stab(self, pos):
+        changed = False
+        while self.ahead is not None and self.ahead[0] <= pos:
+            start, end, seq, row = self.ahead
+            heapq.heappush(self.active, (end, seq, row))
+            self.ahead = self.read()
+            changed = True
+        while len(self.active) > 0 and self.active[0][0] < pos:
+            heapq.heappop(self.active)
+            changed = True
+
+        if changed:
+            self.hits = [r[2] for r in sorted(self.active, key=lambda r: r[1])]
+        return self.hits
+
+
+### EOF
@@ -0,0 +1,147 @@
+# tabix.py
+#
+# Reading the target regions of a BGZF VCF through its tabix index
+#
+# A .tbi index maps each chromosome of a sorted BGZF file to binning-scheme
+# bins of chunks (virtual offset ranges) plus a linear index of the first
+# offset in every 16 kb window. For the regions of a target set, the chunks
+# of the bins overlapping them are collected per chromosome, clipped by the
+# linear index and merged, and only those parts of the file are
+# decompressed and read, instead of the whole file.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import gzip
+import struct
+
+import bgzf as bz
+import targets as tg
+
+TBI_MAGIC = b"TBI\x01"
+
+# Width of a linear index window
+LINEAR_SHIFT = 14
+
+
+"""Per-chromosome bins and linear index of a .tbi file
+"""
+
+
+class TabixIndex(object):
+    def __init__(self, path):
+        with gzip.open(path, "rb") as fh:
+            data = fh.read()
+        if data[:4] != TBI_MAGIC:
+            raise ValueError(f"{path}: not a tabix index")
+        header = struct.unpack("<8i", data[4:36])
+        n_ref, self.format, self.col_seq, self.col_beg, self.col_end = header[:5]
+        self.meta = chr(header[5])
+        self.skip = header[6]
+        l_nm = header[7]
+        names = data[36 : 36 + l_nm].split(b"\x00")[:-1]
+        self.names = [name.decode("utf-8") for name in names]
+
+        offset = 36 + l_nm
+        self.bins = []
+        self.linear = []
+        for r in range(n_ref):
+            bins = {}
+            n_bin = struct.unpack("<i", data[offset : offset + 4])[0]
+            offset = offset + 4
+            for b in range(n_bin):
+                bin_id, n_chunk = struct.unpack("<Ii", data[offset : offset + 8])
+                offset = offset + 8
+                size = 16 * n_chunk
+                chunks = struct.unpack(f"<{2 * n_chunk}Q", data[offset : offset + size])
+                offset = offset + size
+                bins[bin_id] = list(zip(chunks[0::2], chunks[1::2]))
+            n_intv = struct.unpack("<i", data[offset : offset + 4])[0]
+            offset = offset + 4
+            linear = data[offset : offset + 8 * n_intv]
+            self.linear.append(struct.unpack(f"<{n_intv}Q", linear))
+            offset = offset + 8 * n_intv
+            self.bins.append(bins)
+
+    """Merged (start, end) virtual offset ranges holding every record of
+    chromosome ref that overlaps one of the 0-based [beg, end) regions
+    """
+
+    def chunks(self, ref, regions):
+        chunks = []
+        bins = self.bins[ref]
+        linear = self.linear[ref]
+        for beg, end in regions:
+            window = beg >> LINEAR_SHIFT
+            min_offset = linear[min(window, len(linear) - 1)] if len(linear) > 0 else 0
+            for bin_id in reg2bins(beg, end):
+                for start, stop in bins.get(bin_id, []):
+                    if stop > min_offset:
+                        chunks.append((max(start, min_offset), stop))
+        chunks.sort()
+        merged = []
+        for start, stop in chunks:
+            if len(merged) > 0 and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+        return merged
+
+
+"""Bins of the binning scheme overlapping the 0-based [beg, end) region
+"""
+
+
+def reg2bins(beg, end):
+    end = end - 1
+    bins = [0]
+    for shift, first in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+    return bins
+
+
+def has_index(path):
+    return os.path.exists(path + ".tbi") and bz.is_bgzf(path)
+
+
+"""Header lines of a BGZF VCF, then the data lines of it that
+targets.filter_lines() would keep, read through the tabix index next to it;
+counts.kept is the number of data lines yielded (lines outside the targets
+are mostly never read, so they are not counted as skipped)
+"""
+
+
+def region_lines(path, targets, counts):
+    index = TabixIndex(path + ".tbi")
+    reader = bz.BgzfReader(path)
+    try:
+        reader.seek(0)
+        while True:
+            line = reader.readline().decode("utf-8")
+            if not line.startswith(index.meta):
+                break
+            yield line
+
+        for ref, name in enumerate(index.names):
+            regions = targets.regions(name)
+            if len(regions) == 0:
+                continue
+            for start, stop in index.chunks(ref, regions):
+                reader.seek(start)
+                while reader.tell() < stop:
+                    line = reader.readline().decode("utf-8")
+                    if len(line) == 0:
+                        break
+                    if line.startswith(index.meta):
+                        continue
+                    if tg.keeps(targets, line):
+                        counts.kept = counts.kept + 1
+                        yield line
+    finally:
+        reader.close()
+
+
+### EOF
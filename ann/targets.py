@@ -0,0 +1,156 @@
+# targets.py
+#
+# Target regions (BED) for panel jobs
+#
+# Clinical panels only need the variants inside their capture regions. A
+# TargetSet holds the regions of a BED file, merged and sorted per
+# chromosome, and answers whether a variant position is inside one with a
+# binary search, so variants outside the targets can be dropped before any
+# lookup.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+from bisect import bisect_right
+
+
+"""Chromosome name without its "chr" prefix, so BED and VCF files that
+disagree on it still match
+"""
+
+
+def normalize(chrom):
+    chrom = chrom.strip()
+    if chrom.startswith("chr"):
+        return chrom[3:]
+    return chrom
+
+
+"""Merged target regions per chromosome
+Regions are BED intervals: 0-based, end exclusive, so the 1-based VCF
+position pos is inside [start, end) when start < pos <= end.
+"""
+
+
+class TargetSet(object):
+    def __init__(self):
+        self.pending = {}
+        self.starts = {}
+        self.ends = {}
+
+    def add(self, chrom, start, end):
+        if end > start:
+            self.pending.setdefault(normalize(chrom), []).append((start, end))
+
+    def build(self):
+        for chrom, regions in self.pending.items():
+            regions.sort()
+            starts = []
+            ends = []
+            for start, end in regions:
+                if len(ends) > 0 and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[chrom] = starts
+            self.ends[chrom] = ends
+        self.pending = {}
+        return self
+
+    def contains(self, chrom, pos):
+        starts = self.starts.get(normalize(chrom))
+        if starts is None:
+            return False
+        i = bisect_right(starts, pos - 1) - 1
+        return i >= 0 and pos - 1 < self.ends[normalize(chrom)][i]
+
+    def regions(self, chrom):
+        chrom = normalize(chrom)
+        return list(zip(self.starts.get(chrom, []), self.ends.get(chrom, [])))
+
+    def count(self):
+        return sum([len(starts) for starts in self.starts.values()])
+
+
+"""Read a BED file; track, browser and comment lines are skipped
+"""
+
+
+def load_bed(path):
+    targets = TargetSet()
+    with open(path) as fh:
+        for line in fh:
+            if line.startswith(("#", "track", "browser")) or len(line.strip()) == 0:
+                continue
+            fields = line.split()
+            if len(fields) < 3:
+                raise ValueError(
+                    f"{path}: BED line without start and end: {line.strip()}"
+                )
+            targets.add(fields[0], int(fields[1]), int(fields[2]))
+    return targets.build()
+
+
+"""Counts of the data lines a filter has seen
+"""
+
+
+class TargetCounts(object):
+    def __init__(self):
+        self.kept = 0
+        self.skipped = 0
+
+    def add(self, kept, skipped):
+        self.kept = self.kept + kept
+        self.skipped = self.skipped + skipped
+
+
+"""Whether a data line is kept: it lies inside the targets, or its position
+cannot be read (it is left for the stages to deal with as before)
+"""
+
+
+def keeps(targets, line):
+    fields = line.split("\t", 2)
+    try:
+        return targets.contains(fields[0], int(fields[1]))
+    except (IndexError, ValueError):
+        return True
+
+
+"""Lines of a VCF with the data lines outside the targets left out, see
+keeps(); header lines pass through
+"""
+
+
+def filter_lines(lines, targets, counts):
+    for line in lines:
+        if line.startswith("#"):
+            yield line
+            continue
+        if keeps(targets, line):
+            counts.kept = counts.kept + 1
+            yield line
+        else:
+            counts.skipped = counts.skipped + 1
+
+
+"""One .count.log line on the target filter of a job
+"""
+
+
+def report(targets, counts, method):
+    line = (
+        f"## Targets: {str(targets.count())} regions, "
+        + f"{str(counts.kept)} variants kept"
+    )
+    if method == "tabix":
+        return line + " (read through the tabix index)"
+    total = counts.kept + counts.skipped
+    return line + f" of {str(total)} (scan)"
+
+
+### EOF
@@ -0,0 +1,32 @@
+# conftest.py
+#
+# Shared setup of the annotator's tests
+#
+# The annotator's modules import each other by name from the ann directory,
+# as run.py and the benchmarks do, so it goes first on the path. Run with
+# python -m pytest from the ann directory (or with ann/tests as the path).
+#
+# Tests marked integration need the reference MySQL database (and pymysql,
+# boto3 and its credentials); they only run with GAS_INTEGRATION_TESTS=1 set,
+# e.g. GAS_INTEGRATION_TESTS=1 python -m pytest -m integration tests
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import sys
+
+ANN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ANN_DIR not in sys.path:
+    sys.path.insert(0, ANN_DIR)
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "integration: needs the reference MySQL database"
+    )
+
+
+### EOF
@@ -0,0 +1,258 @@
+# test_bgzf.py
+#
+# Tests of BGZF writing and reading (bgzf.py) and of reading target regions
+# through a tabix index (tabix.py)
+#
+# The tests write their own .tbi indexes, with the binning scheme and
+# linear index of the tabix format, so no htslib is needed.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import gzip
+import random
+import struct
+
+import bgzf as bz
+import tabix as tbx
+import targets as tg
+
+
+HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def vcf_lines(rng, chroms, n, span):
+    lines = []
+    for chrom in chroms:
+        positions = sorted([rng.randint(1, span) for i in range(n)])
+        for pos in positions:
+            info = "DP=" + str(rng.randint(1, 99)) + ";X=" + "A" * rng.randint(0, 40)
+            lines.append(f"{chrom}\t{str(pos)}\t.\tA\tG\t50\tPASS\t{info}\n")
+    return lines
+
+
+def test_writer_round_trip(tmp_path):
+    rng = random.Random(1)
+    text = HEADER + "".join(vcf_lines(rng, ["chr1", "chr2"], 3000, 10 ** 6))
+    assert len(text) > 3 * bz.BLOCK_SIZE
+    path = str(tmp_path / "out.vcf.gz")
+    writer = bz.BgzfWriter(path, threads=2)
+    for i in range(0, len(text), 7777):
+        writer.write(text[i : i + 7777])
+    writer.close()
+
+    assert bz.is_compressed(path) and bz.is_bgzf(path)
+    with open(path, "rb") as fh:
+        assert fh.read()[-len(bz.EOF_BLOCK) :] == bz.EOF_BLOCK
+    with gzip.open(path, "rt") as fh:
+        assert fh.read() == text
+    with bz.open_text(path) as fh:
+        assert fh.readline() == text.splitlines(True)[0]
+    assert writer.text_bytes == len(text.encode("utf-8"))
+    assert writer.compressed_bytes == len(open(path, "rb").read())
+
+
+"""Parts written without the EOF block can be concatenated into one file
+"""
+
+
+def test_concatenated_parts(tmp_path):
+    parts = [
+        "".join(["part" + str(p) + " line " + str(i) + "\n" for i in range(5000)])
+        for p in range(3)
+    ]
+    data = b""
+    for p in range(len(parts)):
+        path = str(tmp_path / ("part" + str(p)))
+        writer = bz.BgzfWriter(path, threads=1, eof=p == len(parts) - 1)
+        writer.write(parts[p])
+        writer.close()
+        data = data + open(path, "rb").read()
+    path = str(tmp_path / "all.gz")
+    with open(path, "wb") as fh:
+        fh.write(data)
+    with gzip.open(path, "rt") as fh:
+        assert fh.read() == "".join(parts)
+
+
+def test_gzip_is_not_bgzf(tmp_path):
+    path = str(tmp_path / "plain.vcf.gz")
+    with gzip.open(path, "wt") as fh:
+        fh.write(HEADER)
+    assert bz.is_compressed(path)
+    assert not bz.is_bgzf(path)
+    assert bz.plain_name(path) == str(tmp_path / "plain.vcf")
+
+
+def test_reader_lines_and_virtual_offsets(tmp_path):
+    rng = random.Random(2)
+    lines = vcf_lines(rng, ["chr1"], 4000, 10 ** 6)
+    path = str(tmp_path / "in.vcf.gz")
+    writer = bz.BgzfWriter(path, threads=2)
+    writer.write("".join(lines))
+    writer.close()
+
+    reader = bz.BgzfReader(path)
+    reader.seek(0)
+    offsets = []
+    for line in lines:
+        offsets.append(reader.tell())
+        assert reader.readline().decode("utf-8") == line
+    assert reader.readline() == b""
+    for i in (0, 1, 1234, len(lines) - 1):
+        reader.seek(offsets[i])
+        assert reader.readline().decode("utf-8") == lines[i]
+    reader.close()
+
+
+"""Smallest bin of the binning scheme holding the 0-based [beg, end)
+"""
+
+
+def reg2bin(beg, end):
+    end = end - 1
+    for shift, first in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+    return 0
+
+
+"""Write a header and sorted VCF lines as BGZF blocks of block_lines lines,
+with a tabix index next to it; position gives the position a line is
+indexed at
+"""
+
+
+def write_indexed(path, lines, block_lines=20, position=lambda f: int(f[1])):
+    names = []
+    bins = {}
+    linear = {}
+    groups = [[HEADER]] + [
+        lines[i : i + block_lines] for i in range(0, len(lines), block_lines)
+    ]
+    with open(path, "wb") as fh:
+        for group in groups:
+            coffset = fh.tell()
+            data = b""
+            for line in group:
+                start = (coffset << 16) | len(data)
+                data = data + line.encode("utf-8")
+                if line.startswith("#"):
+                    continue
+                fields = line.split("\t")
+                if fields[0] not in names:
+                    names.append(fields[0])
+                ref = names.index(fields[0])
+                beg = position(fields) - 1
+                end = beg + len(fields[3])
+                chunk = (start, (coffset << 16) | len(data))
+                bin_id = reg2bin(beg, end)
+                bins.setdefault(ref, {}).setdefault(bin_id, []).append(chunk)
+                windows = linear.setdefault(ref, {})
+                last = (end - 1) >> tbx.LINEAR_SHIFT
+                for w in range(beg >> tbx.LINEAR_SHIFT, last + 1):
+                    windows[w] = min(windows.get(w, start), start)
+            fh.write(bz.compress_block(data))
+        fh.write(bz.EOF_BLOCK)
+
+    packed_names = b"".join([name.encode("utf-8") + b"\x00" for name in names])
+    index = tbx.TBI_MAGIC + struct.pack(
+        "<8i", len(names), 2, 1, 2, 0, ord("#"), 0, len(packed_names)
+    )
+    index = index + packed_names
+    for ref in range(len(names)):
+        index = index + struct.pack("<i", len(bins[ref]))
+        for bin_id, chunks in sorted(bins[ref].items()):
+            index = index + struct.pack("<Ii", bin_id, len(chunks))
+            for start, stop in chunks:
+                index = index + struct.pack("<QQ", start, stop)
+        windows = linear[ref]
+        offsets = []
+        for w in range(max(windows) + 1):
+            # Empty windows take the offset of the window before them
+            offsets.append(windows.get(w, offsets[-1] if offsets else 0))
+        index = index + struct.pack(f"<i{len(offsets)}Q", len(offsets), *offsets)
+    with gzip.open(path + ".tbi", "wb") as fh:
+        fh.write(index)
+
+
+def test_tabix_index_header(tmp_path):
+    rng = random.Random(3)
+    path = str(tmp_path / "in.vcf.gz")
+    write_indexed(path, vcf_lines(rng, ["chr1", "chr2"], 50, 10 ** 5))
+    assert tbx.has_index(path)
+    index = tbx.TabixIndex(path + ".tbi")
+    assert index.names == ["chr1", "chr2"]
+    assert index.meta == "#"
+    assert (index.col_seq, index.col_beg) == (1, 2)
+
+
+def test_region_lines_match_a_filter_of_the_whole_file(tmp_path):
+    rng = random.Random(4)
+    lines = vcf_lines(rng, ["chr1", "chr2", "chr3"], 1500, 3 * 10 ** 6)
+    path = str(tmp_path / "in.vcf.gz")
+    write_indexed(path, lines)
+
+    targets = tg.TargetSet()
+    targets.add("chr1", 0, 1000)
+    targets.add("chr1", 150000, 152000)
+    targets.add("chr1", 400000, 1700000)
+    targets.add("2", 2990000, 3000000)
+    targets.add("chr7", 0, 10 ** 6)
+    targets.build()
+
+    counts = tg.TargetCounts()
+    read = list(tbx.region_lines(path, targets, counts))
+    expected = [
+        line
+        for line in lines
+        if targets.contains(line.split("\t")[0], int(line.split("\t")[1]))
+    ]
+    assert read == HEADER.splitlines(True) + expected
+    assert counts.kept == len(expected)
+    assert 0 < len(expected) < len(lines)
+
+
+"""Data lines whose position cannot be read are kept, through the index as
+by a filter of the whole file
+"""
+
+
+def test_unreadable_positions_are_kept(tmp_path):
+    lines = [
+        f"chr1\t{pos}\t.\tA\tG\t50\tPASS\t.\n"
+        for pos in ("100", "2OO", "300", "90000")
+    ]
+    path = str(tmp_path / "in.vcf.gz")
+    write_indexed(path, lines, 1, lambda f: int(f[1].replace("O", "0")))
+    targets = tg.TargetSet()
+    targets.add("chr1", 0, 1000)
+    targets.build()
+
+    counts = tg.TargetCounts()
+    read = list(tbx.region_lines(path, targets, counts))
+    assert read == HEADER.splitlines(True) + lines[:3]
+    assert counts.kept == 3
+
+    counts = tg.TargetCounts()
+    read = list(tg.filter_lines(HEADER.splitlines(True) + lines, targets, counts))
+    assert read == HEADER.splitlines(True) + lines[:3]
+    assert (counts.kept, counts.skipped) == (3, 1)
+
+
+def test_region_lines_without_targets_on_the_file(tmp_path):
+    rng = random.Random(5)
+    path = str(tmp_path / "in.vcf.gz")
+    write_indexed(path, vcf_lines(rng, ["chr1"], 100, 10 ** 5))
+    targets = tg.TargetSet()
+    targets.add("chr9", 0, 10 ** 6)
+    counts = tg.TargetCounts()
+    assert list(tbx.region_lines(path, targets.build(), counts)) == (
+        HEADER.splitlines(True)
+    )
+    assert counts.kept == 0
+
+
+### EOF
@@ -0,0 +1,117 @@
+# test_checkpoint.py
+#
+# Tests of resuming job steps from the manifest in checkpoint.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import json
+import os
+
+import checkpoint as ck
+
+
+def write(path, text, mode="w"):
+    with open(path, mode) as fh:
+        fh.write(text)
+    return path
+
+
+"""A job directory with one step recorded: its output and the log it
+appended to
+"""
+
+
+def recorded_job(tmp_path, fingerprint="job-1"):
+    base = str(tmp_path / "in.vcf")
+    output = write(base + ".1", "annotated\n")
+    log = write(base + ".count.log", "Total: 3\n")
+    journal = ck.JobCheckpoint(base, fingerprint)
+    journal.record("stage1", [output], {"lines": 3}, logs=[log])
+    return base, output, log
+
+
+def test_resume_returns_recorded_values(tmp_path):
+    base, output, log = recorded_job(tmp_path)
+    journal = ck.JobCheckpoint(base, "job-1")
+    assert journal.resume("stage1") == {"lines": 3}
+    assert journal.resume("stage2") is None
+    assert journal.report() == {"resumed_steps": 1, "recorded_steps": 0}
+
+
+def test_resume_cuts_logs_back(tmp_path):
+    base, output, log = recorded_job(tmp_path)
+    write(log, "Lines of a later step\n", "a")
+    journal = ck.JobCheckpoint(base, "job-1")
+    assert journal.resume("stage1") == {"lines": 3}
+    with open(log) as fh:
+        assert fh.read() == "Total: 3\n"
+
+
+def test_resume_rejects_changed_files(tmp_path):
+    base, output, log = recorded_job(tmp_path)
+    write(output, "Annotated\n")
+    assert ck.JobCheckpoint(base, "job-1").resume("stage1") is None
+
+    base, output, log = recorded_job(tmp_path)
+    write(output, "more\n", "a")
+    assert ck.JobCheckpoint(base, "job-1").resume("stage1") is None
+
+    base, output, log = recorded_job(tmp_path)
+    write(log, "Total")
+    assert ck.JobCheckpoint(base, "job-1").resume("stage1") is None
+
+    base, output, log = recorded_job(tmp_path)
+    os.remove(output)
+    assert ck.JobCheckpoint(base, "job-1").resume("stage1") is None
+
+
+def test_resume_ignores_other_jobs_and_bad_manifests(tmp_path):
+    base, output, log = recorded_job(tmp_path)
+    assert ck.JobCheckpoint(base, "job-2").resume("stage1") is None
+
+    write(ck.manifest_name(base), "{ not json")
+    assert ck.JobCheckpoint(base, "job-1").resume("stage1") is None
+
+    base, output, log = recorded_job(tmp_path)
+    with open(ck.manifest_name(base)) as fh:
+        manifest = json.load(fh)
+    manifest["version"] = ck.VERSION + 1
+    write(ck.manifest_name(base), json.dumps(manifest))
+    assert ck.JobCheckpoint(base, "job-1").resume("stage1") is None
+
+
+"""Recording with replace drops the steps before it, and finish() leaves
+only the output step, without persisting it
+"""
+
+
+def test_replace_and_finish(tmp_path):
+    base, output, log = recorded_job(tmp_path)
+    persisted = []
+    journal = ck.JobCheckpoint(
+        base, "job-1", lambda path, added, removed: persisted.append(removed)
+    )
+    second = write(base + ".2", "annotated again\n")
+    journal.record("stage2", [second], {"lines": 3}, logs=[log], replace=True)
+    assert persisted == [[os.path.basename(output)]]
+    assert journal.resume("stage1") is None
+
+    final = write(base + ".annot.vcf", "final\n")
+    journal.finish([final], [log])
+    assert len(persisted) == 1
+
+    resumed = ck.JobCheckpoint(base, "job-1")
+    assert resumed.resume("stage2") is None
+    assert resumed.resume(ck.OUTPUT_STEP) == {"complete": True}
+
+
+def test_file_digest_of_a_prefix(tmp_path):
+    path = write(str(tmp_path / "data"), "abcdef")
+    assert ck.file_digest(path, 3) == ck.file_digest(write(path + ".3", "abc"))
+    assert ck.file_digest(path)[0] == 6
+
+
+### EOF
@@ -0,0 +1,97 @@
+# test_extsort.py
+#
+# Tests of the external sort in extsort.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import io
+import os
+import random
+
+import pytest
+
+import extsort as es
+
+
+HEADER = ["##fileformat=VCFv4.1", "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+
+
+"""Data lines over a few chromosomes, in the VCF's chromosome order, some
+sharing a position and some with the chromosome named without "chr"
+"""
+
+
+def data_lines(rng, n):
+    lines = []
+    for chrom in ("chr1", "chr2", "chrX"):
+        for i in range(n):
+            name = chrom if rng.random() < 0.8 else chrom[3:]
+            pos = rng.randint(1, 50)
+            lines.append(f"{name}\t{str(pos)}\t.\tA\tG\t50\tPASS\tID={str(len(lines))}")
+    return lines
+
+
+def sort_key(line, ranks):
+    fields = line.split("\t")
+    return (ranks[es.normal_chrom(fields[0])], int(fields[1]))
+
+
+def test_is_sorted():
+    assert es.is_sorted(HEADER + ["chr1\t5", "1\t5", "chr1\t9", "chr2\t1"])
+    assert not es.is_sorted(["chr1\t5", "chr1\t4"])
+    assert not es.is_sorted(["chr1\t5", "chr2\t1", "chr1\t9"])
+    # Positions that cannot be read count as 0
+    assert es.is_sorted(["chr1\tabc", "chr1\t1"])
+
+
+@pytest.mark.parametrize("memory", [1 << 20, 2000, 400])
+def test_sort_lines_is_stable_and_restores_order(memory, tmp_path):
+    rng = random.Random(memory)
+    lines = data_lines(rng, 200)
+    shuffled = list(lines)
+    rng.shuffle(shuffled)
+    prefix = str(tmp_path / "job")
+
+    fh_out = io.StringIO()
+    fh_order = io.StringIO()
+    variants, runs = es.sort_lines(HEADER + shuffled, fh_out, prefix, memory, fh_order)
+    assert variants == len(lines)
+    assert (runs > 1) == (memory < 1 << 20)
+
+    # Chromosomes rank in order of first appearance; ties keep input order
+    ranks = {}
+    for line in shuffled:
+        ranks.setdefault(es.normal_chrom(line.split("\t")[0]), len(ranks))
+    expected = sorted(shuffled, key=lambda line: sort_key(line, ranks))
+    written = fh_out.getvalue().splitlines()
+    assert written == HEADER + expected
+    assert es.is_sorted(written)
+
+    fh_order.seek(0)
+    fh_restored = io.StringIO()
+    es.restore_order(written, fh_order, fh_restored, prefix, memory)
+    assert fh_restored.getvalue().splitlines() == HEADER + shuffled
+
+    # Run files are deleted once they are merged
+    assert [name for name in os.listdir(tmp_path) if ".run" in name] == []
+
+
+def test_merge_of_more_runs_than_the_fan_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(es, "MAX_FANIN", 3)
+    sorter = es.ExternalSorter(str(tmp_path / "many"), 1)
+    rng = random.Random(3)
+    keys = [(rng.randint(0, 5), rng.randint(0, 100)) for i in range(40)]
+    for i in range(len(keys)):
+        sorter.add(keys[i] + (i,), "line" + str(i))
+    assert len(sorter.runs) == 40
+    merged = list(sorter.merged())
+    assert [key for key, line in merged] == sorted(
+        [keys[i] + (i,) for i in range(len(keys))]
+    )
+    assert os.listdir(tmp_path) == []
+
+
+### EOF
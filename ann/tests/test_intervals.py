@@ -0,0 +1,103 @@
+# test_intervals.py
+#
+# Tests of the implicit interval tree in intervals.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import array
+import random
+
+import pytest
+
+import intervals as iv
+
+
+"""Sorted random closed intervals, some nested, some empty-width, some
+sharing a start
+"""
+
+
+def random_intervals(rng, n, span=10000):
+    entries = []
+    for i in range(n):
+        start = rng.randint(0, span)
+        width = rng.choice([0, 1, rng.randint(0, 50), rng.randint(0, 2000)])
+        entries.append((start, start + width))
+    entries.sort()
+    return [start for start, end in entries], [end for start, end in entries]
+
+
+def brute_force(starts, ends, lo, hi):
+    return [i for i in range(len(starts)) if starts[i] <= hi and lo <= ends[i]]
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 7, 8, 15, 16, 17, 31, 100, 257, 1000])
+def test_overlap_core_matches_brute_force(n):
+    rng = random.Random(n)
+    starts, ends = random_intervals(rng, n)
+    maxs, level = iv.index_core(starts, ends)
+    for i in range(200):
+        lo = rng.randint(-10, 12000)
+        hi = lo + rng.choice([0, 0, 1, rng.randint(0, 3000)])
+        hits = iv.overlap_core(starts, ends, maxs, level, lo, hi)
+        assert sorted(hits) == brute_force(starts, ends, lo, hi)
+
+
+def test_overlap_core_on_memoryviews():
+    rng = random.Random(1)
+    starts, ends = random_intervals(rng, 300)
+    maxs, level = iv.index_core(starts, ends)
+    views = [memoryview(array.array("q", values)) for values in (starts, ends, maxs)]
+    for pos in range(0, 12000, 37):
+        hits = iv.overlap_core(views[0], views[1], views[2], level, pos, pos)
+        assert sorted(hits) == brute_force(starts, ends, pos, pos)
+
+
+def test_overlap_core_boundaries():
+    starts = [10, 20, 30]
+    ends = [15, 20, 40]
+    maxs, level = iv.index_core(starts, ends)
+
+    def stab(pos):
+        return sorted(iv.overlap_core(starts, ends, maxs, level, pos, pos))
+
+    assert stab(9) == []
+    assert stab(10) == [0]
+    assert stab(15) == [0]
+    assert stab(16) == []
+    assert stab(20) == [1]
+    assert stab(40) == [2]
+    assert stab(41) == []
+
+
+"""Hits come back in the order the rows were added, however they sort
+"""
+
+
+def test_interval_index_keeps_scan_order():
+    index = iv.IntervalIndex()
+    index.add("chr1", 50, 100, "c")
+    index.add("chr1", 10, 200, "a")
+    index.add("chr1", 50, 60, "b")
+    index.add("chr2", 10, 200, "other")
+    index.build()
+    assert index.stab("chr1", 55) == ["c", "a", "b"]
+    assert index.overlap("chr1", 150, 300) == ["a"]
+    assert index.first("chr1", 55) == "c"
+    assert index.first("chr1", 500) is None
+    assert index.stab("chr3", 55) == []
+
+
+def test_point_index():
+    index = iv.PointIndex(["CHR", "start", "name"])
+    index.add("1", 100, ("1", 100, "x"))
+    index.add("1", 100, ("1", 100, "y"))
+    assert index.stab("1", 100) == [("1", 100, "x"), ("1", 100, "y")]
+    assert index.stab("1", 101) == []
+    assert index.column("name") == 2
+
+
+### EOF
@@ -0,0 +1,107 @@
+# test_mysql.py
+#
+# Integration test of the streaming pipeline against the reference MySQL
+# database
+#
+# test_pipeline.py compares the streaming modes with the legacy pipeline on
+# a SQLite replica. This runs the legacy pipeline and the same modes, plus
+# the variant cache, on MySQL itself, so its collation and row order are
+# exercised too. The input is the VCF at GAS_INTEGRATION_VCF, or else a
+# synthetic one over hg19 chromosomes 21 and 22 (see benchmark/vcfgen.py).
+# With GAS_INTEGRATION_REPLICA set to a replica copied from the database
+# (python refdb.py copy), the modes also run on the replica, to check that it
+# returns rows in the order the legacy queries get them from MySQL.
+#
+# Run with: GAS_INTEGRATION_TESTS=1 python -m pytest -m integration tests
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+
+import pytest
+
+if os.environ.get("GAS_INTEGRATION_TESTS") != "1":
+    pytest.skip("needs GAS_INTEGRATION_TESTS=1", allow_module_level=True)
+pytest.importorskip("pymysql")
+pytest.importorskip("boto3")
+
+import dbconn as dbc
+from benchmark import genome as gn
+from benchmark import vcfgen as vg
+from test_pipeline import MODES, RUN_REPORTS, annotate, assert_same_output
+
+pytestmark = pytest.mark.integration
+
+LINES = 2000
+UNSORTED = 0.9
+
+# The cache's hit counts differ between a cold and a warm run
+REPORTS = RUN_REPORTS + ("## Variant cache",)
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("inputs"))
+    if os.environ.get("GAS_INTEGRATION_VCF"):
+        return {"sorted": os.environ["GAS_INTEGRATION_VCF"]}
+    genome = gn.Genome(scale=1.0, chroms=["21", "22"])
+    paths = {}
+    for kind, sortedness in (("sorted", 1.0), ("unsorted", UNSORTED)):
+        paths[kind] = os.path.join(root, kind + ".vcf")
+        vg.generate(paths[kind], LINES, genome, sortedness=sortedness, seed=1)
+    return paths
+
+
+@pytest.fixture(scope="module")
+def legacy(inputs, tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("legacy"))
+    outputs = {}
+    for kind, infile in inputs.items():
+        outputs[kind] = annotate(os.path.join(root, kind), infile, legacy=True)
+    yield outputs
+    dbc.close_shared()
+
+
+@pytest.mark.parametrize(
+    "name, kind, options", MODES, ids=[mode[0] for mode in MODES]
+)
+def test_mysql_mode_matches_legacy(name, kind, options, inputs, legacy, tmp_path):
+    if kind not in inputs:
+        pytest.skip("no unsorted input")
+    output = annotate(str(tmp_path), inputs[kind], **options)
+    assert_same_output(name, output, legacy[kind])
+
+
+@pytest.mark.parametrize(
+    "name, kind, options", MODES, ids=[mode[0] for mode in MODES]
+)
+def test_replica_mode_matches_legacy(name, kind, options, inputs, legacy, tmp_path):
+    replica = os.environ.get("GAS_INTEGRATION_REPLICA")
+    if not replica:
+        pytest.skip("needs GAS_INTEGRATION_REPLICA")
+    if kind not in inputs:
+        pytest.skip("no unsorted input")
+    output = annotate(str(tmp_path), inputs[kind], reference_db=replica, **options)
+    assert_same_output(name, output, legacy[kind])
+
+
+"""A cold and then a warm variant cache give the legacy output
+"""
+
+
+def test_mysql_cache_matches_legacy(inputs, legacy, tmp_path):
+    options = {
+        "cache_path": str(tmp_path / "cache.db"),
+        "reference_version": "test",
+        "batch_size": 100,
+    }
+    for run in ("cold", "warm"):
+        workdir = str(tmp_path / run)
+        output = annotate(workdir, inputs["sorted"], REPORTS, **options)
+        assert output == legacy["sorted"]
+
+
+### EOF
@@ -0,0 +1,244 @@
+# test_pipeline.py
+#
+# End-to-end equivalence of the streaming pipeline and the legacy one
+#
+# A small synthetic genome (see benchmark/) is built once into a SQLite
+# replica, a snapshot and a Bloom filter, and a synthetic VCF over it, in
+# coordinate order and partly shuffled, is annotated by the legacy pipeline
+# on the replica. Every streaming mode on the replica must then write the
+# same .annot.vcf and the same .count.log, apart from the lines reporting
+# its own timings. Nothing here needs pymysql, boto3 or a database server;
+# the same modes are compared on MySQL itself by test_mysql.py.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import shutil
+
+import pytest
+
+import driver
+import extsort as es
+from benchmark import genome as gn
+from benchmark import reference as rf
+from benchmark import vcfgen as vg
+
+SCALE = 0.05
+CHROMS = ["21", "22"]
+LINES = 600
+
+# Share of the records of the "unsorted" input left in place
+UNSORTED = 0.9
+
+# Tables served from memory or by sweep join in the index and sweep modes
+TABLES = (
+    "bigRefGene",
+    "refGene",
+    "cpgIslandExt",
+    "cytoBand",
+    "gadAll",
+    "targetScanS",
+    "hugo",
+    "dgv_Cnv",
+    "abParts_IG_T_CelReceptors",
+    "mcCarroll_Cnv",
+    "conrad_Cnv",
+    "genomicSuperDups",
+    "tfbsConsSites",
+)
+
+# .count.log lines that differ between runs of the same job
+RUN_REPORTS = ("variants/s",)
+
+# Mode name, input ("sorted" or "unsorted") and the driver.RunOptions of
+# the streaming runs
+MODES = [
+    ("query", "sorted", {}),
+    ("batch", "sorted", {"batch_size": 100}),
+    ("index", "sorted", {"indexed_tables": TABLES, "batch_size": 50}),
+    ("sweep", "sorted", {"sweep_tables": TABLES, "batch_size": 7}),
+    ("threads", "sorted", {"stage_workers": 3, "batch_size": 20}),
+    ("chunked", "sorted", {"workers": 3, "min_chunk": 4096, "batch_size": 64}),
+    ("sort", "unsorted", {"sort_input": True, "sort_memory": 16384}),
+    (
+        "keep-order",
+        "unsorted",
+        {"sort_input": True, "keep_order": True, "sort_memory": 16384},
+    ),
+]
+
+
+"""The synthetic reference and the sorted and unsorted inputs over it
+"""
+
+
+@pytest.fixture(scope="module")
+def reference(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("reference"))
+    genome = gn.Genome(scale=SCALE, chroms=CHROMS)
+    snapshot_root, bloom_root, replica = rf.build(root, genome)
+    inputs = {}
+    for kind, sortedness in (("sorted", 1.0), ("unsorted", UNSORTED)):
+        path = os.path.join(root, kind + ".vcf")
+        vg.generate(path, LINES, genome, sortedness=sortedness, seed=genome.seed)
+        inputs[kind] = path
+    inputs["lowercase"] = lowercase_alleles(inputs["sorted"], root)
+    return {"snapshot": snapshot_root, "replica": replica, "inputs": inputs}
+
+
+"""Copy of a VCF with the REF and ALT of every other record in lower case,
+as soft-masked alleles are written
+"""
+
+
+def lowercase_alleles(infile, root):
+    path = os.path.join(root, "lowercase.vcf")
+    with open(infile) as fh_in, open(path, "w") as fh_out:
+        for i, line in enumerate(fh_in):
+            fields = line.split("\t")
+            if not line.startswith("#") and i % 2 == 0:
+                fields[3] = fields[3].lower()
+                fields[4] = fields[4].lower()
+            fh_out.write("\t".join(fields))
+    return path
+
+
+"""Output and log of the legacy pipeline over each input
+"""
+
+
+@pytest.fixture(scope="module")
+def legacy(reference, tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("legacy"))
+    outputs = {}
+    for kind, infile in reference["inputs"].items():
+        outputs[kind] = annotate(
+            os.path.join(root, kind),
+            infile,
+            legacy=True,
+            reference_db=reference["replica"],
+        )
+    return outputs
+
+
+def annotate(workdir, infile, reports=RUN_REPORTS, **options):
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, "input.vcf")
+    shutil.copy(infile, path)
+    driver.run(path, "vcf", driver.RunOptions(**options))
+    return read_output(path, reports)
+
+
+"""Lines of the .annot.vcf and the .count.log of a job, the log without the
+lines reporting on the run itself
+"""
+
+
+def read_output(path, reports=RUN_REPORTS):
+    with open(driver.annotated_name(path)) as fh:
+        annotated = fh.read().splitlines()
+    with open(path + ".count.log") as fh:
+        log = [
+            line
+            for line in fh.read().splitlines()
+            if not any([report in line for report in reports])
+        ]
+    return annotated, log
+
+
+def split_header(lines):
+    header = [line for line in lines if line.startswith("#")]
+    return header, [line for line in lines if not line.startswith("#")]
+
+
+def test_legacy_annotates(legacy):
+    annotated, log = legacy["sorted"]
+    header, data = split_header(annotated)
+    assert len(data) == LINES
+    assert any([";DB" in line for line in data])
+    assert any(["exon=" in line for line in data])
+    assert len(log) > 0
+
+
+@pytest.mark.parametrize(
+    "name, kind, options", MODES, ids=[mode[0] for mode in MODES]
+)
+def test_mode_matches_legacy(name, kind, options, reference, legacy, tmp_path):
+    infile = reference["inputs"][kind]
+    options = dict(options, reference_db=reference["replica"])
+    assert_same_output(name, annotate(str(tmp_path), infile, **options), legacy[kind])
+
+
+def assert_same_output(name, output, expected):
+    annotated, log = output
+    expected, expected_log = expected
+    if name == "sort":
+        # Without keep_order, the lines come out in coordinate order
+        header, data = split_header(annotated)
+        expected_header, expected_data = split_header(expected)
+        assert es.is_sorted(data)
+        assert header == expected_header
+        assert sorted(data) == sorted(expected_data)
+    else:
+        assert annotated == expected
+    assert log == expected_log
+
+
+"""Alleles match the reference whatever their case, as MySQL compares them
+"""
+
+
+@pytest.mark.parametrize("name", ["query", "index", "sweep"])
+def test_lowercase_alleles_match_legacy(name, reference, legacy, tmp_path):
+    options = dict([mode[::2] for mode in MODES])[name]
+    options = dict(options, reference_db=reference["replica"])
+    output = annotate(str(tmp_path), reference["inputs"]["lowercase"], **options)
+    assert output == legacy["lowercase"]
+
+    # The lower-case records find the same dbSNP and bigRefGene rows as when
+    # they were upper-case
+    header, data = split_header(output[0])
+    header, upper = split_header(legacy["sorted"][0])
+    for line, expected in zip(data, upper):
+        assert line.split("\t")[2] == expected.split("\t")[2]
+        assert line.split("\t")[7] == expected.split("\t")[7]
+
+
+"""A checkpointed job gives the same output, and run again once it is
+complete leaves it as it is
+"""
+
+
+def test_checkpoint_matches_legacy(reference, legacy, tmp_path, capsys):
+    options = {
+        "reference_db": reference["replica"],
+        "checkpoint": True,
+        "checkpoint_bytes": 8192,
+        "workers": 2,
+        "min_chunk": 4096,
+    }
+    workdir = str(tmp_path)
+    assert annotate(workdir, reference["inputs"]["sorted"], **options) == (
+        legacy["sorted"]
+    )
+    capsys.readouterr()
+    path = os.path.join(workdir, "input.vcf")
+    driver.run(path, "vcf", driver.RunOptions(**options))
+    assert "nothing to annotate" in capsys.readouterr().out
+    assert read_output(path) == legacy["sorted"]
+
+
+def test_snapshot_matches_legacy(reference, legacy, tmp_path):
+    options = {
+        "snapshot_dir": reference["snapshot"],
+        "indexed_tables": TABLES,
+        "batch_size": 100,
+    }
+    output = annotate(str(tmp_path), reference["inputs"]["sorted"], **options)
+    assert output == legacy["sorted"]
+
+
+### EOF
@@ -0,0 +1,73 @@
+# test_profiles.py
+#
+# Checks that the annotation profiles the web app offers are the ones the
+# annotator defines
+#
+# The web app and the annotator are deployed apart, so web/config.py keeps
+# its own copy of the profile names from annotator_config.ini; this fails as
+# soon as the two lists differ.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import ast
+import os
+from configparser import ConfigParser, ExtendedInterpolation
+
+import driver
+
+ANN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEB_CONFIG = os.path.join(os.path.dirname(ANN_DIR), "web", "config.py")
+
+
+"""The annotator's configuration, read as run.py reads it
+"""
+
+
+def annotator_config():
+    config = ConfigParser(interpolation=ExtendedInterpolation())
+    config.read(os.path.join(ANN_DIR, "annotator_config.ini"))
+    return config
+
+
+"""Values of the literal list settings of web/config.py's Config class,
+read without importing it (it needs boto3 and the launch environment)
+"""
+
+
+def web_settings():
+    with open(WEB_CONFIG) as fh:
+        tree = ast.parse(fh.read())
+    settings = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "Config":
+            for statement in node.body:
+                if isinstance(statement, ast.Assign) and isinstance(
+                    statement.value, ast.List
+                ):
+                    for target in statement.targets:
+                        settings[target.id] = ast.literal_eval(statement.value)
+    return settings
+
+
+def test_web_offers_the_annotator_profiles():
+    config = annotator_config()
+    profiles = [p for p in config["profiles"] if p not in config.defaults()]
+    free = [p.strip() for p in config["ann"]["FreeUserProfiles"].split(",")]
+    settings = web_settings()
+    assert settings["ANNOTATION_PROFILES"] == profiles
+    assert settings["FREE_USER_PROFILES"] == free
+    assert config["ann"]["DefaultProfile"].strip() in profiles
+
+
+def test_profiles_name_known_stages():
+    config = annotator_config()
+    for profile in config["profiles"]:
+        if profile not in config.defaults():
+            names = [n.strip() for n in config["profiles"][profile].split(",")]
+            assert len(driver.select_stages(names)) > 0
+
+
+### EOF
@@ -0,0 +1,87 @@
+# test_refdb.py
+#
+# Tests of the row order and query shapes of the reference backends in
+# refdb.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import refdb as rd
+
+# Overlapping islands, neither in start order nor grouped by chromosome
+ISLANDS = [
+    ("chr1", 50, 90, "c"),
+    ("chr2", 10, 20, "x"),
+    ("chr1", 10, 80, "a"),
+    ("chr1", 60, 70, "d"),
+    ("chr2", 5, 15, "y"),
+    ("chr1", 40, 100, "b"),
+]
+
+
+"""A database with the islands in insertion (table-scan) order, and a
+replica copied from it
+"""
+
+
+def copied_replica(tmp_path):
+    source = str(tmp_path / "source.db")
+    conn = rd.SqliteConnection(source, readonly=False)
+    cursor = conn.cursor()
+    cursor.execute(
+        "create table cpgIslandExt (chrom text, chromStart integer, "
+        + "chromEnd integer, name text)"
+    )
+    for row in ISLANDS:
+        cursor.execute("insert into cpgIslandExt values (?, ?, ?, ?)", row)
+    conn.commit()
+    conn.close()
+
+    path = str(tmp_path / "replica.db")
+    rd.copy_database(
+        path, ["cpgIslandExt"], lambda: rd.SqliteConnection(source, readonly=False)
+    )
+    return rd.SqliteBackend(path)
+
+
+def test_copy_keeps_scan_order(tmp_path):
+    backend = copied_replica(tmp_path)
+    cursor = backend.cursor()
+    cursor.execute("select * from cpgIslandExt order by rowid;")
+    assert [tuple(row) for row in cursor.fetchall()] == ISLANDS
+
+    table = backend.table("cpgIslandExt")
+    names = [row[3] for row in table.stab("chr1", 65)]
+    assert names == ["c", "a", "d", "b"]
+    assert table.first("chr1", 65)[3] == "c"
+    assert [row[3] for row in table.stab("chr1", 30, 15)] == ["a", "b"]
+    rows = list(table.rows_by_start("chr1"))
+    assert [(seq, row[3]) for seq, row in rows] == [
+        (2, "a"), (4, "b"), (1, "c"), (3, "d")
+    ]
+
+
+def test_mysql_queries_have_the_legacy_shape():
+    backend = rd.MySqlBackend()
+    sql, args = backend.stab_sql(backend.table("dbSNP"), "dbSNP", "1", 100, 0)
+    assert sql == "select * from dbSNP where CHR = %s AND POS = %s;"
+    assert args == ("1", 100)
+
+    refGene = backend.table("refGene")
+    sql, args = backend.stab_sql(refGene, "refGene", "chr1", 100, 500)
+    assert sql == (
+        "select * from refGene where chrom = %s AND (txStart - %s) <= %s"
+        + " AND %s <= (txEnd + %s);"
+    )
+    assert args == ("chr1", 500, 100, 100, 500)
+
+    sql, args = backend.stab_sql(refGene, "refGene", "chr1", 100, 0)
+    assert sql == (
+        "select * from refGene where chrom = %s AND txStart <= %s AND %s <= txEnd;"
+    )
+    assert args == ("chr1", 100, 100)
+
+
+### EOF
@@ -0,0 +1,74 @@
+# test_snapshot.py
+#
+# Tests of the snapshot table files written and mapped by snapshot.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import refdb as rd
+import snapshot as sn
+
+# Overlapping ranges out of start order, with a column of mixed kinds and a
+# row without coordinates
+RANGES = [
+    ("chr1", 50, 90, "c", 1.5),
+    ("chr2", 10, 20, "x", None),
+    ("chr1", 10, 80, "a", "text"),
+    ("chr1", None, 70, "skipped", None),
+    ("chr1", 60, 70, "dé", 2),
+    ("chr1", 40, 100, "b", b"\x00\xff"),
+]
+
+
+"""A table of RANGES dumped into a snapshot file and mapped
+"""
+
+
+def dumped_table(tmp_path):
+    source = rd.SqliteConnection(str(tmp_path / "source.db"), readonly=False)
+    cursor = source.cursor()
+    cursor.execute(
+        "create table ranges (chrom text, chromStart integer, chromEnd integer, "
+        + "name text, score)"
+    )
+    for row in RANGES:
+        cursor.execute("insert into ranges values (?, ?, ?, ?, ?)", row)
+    source.commit()
+
+    path = str(tmp_path / "ranges.snap")
+    writer = sn.TableWriter(path, "ranges", [])
+    sn.dump_table(source, writer, "ranges", "chrom", "chromStart", "chromEnd", "*")
+    writer.close()
+    source.close()
+    return sn.SnapshotTable(path)
+
+
+def test_rows_come_back_whole_in_scan_order(tmp_path):
+    table = dumped_table(tmp_path)
+    rows = [row for row in RANGES if row[1] is not None]
+    assert table.stab("chr1", 65) == [rows[0], rows[2], rows[3], rows[4]]
+    assert table.first("chr1", 45) == rows[2]
+    assert table.stab("chr1", 30, 15) == [rows[2], rows[4]]
+    assert table.stab("chr2", 15) == [rows[1]]
+    assert table.stab("chr3", 15) == []
+    assert table.chromosomes() == ["chr1", "chr2"]
+    assert table.column("name") == 3
+
+
+def test_columns_are_stored_by_kind(tmp_path):
+    table = dumped_table(tmp_path)
+    kinds = [column["kind"] for column in table.blocks["chr1"]["columns"]]
+    assert kinds == ["str", "int", "int", "str", "cell"]
+    kinds = [column["kind"] for column in table.blocks["chr2"]["columns"]]
+    assert kinds == ["str", "int", "int", "str", "cell"]
+
+
+def test_rows_are_fetched_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(sn, "FETCH_ROWS", 2)
+    table = dumped_table(tmp_path)
+    assert len(table.stab("chr1", 65)) == 4
+
+
+### EOF
@@ -0,0 +1,132 @@
+# test_sweep.py
+#
+# Tests of the sort-merge sweep join in sweep.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import random
+
+import sweep as sw
+
+
+"""In-memory table with the rows_by_start() and column() of a
+refdb.ReferenceTable; rows are numbered in the order they were given, as a
+table scan would number them
+"""
+
+
+class RowTable(object):
+    def __init__(self, rows, names=("chrom", "chromStart", "chromEnd", "name")):
+        self.names = list(names)
+        self.data = rows
+        self.loads = []
+
+    def column(self, name):
+        return self.names.index(name)
+
+    def rows_by_start(self, chrom):
+        self.loads.append(chrom)
+        rows = [(seq + 1, row) for seq, row in enumerate(self.data)]
+        rows = [(seq, row) for seq, row in rows if row[0] == chrom]
+        return iter(sorted(rows, key=lambda r: r[1][1]))
+
+
+def per_variant(table, chrom, pos):
+    return [row for row in table.data if row[0] == chrom and row[1] <= pos <= row[2]]
+
+
+def test_sweep_join_matches_per_variant_lookups():
+    rng = random.Random(7)
+    rows = []
+    for i in range(400):
+        start = rng.randint(0, 5000)
+        rows.append(
+            (rng.choice(["chr1", "chr2"]), start, start + rng.randint(0, 300), i)
+        )
+    table = RowTable(rows)
+    join = sw.SweepJoin(table)
+    for chrom in ("chr1", "chr2"):
+        for pos in sorted([rng.randint(0, 5400) for i in range(300)]):
+            assert join.advance(chrom, pos)
+            assert join.stab(pos) == per_variant(table, chrom, pos)
+    assert table.loads == ["chr1", "chr2"]
+    assert join.scans == 2
+
+
+def test_sweep_join_custom_columns():
+    table = RowTable(
+        [("1", 100, 100, "a"), ("1", 100, 100, "b"), ("1", 200, 200, "c")],
+        names=("CHR", "start", "end", "name"),
+    )
+    join = sw.SweepJoin(table, "start", "end")
+    assert join.advance("1", 100)
+    assert join.stab(100) == [table.data[0], table.data[1]]
+    assert join.advance("1", 150)
+    assert join.stab(150) == []
+    assert join.advance("1", 200)
+    assert join.stab(200) == [table.data[2]]
+
+
+"""Hits of overlapping intervals come back in scan order, not start order
+"""
+
+
+def test_sweep_join_keeps_scan_order():
+    table = RowTable([("chr1", 50, 100, "late"), ("chr1", 10, 100, "early")])
+    join = sw.SweepJoin(table)
+    assert join.advance("chr1", 60)
+    assert join.stab(60) == [table.data[0], table.data[1]]
+
+
+"""RowTable recording the rows streamed out of it
+"""
+
+
+class CountingTable(RowTable):
+    def __init__(self, rows):
+        RowTable.__init__(self, rows)
+        self.read = []
+
+    def rows_by_start(self, chrom):
+        for seq, row in RowTable.rows_by_start(self, chrom):
+            self.read.append(seq)
+            yield seq, row
+
+
+"""Rows are read from the stream only as far as the position swept to
+"""
+
+
+def test_sweep_join_reads_rows_lazily():
+    table = CountingTable([("chr1", s, s + 5, "") for s in range(0, 100, 10)])
+    join = sw.SweepJoin(table)
+    assert join.advance("chr1", 22)
+    assert join.stab(22) == [table.data[2]]
+    assert table.read == [1, 2, 3, 4]
+    assert join.advance("chr1", 23)
+    assert join.stab(23) == [table.data[2]]
+    assert table.read == [1, 2, 3, 4]
+
+
+def test_sweep_join_rejects_unsorted_input():
+    table = RowTable([("chr1", 10, 20, "a"), ("chr2", 10, 20, "b")])
+    join = sw.SweepJoin(table)
+    assert join.advance("chr1", 15)
+    assert not join.advance("chr1", 14)
+
+    join = sw.SweepJoin(table)
+    assert join.advance("chr1", 15)
+    assert join.advance("chr2", 15)
+    assert not join.advance("chr1", 16)
+
+
+def test_sweep_join_chromosome_without_rows():
+    join = sw.SweepJoin(RowTable([("chr1", 10, 20, "a")]))
+    assert join.advance("chrX", 15)
+    assert join.stab(15) == []
+
+
+### EOF
@@ -0,0 +1,83 @@
+# test_varcache.py
+#
+# Tests of the host-wide cache of reference lookups in varcache.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import decimal
+import sqlite3
+
+import varcache as vc
+
+
+ROWS = [
+    ("21", 9411245, "rs1", "C", "A", decimal.Decimal("0.25"), None),
+    ("21", 9411245, "rs2", "C", "T", decimal.Decimal("0.5"), b"raw"),
+]
+
+
+def test_rows_survive_a_reopen(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = vc.VariantCache(path, "1")
+    key = cache.key("dbSNP", "21", 9411245, "C")
+    assert cache.get(key) is None
+    cache.put(key, ROWS)
+    cache.put(cache.key("dbSNP", "21", 1, "A"), [])
+    # New entries are served before they are written
+    assert cache.get(key) == ROWS
+    cache.close()
+
+    cache = vc.VariantCache(path, "1")
+    assert cache.get(key) == ROWS
+    assert cache.get(cache.key("dbSNP", "21", 1, "A")) == []
+    assert cache.get(cache.key("dbSNP", "21", 1, "G")) is None
+    cache.close()
+
+
+def test_other_versions_are_misses_and_purged(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = vc.VariantCache(path, "1")
+    key = cache.key("dbSNP", "21", 9411245, "C")
+    cache.put(key, ROWS)
+    cache.close()
+
+    cache = vc.VariantCache(path, "2")
+    assert cache.get(key) is None
+    cache.close()
+    assert cache_count(path) == 0
+
+
+"""Least recently used entries are evicted down to max_entries
+"""
+
+
+def test_eviction_keeps_the_recently_used(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = vc.VariantCache(path, "1", max_entries=2)
+    keys = [cache.key("hugo", "chr1", pos) for pos in (1, 2, 3)]
+    cache.put(keys[0], [("a",)])
+    cache.close()
+
+    cache = vc.VariantCache(path, "1", max_entries=2)
+    cache.put(keys[1], [("b",)])
+    cache.put(keys[2], [("c",)])
+    cache.close()
+    assert cache_count(path) == 2
+
+    cache = vc.VariantCache(path, "1", max_entries=2)
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == [("c",)]
+    cache.close()
+
+
+def cache_count(path):
+    conn = sqlite3.connect(path)
+    count = conn.execute("select count(*) from entries;").fetchone()[0]
+    conn.close()
+    return count
+
+
+### EOF
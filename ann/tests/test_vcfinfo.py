@@ -0,0 +1,90 @@
+# test_vcfinfo.py
+#
+# Tests of the INFO column builder in vcfinfo.py
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import vcfinfo as vi
+
+
+def test_append_builds_the_concatenated_text():
+    info = vi.InfoField("DP=10")
+    expected = "DP=10"
+    for piece in [";DB", "", ";VC=SNV;GMAF=0.1", ";positionType=intron"]:
+        info.append(piece)
+        expected = expected + piece
+        assert len(info) == len(expected)
+        assert info.tail == expected[-1:]
+    assert info.text() == expected
+    assert str(info) == expected
+
+
+def test_add_separates_records():
+    info = vi.InfoField(".")
+    info.add("cytoBand=p11")
+    assert info.text() == ".;cytoBand=p11"
+
+    info = vi.InfoField("DP=3;")
+    info.add("hugo=A")
+    assert info.text() == "DP=3;hugo=A"
+
+    info = vi.InfoField("")
+    assert info.tail == ""
+    info.add("x=1")
+    assert info.text() == ";x=1"
+
+
+def test_startswith_and_drop():
+    info = vi.InfoField(".")
+    info.append(";gene=ABC")
+    assert info.startswith(".;")
+    info.drop(2)
+    assert info.text() == "gene=ABC"
+    assert len(info) == len("gene=ABC")
+    assert info.tail == "C"
+    assert not info.startswith(".;")
+
+
+"""field() finds values the way utils.parse_field() does: the first entry
+whose key contains the key, in the text cleaned of quotes and stripped
+"""
+
+
+def test_field_lookups():
+    info = vi.InfoField("DP=10;positionType='intron';DB")
+    assert info.field("positionType") == "intron"
+    assert info.field("DP") == "10"
+    assert info.field("Type") == "intron"
+    assert info.field("missing") == "."
+
+
+def test_field_view_follows_appends():
+    info = vi.InfoField("DP=10")
+    assert info.field("positionType") == "."
+    info.append(";positionType=CDS")
+    assert info.field("positionType") == "CDS"
+    info.drop(6)
+    assert info.field("DP") == "."
+
+
+def test_split_and_join_fields():
+    line = "chr1\t100\t.\tA\tG\t50\tPASS\tDP=3\tGT\t0/1"
+    fields = vi.split_fields(line)
+    assert isinstance(fields[vi.INFO], vi.InfoField)
+    fields[vi.INFO].add("x=1")
+    assert vi.join_fields(fields) == line.replace("DP=3", "DP=3;x=1")
+    assert vi.last_char(fields[vi.INFO]) == "1"
+    assert vi.last_char(fields[0]) == "1"
+    assert vi.last_char("") == ""
+
+
+def test_short_lines_have_no_info():
+    fields = vi.split_fields("chr1\t100\t.\tA")
+    assert fields == ["chr1", "100", ".", "A"]
+    assert vi.join_fields(fields, " ") == "chr1 100 . A"
+
+
+### EOF
@@ -13,16 +13,28 @@ __author__ = "Vas Vasiliadis <vas@uchicago.edu>"
 
 
 import os
-import json
-import pymysql
-import boto3
-from botocore.exceptions import ClientError
+import credentials
+
+# Only needed to connect to MySQL; jobs reading a replica or a snapshot run
+# without them
+try:
+    import pymysql
+    from botocore.exceptions import ClientError
+except ImportError:
+    pymysql = None
 
 """Get connection to reference database
+The RDS secret comes from the credential cache; if MySQL rejects it (the
+password was rotated), the cached copy is dropped and fetched again once.
 """
 
+DB_SECRET_ID = "rds/anntools_database"
+MYSQL_ACCESS_DENIED = 1045
+
 
 def db_connect():
+    if pymysql is None:
+        raise ImportError("pymysql and boto3 are needed to connect to the database")
     AWS_REGION_NAME = (
         os.environ["AWS_REGION_NAME"]
         if ("AWS_REGION_NAME" in os.environ)
@@ -30,14 +42,23 @@ def db_connect():
     )
 
     # Get RDS secret from AWS Secrets Manager
-    asm = boto3.client("secretsmanager", region_name=AWS_REGION_NAME)
     try:
-        asm_response = asm.get_secret_value(SecretId="rds/anntools_database")
-        rds_secret = json.loads(asm_response["SecretString"])
+        rds_secret = credentials.get_secret(DB_SECRET_ID, region_name=AWS_REGION_NAME)
     except ClientError as e:
         print(f"Unable to retrieve RDS credentials from AWS Secrets Manager: {e}")
         raise e
 
+    try:
+        return connect_with(rds_secret)
+    except pymysql.err.OperationalError as e:
+        if e.args[0] != MYSQL_ACCESS_DENIED:
+            raise e
+        credentials.invalidate(DB_SECRET_ID)
+        rds_secret = credentials.get_secret(DB_SECRET_ID, region_name=AWS_REGION_NAME)
+        return connect_with(rds_secret)
+
+
+def connect_with(rds_secret):
     # Extract database connection parameters
     rds_host = rds_secret["host"]
     mysql_port = rds_secret["port"]
@@ -0,0 +1,113 @@
+# varcache.py
+#
+# Worker-local cache of reference lookups shared by every job on the host
+#
+# Samples submitted by different users overlap heavily, so the same common
+# variants are looked up in the same reference tables over and over. The
+# rows a stage gets back for a (table, chrom, pos, ref, alt) key are kept in
+# an SQLite file, stamped with the reference version that produced them;
+# entries from another version are treated as misses and purged, so loading
+# a new reference invalidates the cache. The file is capped at a number of
+# entries, evicting the least recently used.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import time
+import sqlite3
+import threading
+import snapshot as sn
+
+
+"""Rows of one lookup, stored as newline-separated snapshot-encoded rows
+"""
+
+
+def encode_rows(rows):
+    return b"\n".join([sn.encode_row(row) for row in rows])
+
+
+def decode_rows(data):
+    if len(data) == 0:
+        return []
+    return [sn.decode_row(line) for line in bytes(data).split(b"\n")]
+
+
+"""Cache of reference rows for one job
+Lookups read the file directly; new entries and last-use times are kept in
+memory and written in one transaction by close(), which also purges other
+versions and evicts down to max_entries. Safe to use from several threads,
+and several processes may share the file.
+"""
+
+
+class VariantCache(object):
+    def __init__(self, path, version, max_entries=5000000):
+        self.path = path
+        self.version = str(version)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.touched = set()
+
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("pragma journal_mode=wal;")
+        self.conn.execute(
+            "create table if not exists entries ("
+            + "key text primary key, version text, rows blob, used real);"
+        )
+        self.conn.execute("create index if not exists entries_used on entries (used);")
+        self.conn.commit()
+
+    def key(self, table, chrom, pos, ref="", alt=""):
+        return "\t".join([str(table), str(chrom), str(pos), str(ref), str(alt)])
+
+    def get(self, key):
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            found = self.conn.execute(
+                "select version, rows from entries where key = ?;", (key,)
+            ).fetchone()
+            if found is None or found[0] != self.version:
+                return None
+            self.touched.add(key)
+        return decode_rows(found[1])
+
+    def put(self, key, rows):
+        with self.lock:
+            self.pending[key] = list(rows)
+
+    def close(self):
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "delete from entries where version != ?;", (self.version,)
+                )
+                self.conn.executemany(
+                    "insert or replace into entries values (?, ?, ?, ?);",
+                    [
+                        (key, self.version, encode_rows(rows), now)
+                        for key, rows in self.pending.items()
+                    ],
+                )
+                self.conn.executemany(
+                    "update entries set used = ? where key = ?;",
+                    [(now, key) for key in self.touched],
+                )
+                count = self.conn.execute("select count(*) from entries;").fetchone()[0]
+                if count > self.max_entries:
+                    self.conn.execute(
+                        "delete from entries where key in (select key from entries "
+                        + "order by used limit ?);",
+                        (count - self.max_entries,),
+                    )
+            self.conn.close()
+            self.pending = {}
+            self.touched = set()
+
+
+### EOF
@@ -0,0 +1,94 @@
+# vcfblock.py
+#
+# Parse-once records for blocks of VCF data lines
+#
+# Every stage used to strip and split the line it was given, add or drop
+# the "chr" prefix of the chromosome, clean and strip the alleles and look
+# up their complements, all over again. A VariantRecord is the split line
+# the stages work on, as before, carrying those columns parsed once when
+# the block is read: both spellings of the chromosome, the position as text
+# and as an int, the cleaned alleles and their complements. No stage
+# changes these columns, so the parsed values stay valid as the record goes
+# through every stage; INFO is a vcfinfo.InfoField the stages append to.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import annotate as ann
+import vcfinfo as vi
+
+
+"""Split fields of one data line, with its parsed columns:
+    chrom     - CHROM stripped, with a "chr" prefix (refGene, cytoBand, ...)
+    bare      - CHROM stripped, without its "chr" prefix (dbSNP, bigRefGene)
+    pos       - POS stripped, as the stages put it in queries
+    position  - POS as an int, None if it is not a number
+    ref, alt  - alleles cleaned of quotes and stripped
+    comp_ref, comp_alt - complementary base of single-base alleles, or ""
+Columns a short line lacks are None.
+"""
+
+
+class VariantRecord(list):
+    __slots__ = (
+        "chrom",
+        "bare",
+        "pos",
+        "position",
+        "ref",
+        "alt",
+        "comp_ref",
+        "comp_alt",
+    )
+
+    def parse(self, inds):
+        size = len(self)
+        chrom = self[inds[0]].strip() if size > inds[0] else None
+        self.chrom = self.bare = chrom
+        if chrom is not None:
+            if chrom.startswith("chr"):
+                self.bare = chrom.replace("chr", "")
+            else:
+                self.chrom = "chr" + chrom
+
+        self.pos = self[inds[1]].strip() if size > inds[1] else None
+        try:
+            self.position = int(self.pos)
+        except (TypeError, ValueError):
+            self.position = None
+
+        self.ref = self.comp_ref = self.alt = self.comp_alt = None
+        if size > inds[2]:
+            self.ref = ann.clean_mysql_chars(self[inds[2]]).strip()
+            self.comp_ref = ann.getComplementary(self.ref)
+        if size > inds[3]:
+            self.alt = ann.clean_mysql_chars(self[inds[3]]).strip()
+            self.comp_alt = ann.getComplementary(self.alt)
+        return self
+
+    """The same variant over its line split again (see driver.restrip())
+    """
+
+    def resplit(self, line, sep="\t"):
+        record = VariantRecord(vi.split_fields(line, sep))
+        for name in VariantRecord.__slots__:
+            setattr(record, name, getattr(self, name))
+        return record
+
+
+def parse_record(line, inds):
+    return VariantRecord(vi.split_fields(line)).parse(inds)
+
+
+"""Parse stripped data lines into a list of VariantRecords
+"""
+
+
+def parse_block(lines, format="vcf"):
+    inds = ann.getFormatSpecificIndices(format=format)
+    return [parse_record(line, inds) for line in lines]
+
+
+### EOF
@@ -0,0 +1,132 @@
+# vcfinfo.py
+#
+# The INFO column of a record, as the streaming stages build it up
+#
+# Every stage used to append its annotations to the INFO string with "+",
+# copying the whole column each time, and GenesStage re-parsed it once per
+# transcript row. An InfoField collects the appended text in a list and
+# joins it only when the record is written (or a legacy fix-up needs the
+# full text), and answers field lookups from a view of the column parsed
+# once. The text it builds is exactly the string the stages built before,
+# fix-ups and all.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+# Column of INFO in the split fields of a VCF record
+INFO = 7
+
+
+"""INFO text of one record, appended to in pieces
+tail is the last character of the text ("" while it is empty); view holds
+the results of field(), dropped whenever the text changes.
+"""
+
+
+class InfoField(object):
+    __slots__ = ("parts", "size", "tail", "entries", "view")
+
+    def __init__(self, text):
+        self.parts = [text]
+        self.size = len(text)
+        self.tail = text[-1:]
+        self.entries = None
+        self.view = None
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return self.text()
+
+    def text(self):
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0]
+
+    def append(self, text):
+        if len(text) > 0:
+            self.parts.append(text)
+            self.size = self.size + len(text)
+            self.tail = text[-1]
+            self.entries = None
+
+    """Append a record to the INFO list, with a ";" unless it ends with one
+    """
+
+    def add(self, text):
+        if self.tail == ";":
+            self.append(text)
+        else:
+            self.append(";" + text)
+
+    def startswith(self, prefix):
+        if len(self.parts[0]) < len(prefix):
+            self.text()
+        return self.parts[0].startswith(prefix)
+
+    """Drop the first n characters of the text
+    """
+
+    def drop(self, n):
+        text = self.text()[n:]
+        self.parts = [text]
+        self.size = len(text)
+        self.tail = text[-1:]
+        self.entries = None
+
+    """Value of the first INFO entry whose key contains key, "." if none,
+    as utils.parse_field() finds it in the text cleaned of quotes and
+    stripped; entries are split once and each key looked up once
+    """
+
+    def field(self, key):
+        if self.entries is None:
+            text = self.text().replace('"', "").replace("'", "").strip()
+            self.entries = [entry.split("=") for entry in text.split(";")]
+            self.view = {}
+        if key not in self.view:
+            value = "."
+            for pairs in self.entries:
+                if str(pairs[0]).find(str(key)) > -1:
+                    value = str(pairs[1])
+                    break
+            self.view[key] = value
+        return self.view[key]
+
+
+"""Split a data line, with its INFO column as an InfoField
+"""
+
+
+def split_fields(line, sep="\t"):
+    fields = line.split(sep)
+    if len(fields) > INFO:
+        fields[INFO] = InfoField(fields[INFO])
+    return fields
+
+
+"""Join split fields back into a data line
+"""
+
+
+def join_fields(fields, sep="\t"):
+    if len(fields) > INFO and isinstance(fields[INFO], InfoField):
+        info = [fields[INFO].text()]
+        return sep.join(fields[:INFO] + info + fields[INFO + 1 :])
+    return sep.join(fields)
+
+
+"""Last character of a column, "" if it is empty
+"""
+
+
+def last_char(column):
+    if isinstance(column, InfoField):
+        return column.tail
+    return column[-1:]
+
+
+### EOF
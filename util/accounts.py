@@ -0,0 +1,81 @@
+# accounts.py
+#
+# User profile lookups for the utility scripts
+#
+# Same query as helpers.get_user_profile (which must not be modified), but
+# the accounts database secret comes from the credential cache instead of a
+# Secrets Manager call per lookup. The scripts look a profile up for every
+# queue message, so this removes one network round trip from each.
+#
+# Adapted for use in Genomic Annotator Service, built by Eshan Prashar, as a part of
+# graduate coursework at the University of Chicago
+##
+__author__ = "Eshan Prashar <eshanprashar@uchicago.edu>"
+
+import os
+import psycopg2
+import psycopg2.extras
+
+import credentials
+
+# Get util configuration
+from configparser import ConfigParser, ExtendedInterpolation
+
+config = ConfigParser(os.environ, interpolation=ExtendedInterpolation())
+config.read(os.path.join(os.path.abspath(os.path.dirname(__file__)), "util_config.ini"))
+
+credentials.configure(
+    ttl=config.getfloat("secrets", "Ttl"),
+    refresh_ahead=config.getfloat("secrets", "RefreshAhead"),
+    cache_dir=config["secrets"]["CacheDir"].strip(),
+)
+
+ACCOUNTS_SECRET_ID = "rds/accounts_database"
+
+"""Access user profile in accounts database
+If the connection is refused, the cached credentials are dropped and fetched
+again once, in case the password was rotated. psycopg2 gives errors raised
+while connecting no SQLSTATE, so a rejected password cannot be told apart
+from other connection failures; those simply fail again.
+"""
+
+
+def get_user_profile(id=None, db_name=None):
+    try:
+        connection = connect(db_name)
+    except psycopg2.OperationalError:
+        credentials.invalidate(ACCOUNTS_SECRET_ID)
+        connection = connect(db_name)
+
+    try:
+        # Query the database and get the user's profile record
+        cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute("SELECT * FROM profiles WHERE identity_id = %s", (id,))
+        profile = cursor.fetchall()[0]
+    finally:
+        connection.close()
+
+    # Return user profile record as a dict
+    return profile
+
+
+def connect(db_name=None):
+    rds_secret = credentials.get_secret(
+        ACCOUNTS_SECRET_ID, region_name=config["aws"]["AwsRegionName"]
+    )
+    db_uri = (
+        "postgresql://"
+        + rds_secret["username"]
+        + ":"
+        + rds_secret["password"]
+        + "@"
+        + rds_secret["host"]
+        + ":"
+        + str(rds_secret["port"])
+        + "/"
+        + (db_name if db_name else config["gas"]["AccountsDatabase"])
+    )
+    return psycopg2.connect(db_uri)
+
+
+### EOF
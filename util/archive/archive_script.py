@@ -19,7 +19,7 @@ from botocore.client import Config
 
 # Import utility helpers
 sys.path.insert(1, os.path.realpath(os.path.pardir))
-import helpers
+import accounts
 
 # Get configuration
 from configparser import ConfigParser, ExtendedInterpolation
@@ -52,7 +52,7 @@ def handle_archive_queue(s3, dynamo_table, glacier, sqs):
         results_file = sns_parameters['s3_key_result_file']
 
         # Check if user_id is still free 
-        user_profile = helpers.get_user_profile(id=user_id)
+        user_profile = accounts.get_user_profile(id=user_id)
         user_role = user_profile.get('role')
 
         print(f"User is a {user_role}...Processing that information")
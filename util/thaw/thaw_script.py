@@ -17,7 +17,7 @@ from botocore.exceptions import ClientError
 
 # Import utility helpers
 sys.path.insert(1, os.path.realpath(os.path.pardir))
-import helpers
+import accounts
 
 # Get configuration
 from configparser import ConfigParser, ExtendedInterpolation
@@ -49,7 +49,7 @@ def handle_thaw_queue(glacier, sqs):
         #bucket = sns_parameters['results_bucket']
 
         # Although this shouldn't change, check if user is still premium just to confirm
-        user_profile = helpers.get_user_profile(id=user_id)
+        user_profile = accounts.get_user_profile(id=user_id)
         user_role = user_profile.get('role')
 
         print(f"User is a {user_role}...initiating the restoring process")
@@ -181,6 +181,12 @@ class Config(object):
     FREE_USER = "free_user"
     PREMIUM_USER = "premium_user"
 
+    # Annotation profiles offered on the upload form, and those free users
+    # may pick; a copy of the annotator's annotator_config.ini [profiles],
+    # which ann/tests/test_profiles.py checks they match
+    ANNOTATION_PROFILES = ["minimal", "clinical", "full"]
+    FREE_USER_PROFILES = ["minimal", "clinical"]
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
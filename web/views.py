@@ -42,11 +42,12 @@ def annotate():
     user_id = session["primary_identity"]
 
     # Generate unique ID to be used as S3 key (name)
+    job_id = str(uuid.uuid4())
     key_name = (
         app.config["AWS_S3_KEY_PREFIX"]
         + user_id
         + "/"
-        + str(uuid.uuid4())
+        + job_id
         + "~${filename}"
     )
 
@@ -82,9 +83,41 @@ def annotate():
         app.logger.error(f"Unable to generate presigned URL for upload: {e}")
         return abort(500)
 
+    # Optional side files of the job (a BED of target regions, a tabix
+    # index of the input) are posted by the form's script before the VCF,
+    # under the same job ID, as targets.bed and index.tbi
+    side_fields = {
+        "success_action_status": "204",
+        "x-amz-server-side-encryption": encryption,
+        "acl": acl,
+    }
+    side_conditions = [
+        {"success_action_status": "204"},
+        {"x-amz-server-side-encryption": encryption},
+        {"acl": acl},
+    ]
+    try:
+        side_post = s3.generate_presigned_post(
+            Bucket=bucket_name,
+            Key=key_name,
+            Fields=side_fields,
+            Conditions=side_conditions,
+            ExpiresIn=app.config["AWS_SIGNED_REQUEST_EXPIRATION"],
+        )
+    except ClientError as e:
+        app.logger.error(f"Unable to generate presigned URL for upload: {e}")
+        return abort(500)
+
     # Render the upload form which will parse/submit the presigned POST
+    profiles = app.config["ANNOTATION_PROFILES"]
+    if session["role"] == app.config["FREE_USER"]:
+        profiles = app.config["FREE_USER_PROFILES"]
     return render_template(
-        "annotate.html", s3_post=presigned_post, role=session["role"]
+        "annotate.html",
+        s3_post=presigned_post,
+        s3_side_post=side_post,
+        profiles=profiles,
+        role=session["role"],
     )
 
 
@@ -120,6 +153,18 @@ def create_annotation_job_request():
         "job_status": "PENDING"
     }
 
+    # Side files the form uploaded along with the input
+    job_prefix = s3_key.split("~")[0]
+    if request.args.get("targets"):
+        ann_data["s3_key_targets_file"] = job_prefix + "~targets.bed"
+    if request.args.get("index"):
+        ann_data["s3_key_index_file"] = job_prefix + "~index.tbi"
+
+    # Annotation profile picked on the form (the annotator checks it again)
+    profile = request.args.get("profile")
+    if profile in app.config["ANNOTATION_PROFILES"]:
+        ann_data["profile"] = profile
+
     # Persist job to database
     dynamodb = boto3.resource('dynamodb',region_name=app.config["AWS_REGION_NAME"],config=Config(signature_version="s3v4"))
     ann_table = dynamodb.Table(app.config["AWS_DYNAMODB_ANNOTATIONS_TABLE"])